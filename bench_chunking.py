@@ -0,0 +1,112 @@
+import argparse
+import json
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from bench_retrieval import build_bench_chain, run_config
+from bm25 import load_sparse_index
+from build_vector_store import load_all_docs, sync_vector_store
+from chunking import CHUNKING_STRATEGIES
+from embeddings import load_indexing_embeddings
+from utils import preload_tables
+
+
+def chunk_stats(docs):
+    """Chunk count and size, overall and per record type."""
+    sizes = [len(doc.page_content) for doc in docs]
+    by_type = {}
+    for doc in docs:
+        by_type[doc.metadata["type"]] = by_type.get(doc.metadata["type"], 0) + 1
+    return {
+        "chunks": len(docs),
+        "chunks_by_type": by_type,
+        "total_chars": sum(sizes),
+        "mean_chars": round(sum(sizes) / len(sizes), 1) if sizes else 0,
+        "max_chars": max(sizes, default=0),
+    }
+
+
+def measure_strategy(strategy, args, gold, params):
+    """
+    Build a fresh store with `strategy` and measure it. A fresh embedding
+    cache is used so every chunk is really embedded and timed.
+    """
+    persist_dir = Path(args.output_dir) / strategy
+    shutil.rmtree(persist_dir, ignore_errors=True)
+
+    docs = load_all_docs(strategy)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        embeddings = load_indexing_embeddings(batch_size=args.batch_size, cache_dir=cache_dir)
+        vectordb, sync = sync_vector_store(docs, embeddings, str(persist_dir), args.batch_size)
+
+    sparse_index = load_sparse_index({"PERSIST_DIR": str(persist_dir)})
+    metrics, _, _ = run_config(build_bench_chain(vectordb, sparse_index, params, "retrieval"), gold)
+
+    return {
+        "chunking": strategy,
+        "persist_dir": str(persist_dir),
+        **chunk_stats(docs),
+        "embed_seconds": sync["embed_seconds"],
+        "retrieval": metrics,
+    }
+
+
+def main(args):
+    load_dotenv()
+    with open(args.gold, "r", encoding="utf-8") as f:
+        gold = json.load(f)
+    params = {"k": args.k, "top_k": args.top_k, "weight": args.weight, "budget": args.budget}
+    preload_tables("html")
+
+    results = []
+    for strategy in args.chunking:
+        print(f"Building with {strategy} chunking ...")
+        results.append(measure_strategy(strategy, args, gold, params))
+
+    print(f"\n{'chunking':>10} {'chunks':>7} {'chars':>9} {'embed s':>8} "
+          f"{'R@1':>5} {'R@3':>5} {'R@5':>5} {'MRR':>5} {'ctx tok':>8}")
+    for r in results:
+        m = r["retrieval"]
+        print(
+            f"{r['chunking']:>10} {r['chunks']:>7} {r['total_chars']:>9} {r['embed_seconds']:>8.1f} "
+            f"{m['recall@1']:>5.2f} {m['recall@3']:>5.2f} {m['recall@5']:>5.2f} "
+            f"{m['mrr']:>5.2f} {m['context_tokens']:>8.0f}"
+        )
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "gold": args.gold,
+        "params": params,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+#   python bench_chunking.py
+#
+# Builds one store per strategy under bench_chunking_db/ (the serving
+# store in chroma_db is not touched), embedding every chunk from scratch,
+# then runs the gold questions against each.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunking strategies: chunk count, embedding time, recall.")
+    parser.add_argument("--chunking", nargs="+", choices=CHUNKING_STRATEGIES, default=["fixed", "structure"])
+    parser.add_argument("--gold", default="gold_questions.json")
+    parser.add_argument("--output-dir", default="bench_chunking_db", help="where the stores are built")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--top-k", type=int, default=16)
+    parser.add_argument("--weight", type=float, default=10)
+    parser.add_argument("--budget", type=int, default=4000)
+    parser.add_argument("--output", default="bench_chunking_results.json")
+    main(parser.parse_args())
@@ -0,0 +1,142 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embeddings import EMBEDDING_BACKENDS
+
+
+# ======================================================================
+# ----------------------- ONE BACKEND PER PROCESS -----------------------
+# ======================================================================
+# Each backend is measured in a fresh process, so its resident memory
+# is not mixed up with the model loaded before it.
+
+def measure_backend(backend, env, gold, params, repeat):
+    import psutil
+
+    from bench_retrieval import build_bench_chain, run_config
+    from bm25 import load_sparse_index
+    from embeddings import load_embeddings, load_vector_db
+    from utils import preload_tables
+
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    start = time.perf_counter()
+    embeddings = load_embeddings({**env, "EMBEDDING_BACKEND": backend})
+    load_seconds = time.perf_counter() - start
+    rss_model = process.memory_info().rss - rss_before
+
+    questions = [item["question"] for item in gold]
+    embeddings.embed_query(questions[0])   # warm-up
+
+    latencies = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            embeddings.embed_query(question)
+            latencies.append(time.perf_counter() - start)
+    vectors = [embeddings.embed_query(q) for q in questions]
+
+    vectordb = load_vector_db(env, embeddings)
+    sparse_index = None if params.pop("dense_only") else load_sparse_index(env)
+    preload_tables("html")
+    metrics, _, _ = run_config(build_bench_chain(vectordb, sparse_index, params, "retrieval"), gold)
+
+    return {
+        "backend": backend,
+        "load_seconds": round(load_seconds, 3),
+        "rss_model_mb": round(rss_model / 2**20, 1),
+        "rss_total_mb": round(process.memory_info().rss / 2**20, 1),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "retrieval": metrics,
+        "vectors": vectors,
+    }
+
+
+def mean_cosine(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    return float(np.mean(np.sum(a * b, axis=1)))
+
+
+def main(args):
+    load_dotenv()
+    env = {
+        "PERSIST_DIR": args.persist_dir or os.environ.get("PERSIST_DIR", "chroma_db"),
+        "EMBEDDING_ONNX_FILE": args.onnx_file or os.environ.get("EMBEDDING_ONNX_FILE", ""),
+    }
+    with open(args.gold, "r", encoding="utf-8") as f:
+        gold = json.load(f)
+    params = {"k": args.k, "top_k": args.top_k, "weight": args.weight,
+              "budget": args.budget, "dense_only": args.dense_only}
+
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for backend in args.backend:
+        print(f"Measuring {backend} ...")
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(measure_backend, (backend, env, gold, dict(params), args.repeat)))
+
+    # Agreement of each backend's query vectors with the first backend's
+    reference = results[0]["vectors"]
+    for result in results:
+        result["cosine_vs_" + results[0]["backend"]] = round(mean_cosine(result.pop("vectors"), reference), 5)
+
+    print(f"\n{'backend':>10} {'load s':>7} {'RSS MB':>7} {'p50 ms':>7} {'p95 ms':>7} "
+          f"{'R@3':>5} {'MRR':>5} {'cosine':>7}")
+    for r in results:
+        print(
+            f"{r['backend']:>10} {r['load_seconds']:>7.2f} {r['rss_model_mb']:>7.0f} "
+            f"{r['query_p50_ms']:>7.2f} {r['query_p95_ms']:>7.2f} "
+            f"{r['retrieval']['recall@3']:>5.2f} {r['retrieval']['mrr']:>5.2f} "
+            f"{r['cosine_vs_' + results[0]['backend']]:>7.4f}"
+        )
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "persist_dir": env["PERSIST_DIR"],
+        "gold": args.gold,
+        "params": params,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# With the store built by build_vector_store.py (torch vectors):
+#   python bench_embeddings.py
+#   python bench_embeddings.py --backend torch onnx-int8 --repeat 10
+#
+# "cosine" is how close each backend's query vectors are to the first
+# backend's; recall is measured on gold_questions.json against the same
+# store, so a backend that keeps recall can serve queries for it.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare embedding backends: latency, memory and recall.")
+    parser.add_argument("--backend", nargs="+", choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS))
+    parser.add_argument("--gold", default="gold_questions.json")
+    parser.add_argument("--persist-dir", help="Chroma directory (default: PERSIST_DIR or chroma_db)")
+    parser.add_argument("--onnx-file", help="quantized ONNX file for onnx-int8")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the gold questions for latency")
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--top-k", type=int, default=16)
+    parser.add_argument("--weight", type=float, default=10)
+    parser.add_argument("--budget", type=int, default=4000)
+    parser.add_argument("--dense-only", action="store_true", help="measure recall without BM25")
+    parser.add_argument("--output", default="bench_embeddings_results.json")
+    main(parser.parse_args())
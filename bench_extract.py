@@ -0,0 +1,134 @@
+import argparse
+import os
+import tempfile
+import time
+
+import fitz
+
+from extract_text import add_end_boundary, extract_chunks_by_headers, is_boilerplate
+
+
+# ======================================================================
+# ------------------------ SYNTHETIC TEST PDF ---------------------------
+# ======================================================================
+
+def make_synthetic_pdf(path, num_pages=146, headers_per_page=3, lines_per_section=12):
+    """
+    Write a manual-like PDF: bold 12pt section headers followed by
+    10pt body lines, plus the usual footer boilerplate on every page.
+    Sections regularly run across page breaks.
+    """
+    doc = fitz.open()
+    section = 0
+    for page_num in range(num_pages):
+        page = doc.new_page()
+        y = 60
+        for h in range(headers_per_page):
+            # Every other page starts with body text continuing the previous section
+            if h or page_num % 2 == 0:
+                section += 1
+                page.insert_text((50, y), f"Section {section} Procedure",
+                                 fontname="hebo", fontsize=12)
+                y += 20
+            for line in range(lines_per_section):
+                page.insert_text(
+                    (60, y),
+                    f"Item {line} of section {section} .......... SET {page_num}",
+                    fontname="helv", fontsize=10,
+                )
+                y += 14
+        page.insert_text((50, 800), "Copyright © The Boeing Company",
+                         fontname="helv", fontsize=8)
+        page.insert_text((400, 800), f"NP.21.{page_num}", fontname="helv", fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+# ======================================================================
+# ------------------ PREVIOUS IMPLEMENTATION (BASELINE) -----------------
+# ======================================================================
+# Re-parses the page with get_text("dict") for header detection and
+# again for every section that touches the page.
+
+def _legacy_is_header(text, span):
+    return (span["size"] == 12.0 and "Bold" in span["font"]
+            and not text.startswith("NP.") and "Copyright" not in text)
+
+
+def _legacy_collect_headers(doc, start_page, end_page):
+    headers = []
+    for page_num in range(start_page, end_page + 1):
+        for block in doc[page_num].get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    text = span["text"].strip()
+                    if _legacy_is_header(text, span):
+                        headers.append({"page": page_num, "y0": span["bbox"][1], "text": text})
+    return headers
+
+
+def _legacy_extract_text_by_range(doc, start_header, end_header):
+    parts = []
+    for page_num in range(start_header["page"], end_header["page"] + 1):
+        min_y = start_header["y0"] if page_num == start_header["page"] else 0
+        max_y = end_header["y0"] if page_num == end_header["page"] else float("inf")
+        for block in doc[page_num].get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    text = span["text"].strip()
+                    if min_y < span["bbox"][1] < max_y and text and not is_boilerplate(text):
+                        parts.append(text)
+    return " ".join(parts).strip()
+
+
+def legacy_extract_chunks_by_headers(pdf_path, start_page, end_page):
+    doc = fitz.open(pdf_path)
+    headers = _legacy_collect_headers(doc, start_page, end_page)
+    headers.sort(key=lambda h: (h["page"], h["y0"]))
+    headers = add_end_boundary(headers, end_page)
+
+    chunks = []
+    for start, end in zip(headers, headers[1:]):
+        text = _legacy_extract_text_by_range(doc, start, end)
+        if text:
+            chunks.append({"section": start["text"], "page_number": start["page"] + 1,
+                           "description": text})
+    return chunks
+
+
+# ======================================================================
+# ------------------------------ BENCHMARK ------------------------------
+# ======================================================================
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark PDF section extraction.")
+    parser.add_argument("--pages", type=int, default=146)
+    parser.add_argument("--headers-per-page", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "synthetic_manual.pdf")
+        make_synthetic_pdf(pdf_path, args.pages, args.headers_per_page)
+        end_page = args.pages - 1
+
+        legacy_time, legacy_chunks = best_of(
+            lambda: legacy_extract_chunks_by_headers(pdf_path, 0, end_page), args.repeat)
+        new_time, new_chunks = best_of(
+            lambda: extract_chunks_by_headers(pdf_path, 0, end_page), args.repeat)
+
+    assert new_chunks == legacy_chunks, "single-pass output differs from the baseline"
+
+    print(f"pages: {args.pages}, sections: {len(new_chunks)}")
+    print(f"per-section parsing : {legacy_time * 1000:8.1f} ms")
+    print(f"single-pass parsing : {new_time * 1000:8.1f} ms")
+    print(f"speedup             : {legacy_time / new_time:8.1f}x")
@@ -0,0 +1,227 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from datetime import datetime, timezone
+from operator import itemgetter
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableLambda, RunnableParallel
+
+from bm25 import load_sparse_index
+from embeddings import load_embeddings, load_vector_db
+from metrics import StageTimer
+from pipeline import build_context_chain, build_generation_chain, build_retrieval_chain
+from reranker import CrossEncoderReranker, load_cross_encoder
+from utils import preload_tables
+
+
+# Deterministic answer used in --mode full, so runs never call Gemini
+STUB_ANSWER = "Stub answer for offline benchmarking."
+
+RECALL_AT = (1, 3, 5)
+
+
+# ======================================================================
+# ------------------------------ SCORING --------------------------------
+# ======================================================================
+
+def ranked_pages(docs):
+    """Page numbers of `docs` in rank order, each page listed once."""
+    pages = []
+    for doc in docs:
+        page = doc.metadata.get("page_number")
+        if page is not None and int(page) not in pages:
+            pages.append(int(page))
+    return pages
+
+
+def recall_at(pages, expected, n):
+    """Share of the expected pages found among the first n ranked pages."""
+    return len(set(pages[:n]) & expected) / len(expected)
+
+
+def reciprocal_rank(pages, expected):
+    """1 / rank of the first expected page, 0 if none was retrieved."""
+    for rank, page in enumerate(pages, start=1):
+        if page in expected:
+            return 1.0 / rank
+    return 0.0
+
+
+def percentiles(values):
+    return {
+        "p50": round(float(np.percentile(values, 50)), 6),
+        "p95": round(float(np.percentile(values, 95)), 6),
+    }
+
+
+# ======================================================================
+# ------------------------------ RUNNING --------------------------------
+# ======================================================================
+
+def build_bench_chain(vectordb, sparse_index, params, mode, reranker=None):
+    """
+    Retrieval (+ re-ranking and context, + stub generation in full mode)
+    with the given parameters, and the cross-encoder stage if `reranker`.
+
+    Output:
+        {"results": list[(Document, float)], "output": {"sources", "context_tokens", ...}}
+    """
+    options = dict(
+        top_k=params["top_k"],
+        title_match_score_weight=params["weight"],
+        context_token_budget=params["budget"],
+        reranker=reranker,
+    )
+    if mode == "full":
+        tail = build_generation_chain(FakeListChatModel(responses=[STUB_ANSWER]), **options)
+    else:
+        tail = build_context_chain(**options) | RunnableLambda(
+            lambda built: {"sources": built["docs"], "context_tokens": built["tokens"]}
+        )
+
+    return build_retrieval_chain(vectordb, sparse_index=sparse_index, k=params["k"]) | RunnableParallel({
+        "results": itemgetter("results"),
+        "output": tail,
+    })
+
+
+def run_config(chain, gold):
+    """
+    Run every gold question once through `chain`.
+
+    Returns:
+        (metrics dict, latency dict, per-question list)
+    """
+    chain.invoke(gold[0]["question"])   # warm-up, not measured
+
+    stage_timings = {}
+    per_question = []
+    for item in gold:
+        expected = set(item["pages"])
+        timer = StageTimer()
+        start = time.perf_counter()
+        out = chain.invoke(item["question"], config={"callbacks": [timer]})
+        total = time.perf_counter() - start
+
+        for stage, elapsed in {**timer.timings, "total": total}.items():
+            stage_timings.setdefault(stage, []).append(elapsed)
+
+        pages = ranked_pages(out["output"]["sources"])
+        candidate_pages = ranked_pages(doc for doc, _ in out["results"])
+        per_question.append({
+            "question": item["question"],
+            "expected": sorted(expected),
+            "pages": pages,
+            "candidate_recall": recall_at(candidate_pages, expected, len(candidate_pages)),
+            "reciprocal_rank": reciprocal_rank(pages, expected),
+            "context_tokens": out["output"]["context_tokens"],
+            **{f"recall@{n}": recall_at(pages, expected, n) for n in RECALL_AT},
+        })
+
+    metric_names = [f"recall@{n}" for n in RECALL_AT] + ["candidate_recall", "reciprocal_rank", "context_tokens"]
+    metrics = {
+        ("mrr" if name == "reciprocal_rank" else name):
+            round(float(np.mean([q[name] for q in per_question])), 4)
+        for name in metric_names
+    }
+    latency = {stage: percentiles(values) for stage, values in stage_timings.items()}
+    return metrics, latency, per_question
+
+
+def print_summary(runs):
+    print(f"\n{'k':>4} {'top_k':>5} {'weight':>6} {'budget':>6} "
+          f"{'R@1':>5} {'R@3':>5} {'R@5':>5} {'cand':>5} {'MRR':>5} {'p50 ms':>7} {'p95 ms':>7}")
+    for run in runs:
+        p, m, total = run["params"], run["metrics"], run["latency"]["total"]
+        print(
+            f"{p['k']:>4} {p['top_k']:>5} {p['weight']:>6} {p['budget']:>6} "
+            f"{m['recall@1']:>5.2f} {m['recall@3']:>5.2f} {m['recall@5']:>5.2f} "
+            f"{m['candidate_recall']:>5.2f} {m['mrr']:>5.2f} "
+            f"{total['p50'] * 1000:>7.1f} {total['p95'] * 1000:>7.1f}"
+        )
+
+
+def main(args):
+    load_dotenv()
+    persist_dir = args.persist_dir or os.environ.get("PERSIST_DIR", "chroma_db")
+    env = {"PERSIST_DIR": persist_dir}
+
+    with open(args.gold, "r", encoding="utf-8") as f:
+        gold = json.load(f)
+
+    embeddings = load_embeddings(env)
+    vectordb = load_vector_db(env, embeddings)
+    sparse_index = None if args.dense_only else load_sparse_index(env)
+    preload_tables(args.table_format)
+
+    reranker = None
+    if args.reranker:
+        reranker = CrossEncoderReranker(
+            load_cross_encoder(args.reranker),
+            top_k=args.rerank_top_k,
+            budget_seconds=args.rerank_budget_ms / 1000,
+        )
+
+    runs = []
+    for k, top_k, weight, budget in itertools.product(args.k, args.top_k, args.weight, args.budget):
+        params = {"k": k, "top_k": top_k, "weight": weight, "budget": budget}
+        print(f"Running {params} ...")
+        chain = build_bench_chain(vectordb, sparse_index, params, args.mode, reranker)
+        metrics, latency, per_question = run_config(chain, gold)
+        runs.append({"params": params, "metrics": metrics, "latency": latency, "questions": per_question})
+
+    print_summary(runs)
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "mode": args.mode,
+        "persist_dir": persist_dir,
+        "hybrid": sparse_index is not None,
+        "table_format": args.table_format,
+        "reranker": args.reranker,
+        "rerank_stats": reranker.stats() if reranker else None,
+        "gold": args.gold,
+        "runs": runs,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# Build the store first (python build_vector_store.py), then:
+#   python bench_retrieval.py
+#   python bench_retrieval.py --k 10 25 50 --weight 0 5 10 --output sweep.json
+#   python bench_retrieval.py --mode full        # whole pipeline, stub LLM
+#
+# Everything runs offline: the embedding model comes from models/, the
+# store from PERSIST_DIR, and no LLM is called. To compare chunking
+# settings, build each variant into its own directory and pass
+# --persist-dir.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark against a gold question set.")
+    parser.add_argument("--gold", default="gold_questions.json",
+                        help='JSON list of {"question": str, "pages": [int, ...]}')
+    parser.add_argument("--persist-dir", help="Chroma directory (default: PERSIST_DIR or chroma_db)")
+    parser.add_argument("--mode", choices=["retrieval", "full"], default="retrieval",
+                        help="retrieval + re-ranking + context only, or the full pipeline with a stub LLM")
+    parser.add_argument("--k", type=int, nargs="+", default=[25])
+    parser.add_argument("--top-k", type=int, nargs="+", default=[16])
+    parser.add_argument("--weight", type=float, nargs="+", default=[10])
+    parser.add_argument("--budget", type=int, nargs="+", default=[4000])
+    parser.add_argument("--dense-only", action="store_true", help="ignore the BM25 index")
+    parser.add_argument("--table-format", default="html", choices=["html", "markdown", "tsv"])
+    parser.add_argument("--reranker", help="cross-encoder model for the second re-ranking stage")
+    parser.add_argument("--rerank-top-k", type=int, default=4)
+    parser.add_argument("--rerank-budget-ms", type=float, default=250)
+    parser.add_argument("--output", default="bench_retrieval_results.json")
+    main(parser.parse_args())
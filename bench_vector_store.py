@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from bench_retrieval import percentiles
+from embeddings import load_embeddings, load_vector_db
+from serving_index import ServingIndex, export_serving_index
+from vector_store import ChromaStore, NumpyVectorStore, export_numpy_store
+
+# Filters each question is searched with. "type=table" keeps ~1 chunk
+# in 10 and exercises each store's filtered path.
+FILTER_CASES = {
+    "none": None,
+    "type=text": {"type": "text"},
+    "type=table": {"type": "table"},
+}
+
+
+def dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def measure_store(store, query_embeddings, exact, k, repeat):
+    """
+    Latency and recall of one store against the exact float32 results.
+
+    Returns:
+        dict per filter case: recall@k, single-query and batch latency
+    """
+    results = {}
+    for case, filters in FILTER_CASES.items():
+        latencies = []
+        found = []
+        for i, embedding in enumerate(query_embeddings):
+            for _ in range(repeat):
+                hits, elapsed = timed(store.search, embedding, k, filters)
+                latencies.append(elapsed)
+            expected = exact[case][i]
+            if expected:
+                found.append(len({doc.id for doc, _ in hits} & expected) / len(expected))
+
+        _, batch_seconds = timed(store.search_batch, query_embeddings, k, filters)
+        results[case] = {
+            f"recall@{k}": round(sum(found) / len(found), 4) if found else None,
+            "latency": percentiles(latencies),
+            "batch_seconds": round(batch_seconds, 6),
+        }
+    return results
+
+
+def main(args):
+    load_dotenv()
+    persist_dir = args.persist_dir or os.environ.get("PERSIST_DIR", "chroma_db")
+    env = {"PERSIST_DIR": persist_dir}
+
+    with open(args.gold, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)]
+
+    embeddings = load_embeddings(env)
+    chroma = load_vector_db(env, embeddings)
+    # Embedded once, so only the search itself is timed
+    query_embeddings = embeddings.embed_documents(questions)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Fresh exports of the current Chroma contents
+        mmap_dir, numpy_dir = Path(tmp) / "serving_index", Path(tmp) / "numpy_store"
+        export_serving_index(chroma, mmap_dir)
+        export_numpy_store(chroma, numpy_dir)
+
+        stores = {}
+        stores["chroma"], chroma_open = timed(ChromaStore, chroma)
+        stores["mmap"], mmap_open = timed(ServingIndex, mmap_dir, embeddings)
+        stores["numpy"], numpy_open = timed(NumpyVectorStore, numpy_dir, embeddings)
+        opened = {"chroma": chroma_open, "mmap": mmap_open, "numpy": numpy_open}
+        sizes = {"chroma": None, "mmap": dir_size(mmap_dir), "numpy": dir_size(numpy_dir)}
+
+        # Ground truth: exact search on Chroma's own float32 vectors
+        exact = {
+            case: [{doc.id for doc, _ in hits} for hits in stores["mmap"].search_batch(query_embeddings, args.k, filters)]
+            for case, filters in FILTER_CASES.items()
+        }
+
+        results = []
+        for name in args.stores:
+            print(f"Measuring {name} ...")
+            results.append({
+                "store": name,
+                "open_seconds": round(opened[name], 6),
+                "bytes_on_disk": sizes[name],
+                "filters": measure_store(stores[name], query_embeddings, exact, args.k, args.repeat),
+            })
+        stores["mmap"].close()
+
+    print(f"\n{'store':>7} {'filter':>11} {'R@' + str(args.k):>6} {'p50 ms':>7} {'p95 ms':>7} {'batch ms':>9} {'open ms':>8}")
+    for r in results:
+        for case, m in r["filters"].items():
+            recall = m[f"recall@{args.k}"]
+            print(
+                f"{r['store']:>7} {case:>11} {recall if recall is not None else float('nan'):>6.3f} "
+                f"{m['latency']['p50'] * 1000:>7.2f} {m['latency']['p95'] * 1000:>7.2f} "
+                f"{m['batch_seconds'] * 1000:>9.2f} {r['open_seconds'] * 1000:>8.1f}"
+            )
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "persist_dir": persist_dir,
+        "gold": args.gold,
+        "questions": len(questions),
+        "chunks": len(stores["numpy"]),
+        "k": args.k,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# Build the store first (python build_vector_store.py), then:
+#   python bench_vector_store.py
+#   python bench_vector_store.py --k 10 --repeat 20 --stores chroma numpy
+#
+# Recall is measured against exact float32 search over Chroma's own
+# vectors, so Chroma's number is the HNSW approximation and numpy's the
+# float16 rounding. Query embedding is not timed.
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare vector stores on search latency and recall.")
+    parser.add_argument("--gold", default="gold_questions.json", help="questions used as queries")
+    parser.add_argument("--persist-dir", help="Chroma directory (default: PERSIST_DIR or chroma_db)")
+    parser.add_argument("--stores", nargs="+", choices=["chroma", "mmap", "numpy"], default=["chroma", "mmap", "numpy"])
+    parser.add_argument("--k", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=5, help="timed searches per question")
+    parser.add_argument("--output", default="bench_vector_store_results.json")
+    main(parser.parse_args())
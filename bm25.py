@@ -0,0 +1,174 @@
+import json
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils import clean_tokenize
+
+# Stored next to the Chroma files in PERSIST_DIR
+BM25_FILE = "bm25_index.json"
+
+
+class BM25Index:
+    """
+    In-process BM25 inverted index over the chunk text.
+
+    Built by build_vector_store.py from the same chunks (and ids) as the
+    Chroma collection, persisted as JSON in PERSIST_DIR, and loaded by
+    the API. Per-term BM25 weights are precomputed at load time, so a
+    query is a handful of NumPy scatter-adds plus an argpartition.
+    """
+
+    def __init__(self, ids, texts, metadatas, postings, doc_len, k1=1.5, b=0.75):
+        self.ids = ids
+        self.texts = texts
+        self.metadatas = metadatas
+        self.postings = postings      # term -> (doc indices, term frequencies)
+        self.doc_len = np.asarray(doc_len, dtype=np.float32)
+        self.k1 = k1
+        self.b = b
+        self._weights = self._precompute_weights()
+
+        # Per-chunk fields used by metadata filters
+        self._types = np.array([m.get("type") for m in metadatas], dtype=object)
+        self._chapters = np.array([m.get("chapter") for m in metadatas], dtype=object)
+        self._pages = np.array(
+            [m.get("page_number") if m.get("page_number") is not None else np.nan for m in metadatas],
+            dtype=np.float64,
+        )
+
+    # --------------------------------------------------------
+    # Build / persist
+    # --------------------------------------------------------
+    @classmethod
+    def from_documents(cls, docs, k1=1.5, b=0.75):
+        """Index a list of chunk Documents."""
+        postings = defaultdict(lambda: ([], []))
+        doc_len = []
+
+        for i, doc in enumerate(docs):
+            counts = Counter(clean_tokenize(doc.page_content))
+            doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings[term][0].append(i)
+                postings[term][1].append(tf)
+
+        return cls(
+            ids=[doc.id for doc in docs],
+            texts=[doc.page_content for doc in docs],
+            metadatas=[doc.metadata for doc in docs],
+            postings=dict(postings),
+            doc_len=doc_len,
+            k1=k1,
+            b=b,
+        )
+
+    def save(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "texts": self.texts,
+            "metadatas": self.metadatas,
+            "doc_len": self.doc_len.astype(int).tolist(),
+            "postings": self.postings,
+        }
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with Path(path).open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            ids=data["ids"],
+            texts=data["texts"],
+            metadatas=data["metadatas"],
+            postings={term: tuple(p) for term, p in data["postings"].items()},
+            doc_len=data["doc_len"],
+            k1=data["k1"],
+            b=data["b"],
+        )
+
+    # --------------------------------------------------------
+    # Search
+    # --------------------------------------------------------
+    def _precompute_weights(self):
+        """term -> (doc indices, BM25 weight of the term in each doc)."""
+        n_docs = len(self.ids)
+        avg_len = float(self.doc_len.mean()) if n_docs else 0.0
+        weights = {}
+
+        for term, (indices, tfs) in self.postings.items():
+            indices = np.asarray(indices, dtype=np.int64)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            df = len(indices)
+            idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[indices] / avg_len)
+            weights[term] = (indices, idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+        return weights
+
+    def filter_mask(self, filters):
+        """Boolean mask of the chunks passing `filters` (see router.chroma_where)."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if "type" in filters:
+            mask &= self._types == filters["type"]
+        if "chapter" in filters:
+            mask &= self._chapters == filters["chapter"]
+        # NaN pages compare False, so chunks without a page are excluded
+        if "page_from" in filters:
+            mask &= self._pages >= filters["page_from"]
+        if "page_to" in filters:
+            mask &= self._pages <= filters["page_to"]
+        return mask
+
+    def search(self, query, k=25, filters=None):
+        """
+        Return up to k (Document, bm25_score) pairs, best first.
+        Documents with no query term, or not passing `filters`,
+        are never returned.
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(clean_tokenize(query)):
+            hit = self._weights.get(term)
+            if hit is not None:
+                indices, term_weights = hit
+                scores[indices] += term_weights   # indices are unique per term
+        if filters:
+            scores[~self.filter_mask(filters)] = 0.0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [
+            (
+                Document(
+                    page_content=self.texts[i],
+                    metadata=dict(self.metadatas[i]),
+                    id=self.ids[i],
+                ),
+                float(scores[i]),
+            )
+            for i in candidates
+        ]
+
+
+def load_sparse_index(env):
+    """
+    Load the BM25 index stored in env["PERSIST_DIR"], or None if the
+    store was built before hybrid search existed.
+    """
+    path = Path(env["PERSIST_DIR"]) / BM25_FILE
+    if not path.exists():
+        print(f"No BM25 index at {path}; falling back to dense-only retrieval.")
+        return None
+    return BM25Index.load(path)
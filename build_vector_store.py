@@ -1,32 +1,74 @@
 import os
 import json
+import time
+import hashlib
+import argparse
 from pathlib import Path
 
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEndpointEmbeddings
-from langchain_chroma import Chroma
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from  dotenv import load_dotenv
-from embeddings import  load_embeddings
+from embeddings import  load_indexing_embeddings, mark_index_updated, read_index_version
+from bm25 import BM25Index, BM25_FILE
+from utils import clean_tokenize
+from router import chapter_id
+from chunking import CHUNKERS, CHUNKING_STRATEGIES
+from serving_index import export_serving_index, serving_index_path
+from vector_store import export_numpy_store, exported_version, numpy_store_path
 
-load_dotenv()
+# Chroma is imported where a store is opened, so ingest.py and the API
+# can import the chunking helpers without loading it.
 
 
 DATA_DIR = Path(".")  
 PERSIST_DIR = "chroma_db"  # local folder where Chroma will store data
 
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=800,
-    chunk_overlap=100,
+# Max number of chunks sent to Chroma in one add / delete call
+WRITE_BATCH_SIZE = 1000
+
+# Source files and the record type their objects default to
+SOURCE_FILES = (
+    ("texts.json", "text"),
+    ("tables.json", "table"),
+    ("diagrams.json", "diagram"),
 )
 
 
-def load_json_docs(path: Path, default_type: str | None = None) -> list[Document]:
-    """Load a JSON file of objects and return a list of embedded Documents."""
+def content_hash(*parts) -> str:
+    """Stable SHA-256 over strings / bytes / JSON-serializable parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        h.update(len(part).to_bytes(8, "big"))
+        h.update(part)
+    return h.hexdigest()
+
+
+def load_json_docs(path: Path, default_type: str | None = None, chunking: str = "structure") -> list[Document]:
+    """
+    Load a JSON file of objects and return a list of chunked Documents.
+    `chunking` picks the chunker in chunking.py ("structure" or "fixed").
+
+    Every chunk gets:
+      • id                  — content hash of chunk text + metadata + CSV bytes,
+                              so an unchanged chunk keeps the same id
+      • metadata.chunk_key  — its stable position (file, page, title, chunk #),
+                              used to tell an updated chunk from a new one
+    """
     with path.open("r", encoding="utf-8") as f:
         items = json.load(f)
+    return chunk_records(items, path, default_type, chunking)
+
 
+def chunk_records(items: list[dict], path: Path, default_type: str | None = None,
+                  chunking: str = "structure") -> list[Document]:
+    """
+    Chunk the objects read from `path` (see load_json_docs). CSV paths
+    are resolved relative to the file's folder.
+    """
     docs: list[Document] = []
+    seen_keys: dict[str, int] = {}
 
     for obj in items:
         # Core fields
@@ -41,75 +83,203 @@ def load_json_docs(path: Path, default_type: str | None = None) -> list[Document
         # 1. Load CSV text if this is a table and a CSV exists
         # ------------------------------------------------------------------
         table_text = ""
+        csv_bytes = b""
         if csv_path:
             csv_file = path.parent / csv_path
             if csv_file.exists():
                 try:
-                    with csv_file.open("r", encoding="utf-8") as f_csv:
-                        table_text = f_csv.read()
+                    csv_bytes = csv_file.read_bytes()
+                    table_text = csv_bytes.decode("utf-8")
                 except Exception:
                     table_text = ""  # fail silently
         # ------------------------------------------------------------------
 
-        # ------------------------------------------------------------------
-        # 2. Build the full embedded text: title + description + section + CSV
-        # ------------------------------------------------------------------
-        text_parts = []
-        if title:
-            text_parts.append(title)
-        if description:
-            text_parts.append(description)
-        if section:
-            text_parts.append(section)
-        if table_text:
-            text_parts.append(table_text)   
-        # ------------------------------------------------------------------
-
-        page_content = "\n\n".join(text_parts) if text_parts else ""
-
         # Metadata
         metadata = {
             "type": obj_type,
+            # chapter id (router.CHAPTERS), used by metadata filters
+            "chapter": chapter_id(obj.get("chapter"), page_number),
             "page_number": page_number,
             "title": title,
             "description": description,
             "section": section,
             "csv_path": csv_path,
+            # precomputed for scoring.title_weighted_reranker
+            "title_tokens": " ".join(sorted(set(clean_tokenize(title)))),
         }
 
-        # Create chunks
-        chunks = splitter.create_documents(
-            [page_content],
-            metadatas=[metadata]
-        )
+        # ------------------------------------------------------------------
+        # 2. Chunk the record (see chunking.py): small sections whole, long
+        #    ones at item boundaries, tables as one summary chunk
+        # ------------------------------------------------------------------
+        chunks = [
+            Document(page_content=text, metadata=dict(metadata))
+            for text in CHUNKERS[chunking](obj_type, title, description, section, table_text)
+        ]
+
+        # ------------------------------------------------------------------
+        # 3. Key every chunk by position and by content
+        # ------------------------------------------------------------------
+        record_key = f"{path.name}|{page_number}|{title or section}"
+        occurrence = seen_keys.get(record_key, 0)
+        seen_keys[record_key] = occurrence + 1
+        if occurrence:
+            record_key = f"{record_key}|{occurrence}"
+
+        for i, chunk in enumerate(chunks):
+            chunk_key = f"{record_key}|{i}"
+            chunk.metadata["chunk_key"] = chunk_key
+            chunk.id = content_hash(chunk_key, chunk.page_content, metadata, csv_bytes)
         docs.extend(chunks)
 
     return docs
 
 
 
-def build_vector_store():
-    # 1) Load all documents from the three JSON files
-    texts_path = DATA_DIR / "texts.json"
-    tables_path = DATA_DIR / "tables.json"
-    diagrams_path = DATA_DIR / "diagrams.json"
-
+def load_all_docs(chunking="structure"):
+    """Chunks of texts.json, tables.json and diagrams.json, in that order."""
     all_docs: list[Document] = []
-    all_docs += load_json_docs(texts_path, default_type="text")
-    all_docs += load_json_docs(tables_path, default_type="table")
-    all_docs += load_json_docs(diagrams_path, default_type="diagram")
+    for name, default_type in SOURCE_FILES:
+        all_docs += load_json_docs(DATA_DIR / name, default_type=default_type, chunking=chunking)
+    return all_docs
+
+
+def build_vector_store(batch_size=64, num_threads=None, cache_dir=None,
+                       persist_dir=PERSIST_DIR, chunking="structure"):
+    """
+    Incrementally sync the local Chroma store with the JSON sources.
+
+    Only chunks whose content hash is not in the store yet are embedded;
+    chunks that no longer exist (or whose content changed) are deleted.
 
-    embeddings =load_embeddings()
+    Inputs:
+        batch_size (int): texts per embedding forward pass
+        num_threads (int | None): torch threads (None = every core)
+        cache_dir (str | None): on-disk embedding cache folder
+        persist_dir (str): Chroma directory
+        chunking (str): "structure" (default) or "fixed" (see chunking.py)
+    """
+    # 1) Load all documents from the three JSON files
+    all_docs = load_all_docs(chunking)
 
-    # 3) Create / overwrite local Chroma store
-    vectordb = Chroma.from_documents(
-        documents=all_docs,
-        embedding=embeddings,
-        persist_directory=PERSIST_DIR,
+    embeddings = load_indexing_embeddings(
+        batch_size=batch_size,
+        num_threads=num_threads,
+        cache_dir=cache_dir,
     )
-    
-    print(" Successfully indexed {len(all_docs)} documents into {PERSIST_DIR!r}")
+    vectordb, _ = sync_vector_store(all_docs, embeddings, persist_dir, batch_size)
     return vectordb
 
 
-build_vector_store()
\ No newline at end of file
+def sync_vector_store(all_docs, embeddings, persist_dir=PERSIST_DIR, batch_size=64):
+    """
+    Bring the Chroma store in `persist_dir` in line with `all_docs`,
+    then rebuild the BM25 index and the exported stores next to it.
+
+    Returns:
+        (Chroma, dict) — the store and counts / embedding time of the sync
+    """
+    from langchain_chroma import Chroma
+
+    # 2) Open (or create) the local Chroma store and diff it against the sources
+    vectordb = Chroma(
+        persist_directory=persist_dir,
+        embedding_function=embeddings,
+    )
+    existing = vectordb.get(include=["metadatas"])
+    existing_ids = set(existing["ids"])
+    existing_keys = {
+        (meta or {}).get("chunk_key")
+        for meta in existing["metadatas"]
+    }
+
+    new_docs = [doc for doc in all_docs if doc.id not in existing_ids]
+    stale_ids = existing_ids - {doc.id for doc in all_docs}
+
+    updated = sum(1 for doc in new_docs if doc.metadata["chunk_key"] in existing_keys)
+    added = len(new_docs) - updated
+    skipped = len(all_docs) - len(new_docs)
+
+    # 3) Delete stale chunks, then embed and insert only the new / changed ones
+    stale_ids = sorted(stale_ids)
+    for i in range(0, len(stale_ids), WRITE_BATCH_SIZE):
+        vectordb.delete(ids=stale_ids[i:i + WRITE_BATCH_SIZE])
+
+    start = time.perf_counter()
+    for i in range(0, len(new_docs), WRITE_BATCH_SIZE):
+        batch = new_docs[i:i + WRITE_BATCH_SIZE]
+        vectordb.add_documents(batch, ids=[doc.id for doc in batch])
+    elapsed = time.perf_counter() - start
+
+    if new_docs:
+        print(
+            f"Embedded {len(new_docs)} chunks in {elapsed:.1f}s "
+            f"({len(new_docs) / elapsed:.1f} chunks/s, batch size {batch_size})"
+        )
+
+    # 4) + 5) BM25 index, version marker and exported stores
+    finalize_store(vectordb, all_docs, persist_dir, changed=bool(new_docs or stale_ids))
+
+    print(
+        f"Synced {len(all_docs)} chunks into {persist_dir!r}: "
+        f"{added} added, {updated} updated, "
+        f"{len(stale_ids) - updated} deleted, {skipped} skipped"
+    )
+    stats = {
+        "chunks": len(all_docs),
+        "embedded": len(new_docs),
+        "embed_seconds": round(elapsed, 3),
+        "added": added,
+        "updated": updated,
+        "deleted": len(stale_ids) - updated,
+    }
+    return vectordb, stats
+
+
+def finalize_store(vectordb, all_docs, persist_dir, changed=True):
+    """
+    Build everything that sits next to the Chroma files in `persist_dir`
+    once its chunks are in place.
+    """
+    # 4) Rebuild the BM25 index over the same chunks (cheap, no embeddings)
+    BM25Index.from_documents(all_docs).save(Path(persist_dir) / BM25_FILE)
+
+    if changed:
+        mark_index_updated(persist_dir)
+
+    # 5) Re-export the memory-mapped serving index and the in-memory
+    #    store when they are out of date
+    version = read_index_version(persist_dir)
+    for out_dir, export in (
+        (serving_index_path(persist_dir), export_serving_index),
+        (numpy_store_path(persist_dir), export_numpy_store),
+    ):
+        exported = exported_version(out_dir)
+        if exported is None or exported != version:
+            export(vectordb, out_dir, index_version=version)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build / sync the Chroma store.")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="texts per embedding forward pass")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads (default: every CPU core)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="on-disk embedding cache (default: ./embedding_cache)")
+    parser.add_argument("--persist-dir", default=PERSIST_DIR,
+                        help="Chroma directory (default: ./chroma_db)")
+    parser.add_argument("--chunking", choices=CHUNKING_STRATEGIES, default="structure",
+                        help="structure-aware chunks (default) or the fixed 800-char splitter")
+    args = parser.parse_args()
+
+    build_vector_store(
+        batch_size=args.batch_size,
+        num_threads=args.threads,
+        cache_dir=args.cache_dir,
+        persist_dir=args.persist_dir,
+        chunking=args.chunking,
+    )
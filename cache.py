@@ -0,0 +1,368 @@
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from resilience import is_sources_only
+from router import split_request
+from utils import clean_tokenize
+
+
+def normalize_question(question):
+    """Exact-match cache key: lowercase tokens without punctuation."""
+    return " ".join(clean_tokenize(question))
+
+
+# A number with its sign and decimals; a "-" right after a word is a hyphen ("ISA-10")
+NUMBER_PATTERN = re.compile(r"(?:(?<![\w.])[-−])?\d+(?:,\d{3})*(?:\.\d+)?")
+
+
+def question_numbers(question):
+    """
+    The numbers in a question, sorted ("2,000 ft at -5°C" → (-5.0, 2000.0)).
+    Questions that differ only in a number embed almost identically, and
+    normalize_question drops the sign and decimal point.
+    """
+    return tuple(sorted(
+        float(n.replace(",", "").replace("−", "-")) for n in NUMBER_PATTERN.findall(question)
+    ))
+
+
+def normalize_query_text(text):
+    """Embedding cache key: case-folded text with whitespace collapsed."""
+    return " ".join(text.casefold().split())
+
+
+class AnswerCache:
+    """
+    Two-tier cache of pipeline results.
+
+      • exact tier    — keyed by the normalized question text and its
+                        numbers ("-10°C" and "10°C" normalize alike)
+      • semantic tier — reuses an entry whose query embedding has a
+                        cosine similarity >= `similarity_threshold` and
+                        whose question has exactly the same numbers
+                        ("at 30°C" never matches "at 35°C")
+
+    Entries are evicted least-recently-used once `max_entries` is
+    reached, expire after `ttl_seconds`, and are all dropped when
+    `version_fn()` (the vector store's index version) changes.
+
+    `scope` separates answers produced under different search filters:
+    both tiers only match entries stored with the same scope.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        max_entries=256,
+        ttl_seconds=3600,
+        similarity_threshold=0.92,
+        version_fn=None,
+    ):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_fn = version_fn
+
+        self._entries = OrderedDict()   # key -> (created, unit vector, result, scope, numbers)
+        self._version = version_fn() if version_fn else None
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # --------------------------------------------------------
+    # Lookup / store
+    # --------------------------------------------------------
+    def lookup(self, question, scope=""):
+        """
+        Look the question up in both tiers.
+
+        Returns:
+            (result | None, kind, embedding)
+            kind is "exact", "semantic" or "miss"; the query embedding
+            is returned so a miss can be stored without re-embedding.
+        """
+        numbers = question_numbers(question)
+        key = (scope, normalize_question(question), numbers)
+
+        with self._lock:
+            self._check_version()
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[2], "exact", entry[1]
+
+        # Embed outside the lock; it is the slow part.
+        vector = self._unit(self.embeddings.embed_query(question))
+
+        with self._lock:
+            keys = [k for k, entry in self._entries.items() if entry[3] == scope and entry[4] == numbers]
+            if keys:
+                matrix = np.stack([self._entries[k][1] for k in keys])
+                similarities = matrix @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.semantic_hits += 1
+                    return self._entries[keys[best]][2], "semantic", vector
+
+            self.misses += 1
+            return None, "miss", vector
+
+    def store(self, question, vector, result, scope=""):
+        """Insert a freshly generated result, evicting the LRU entry if full."""
+        numbers = question_numbers(question)
+        key = (scope, normalize_question(question), numbers)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector, result, scope, numbers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit / miss counters and current size."""
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+    # --------------------------------------------------------
+    # Helpers (call with the lock held)
+    # --------------------------------------------------------
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            self.invalidations += 1
+
+    def _expire(self):
+        # Entries are kept in recency order, not age order, so scan them all.
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [k for k, entry in self._entries.items() if entry[0] < cutoff]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class CachedPipeline:
+    """
+    Wrap the chain from pipeline.build_pipeline with an AnswerCache.
+
+    invoke / ainvoke take the chain's input (the question, or
+    {"question", "filters"}) and return the chain's result dict plus
+    "cache": "exact" | "semantic" | "miss".
+    astream yields the same keys as chunks, like the chain's astream.
+    `config` (e.g. callbacks) is passed to the chain on a cache miss.
+    """
+
+    def __init__(self, chain, cache, executor=None):
+        self.chain = chain
+        self.cache = cache
+        self.executor = executor
+
+    @staticmethod
+    def _question_and_scope(request):
+        question, filters = split_request(request)
+        return question, json.dumps(filters, sort_keys=True) if filters else ""
+
+    def invoke(self, request, config=None):
+        question, scope = self._question_and_scope(request)
+        result, kind, vector = self.cache.lookup(question, scope)
+        if result is None:
+            result = self.chain.invoke(request, config)
+            if not is_sources_only(result.get("answer")):
+                self.cache.store(question, vector, result, scope)
+        return {**result, "cache": kind}
+
+    async def ainvoke(self, request, config=None):
+        question, scope = self._question_and_scope(request)
+        loop = asyncio.get_running_loop()
+        # lookup() may embed the query, so keep it off the event loop
+        result, kind, vector = await loop.run_in_executor(
+            self.executor, self.cache.lookup, question, scope
+        )
+        if result is None:
+            result = await self.chain.ainvoke(request, config)
+            if not is_sources_only(result.get("answer")):
+                self.cache.store(question, vector, result, scope)
+        return {**result, "cache": kind}
+
+    async def astream(self, request, config=None):
+        question, scope = self._question_and_scope(request)
+        loop = asyncio.get_running_loop()
+        result, kind, vector = await loop.run_in_executor(
+            self.executor, self.cache.lookup, question, scope
+        )
+        if result is not None:
+            # Sources first, as the live stream would send them
+            yield {"sources": result.get("sources", [])}
+            for key, value in result.items():
+                if key != "sources":
+                    yield {key: value}
+            yield {"cache": kind}
+            return
+
+        # Forward chunks as they arrive and assemble the full result;
+        # it is only cached if the stream ran to completion (and the
+        # LLM actually answered).
+        final = {}
+        async for chunk in self.chain.astream(request, config):
+            for key, value in chunk.items():
+                if key == "answer":
+                    final[key] = final.get(key, "") + value
+                else:
+                    final[key] = value
+            yield chunk
+        if not is_sources_only(final.get("answer")):
+            self.cache.store(question, vector, final, scope)
+        yield {"cache": kind}
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wrap an embeddings object so that embed_query is memoized.
+
+      • memory tier — LRU of the last `max_entries` query vectors,
+                      keyed by the normalized query text
+      • disk tier   — optional SQLite file (`db_path`) shared by all
+                      uvicorn workers on the machine
+
+    Keys include `namespace` (the model name), so a cache file is never
+    read back with vectors from a different model. embed_documents is
+    passed through unchanged; indexing has its own cache.
+    """
+
+    def __init__(self, embeddings, max_entries=1024, db_path=None, namespace=""):
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.namespace = namespace
+
+        self._entries = OrderedDict()   # key -> list[float]
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path) if db_path else None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def embed_query(self, text):
+        key = self._key(text)
+
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return list(vector)
+
+        vector = self._read_db(key)
+        if vector is not None:
+            with self._lock:
+                self.disk_hits += 1
+        else:
+            vector = self.embeddings.embed_query(text)
+            self._write_db(key, vector)
+            with self._lock:
+                self.misses += 1
+
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return list(vector)
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        """Hit / miss counters per tier and current size."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "entries": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "shared": self._db is not None,
+            }
+
+    # --------------------------------------------------------
+    # Helpers
+    # --------------------------------------------------------
+    def _key(self, text):
+        normalized = normalize_query_text(text)
+        return hashlib.sha256(f"{self.namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _open_db(db_path):
+        # WAL lets several worker processes read while one writes
+        db = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+        db.commit()
+        return db
+
+    def _read_db(self, key):
+        if self._db is None:
+            return None
+        try:
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT vector FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Query embedding cache read failed: {e}")
+            return None
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def _write_db(self, key, vector):
+        if self._db is None:
+            return
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (key, vector) VALUES (?, ?)",
+                    (key, blob),
+                )
+                self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Query embedding cache write failed: {e}")
@@ -0,0 +1,187 @@
+import csv
+import io
+import re
+
+# langchain_text_splitters is imported lazily: it is only needed for the
+# "fixed" strategy and for single units longer than a whole chunk.
+
+# Largest chunk the structure-aware chunker builds. Sections up to this
+# size stay whole; all-mpnet-base-v2 reads ~384 word pieces, about this much.
+MAX_CHUNK_CHARS = 1200
+
+# The previous fixed-size splitter, kept for comparison (--chunking fixed)
+FIXED_CHUNK_SIZE = 800
+FIXED_CHUNK_OVERLAP = 100
+
+CHUNKING_STRATEGIES = ("structure", "fixed")
+
+
+# ======================================================================
+# ----------------------------- TEXT UNITS ------------------------------
+# ======================================================================
+# extract_text.py flattens each section into one line, so item
+# boundaries are recovered from the text itself:
+#
+#   checklist items  "Parking brake ........ Set FASTEN BELTS switch .... OFF"
+#   bullets          "• N1 rotation is observed"
+#   notes            "Note: ...", "CAUTION: ...", "WARNING: ..."
+#   diagram parts    "Element 3: ..."
+#   sentences        "... is stabilized. Verify fuel flow ..."
+
+# Dot leaders are shortened: a 70-dot leader costs ~70 tokens of the
+# embedding model's input for nothing.
+LEADER = re.compile(r"\s*(?:\.\s?){4,}\s*")
+
+# End of a checklist item: leader + setting ("Set", "OFF", "As required")
+CHECKLIST_ITEM = re.compile(
+    r" \.\.\.\. (?:As (?:required|desired|needed)|[A-Z0-9][\w/–-]*)"
+)
+
+BOUNDARY_BEFORE = re.compile(r"\s+(?=•|Note:|NOTE:|CAUTION:|WARNING:|Element \d+:|\[[^\]]{2,40}\]\s)")
+SENTENCE_END = re.compile(r"(?<=[^.][.!?”\"])\s+(?=[A-Z\[“\"])")
+
+
+def normalize_text(text):
+    return LEADER.sub(" .... ", text).strip()
+
+
+def split_units(text):
+    """
+    Split a section into the smallest pieces that must stay together
+    (checklist items, bullets, notes, sentences).
+
+    Returns:
+        list[str]
+    """
+    pieces = []
+    start = 0
+    for match in CHECKLIST_ITEM.finditer(text):
+        pieces.append(text[start:match.end()])
+        start = match.end()
+    pieces.append(text[start:])
+
+    units = []
+    for piece in pieces:
+        for part in BOUNDARY_BEFORE.split(piece):
+            units.extend(s.strip() for s in SENTENCE_END.split(part) if s.strip())
+    return units
+
+
+def pack_units(units, max_chars):
+    """
+    Greedily join consecutive units into chunks of at most `max_chars`.
+    A unit longer than `max_chars` on its own is cut with the fixed
+    splitter, without overlap.
+    """
+    chunks = []
+    current = ""
+    for unit in units:
+        if len(unit) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(fixed_split(unit, max_chars, 0))
+        elif not current:
+            current = unit
+        elif len(current) + 1 + len(unit) <= max_chars:
+            current += " " + unit
+        else:
+            chunks.append(current)
+            current = unit
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def fixed_split(text, chunk_size=FIXED_CHUNK_SIZE, chunk_overlap=FIXED_CHUNK_OVERLAP):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.split_text(text)
+
+
+# ======================================================================
+# ------------------------------ CHUNKERS -------------------------------
+# ======================================================================
+
+def shorten_columns(columns, room):
+    """Column names joined by ", " in at most `room` characters, ending in "… N more columns" if cut."""
+    shown = len(columns)
+    header = ", ".join(columns)
+    while shown and len(header) > room:
+        shown -= 1
+        header = ", ".join(columns[:shown] + [f"… {len(columns) - shown} more columns"])
+    return header
+
+
+def table_summary(title, description, section, table_text):
+    """
+    One chunk per table: what it is and which columns it has. The rows
+    stay in the CSV, which the context step attaches (or looks up in).
+
+    Kept within MAX_CHUNK_CHARS: columns that do not fit are counted
+    ("… 12 more columns"), and a description too long to leave room
+    for them is cut.
+    """
+    columns, rows_line = [], None
+    if table_text:
+        rows = list(csv.reader(io.StringIO(table_text)))
+        if rows:
+            columns = [cell.strip() for cell in rows[0] if cell.strip()]
+            first_column = [row[0].strip() for row in rows[1:] if row and row[0].strip()]
+            if first_column:
+                rows_line = f"Rows ({len(first_column)}): {first_column[0]} … {first_column[-1]}"
+
+    def join(*parts):
+        return "\n\n".join(p for p in parts if p)
+
+    # Up to a third of the chunk is kept for the columns before the description is cut
+    columns_line = "Columns: " + shorten_columns(columns, MAX_CHUNK_CHARS // 3) if columns else None
+    room = MAX_CHUNK_CHARS - len(join(title, "x", section, columns_line, rows_line)) + 1
+    if description and len(description) > room:
+        description = description[:max(room - 1, 0)].rstrip() + "…"
+
+    if columns:
+        room = MAX_CHUNK_CHARS - len(join(title, description, section, "Columns: ", rows_line))
+        columns_line = "Columns: " + shorten_columns(columns, room)
+    return join(title, description, section, columns_line, rows_line)[:MAX_CHUNK_CHARS]
+
+
+def structured_chunks(obj_type, title=None, description=None, section=None, table_text=""):
+    """
+    Type-aware chunking of one source record.
+
+      • table    — a single summary chunk (see table_summary)
+      • otherwise — the whole record when it fits in MAX_CHUNK_CHARS,
+        else its body packed into chunks at item / sentence boundaries,
+        each starting with the record's heading
+
+    Returns:
+        list[str] — chunk texts
+    """
+    if obj_type == "table":
+        return [table_summary(title, description, section, table_text)]
+
+    heading = "\n\n".join(dict.fromkeys(p for p in (title, section) if p))
+    body = normalize_text(description or "")
+    whole = "\n\n".join(p for p in (heading, body) if p)
+    if len(whole) <= MAX_CHUNK_CHARS:
+        return [whole] if whole else []
+
+    room = MAX_CHUNK_CHARS - len(heading) - 2
+    return [
+        "\n\n".join(p for p in (heading, chunk) if p)
+        for chunk in pack_units(split_units(body), room)
+    ]
+
+
+def fixed_chunks(obj_type, title=None, description=None, section=None, table_text=""):
+    """The original chunking: title + description + section + CSV, cut every 800 chars."""
+    text = "\n\n".join(p for p in (title, description, section, table_text) if p)
+    return fixed_split(text) if text else []
+
+
+CHUNKERS = {
+    "structure": structured_chunks,
+    "fixed": fixed_chunks,
+}
@@ -0,0 +1,42 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.runnables import RunnableLambda
+
+
+def create_executor(max_workers):
+    """
+    Create the bounded thread pool used for CPU-bound pipeline steps
+    (query embedding, vector search, re-ranking, table parsing).
+
+    Inputs:
+        max_workers (int): maximum number of steps running at once
+
+    Returns:
+        ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix="rag-cpu",
+    )
+
+
+def offload(func, executor=None):
+    """
+    Wrap a blocking function as a Runnable.
+
+    The sync path calls the function directly. The async path runs it
+    on the given executor so the event loop is never blocked.
+
+    Inputs:
+        func (callable): blocking function of one argument
+        executor (Executor | None): pool to run on (None = loop default)
+
+    Returns:
+        RunnableLambda
+    """
+    async def afunc(inputs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, inputs)
+
+    return RunnableLambda(func, afunc=afunc, name=func.__name__)
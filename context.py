@@ -0,0 +1,177 @@
+import math
+
+from table_lookup import lookup_engine
+from utils import TABLE_FORMATS, clean_tokenize
+import utils
+
+# Rendering used when the configured table format does not fit the budget
+COMPACT_TABLE_FORMAT = "tsv"
+
+# Between two chunks in the prompt's context
+CHUNK_SEPARATOR = "\n\n---\n\n"
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token for English text)."""
+    return math.ceil(len(text) / 4)
+
+
+def is_near_duplicate(tokens, selected_token_sets, threshold):
+    """
+    True if at least `threshold` of `tokens` already appear in one
+    selected chunk, e.g. an overlapping splitter window of the same record.
+    """
+    if not tokens:
+        return True
+    return any(
+        len(tokens & chosen) / len(tokens) >= threshold
+        for chosen in selected_token_sets
+    )
+
+
+def chunk_label(doc):
+    """Short source line sent before a chunk, e.g. "[page 42 · Flap Retraction]"."""
+    page = doc.metadata.get("page_number")
+    heading = doc.metadata.get("title") or doc.metadata.get("section")
+    parts = [f"page {page}" if page is not None else None, heading]
+    return "[" + " · ".join(str(p) for p in parts if p) + "]"
+
+
+def record_key(doc):
+    """
+    The source record a chunk was split from: its chunk_key without the
+    trailing chunk number ("file|page|title|3" → "file|page|title").
+    None for chunks stored without a chunk_key.
+    """
+    chunk_key = doc.metadata.get("chunk_key")
+    if not chunk_key:
+        return None
+    return chunk_key.rsplit("|", 1)[0]
+
+
+def render_lookup(csv_path, query):
+    """
+    "[TABLE_LOOKUP]\\n<cell + provenance>" when `query` pins down a cell
+    of a performance-dispatch table, else "".
+    """
+    try:
+        result = lookup_engine.lookup_query(csv_path, query)
+    except Exception:
+        print("There was an error looking up the table", csv_path)
+        return ""
+    if result is None:
+        return ""
+    return f"\n\n[TABLE_LOOKUP]\n{result.render()}"
+
+
+def render_table(csv_path, remaining, query=None):
+    """
+    Return "[TAG]\\n<table>" for the configured format, or the compact
+    format if the configured one does not fit in `remaining` tokens.
+    Returns "" if neither fits or the CSV is missing.
+
+    With a `query` that names the cell it wants (e.g. "at 30°C and
+    2000 ft"), only the looked-up value and its source cells are
+    returned instead of the whole table.
+    """
+    if query:
+        block = render_lookup(csv_path, query)
+        if block and estimate_tokens(block) <= remaining:
+            return block
+
+    cache = utils.table_cache
+    formats = [cache.fmt]
+    if cache.fmt != COMPACT_TABLE_FORMAT:
+        formats.append(COMPACT_TABLE_FORMAT)
+
+    for fmt in formats:
+        try:
+            rendered = cache.get(csv_path, fmt)
+        except Exception:
+            print("There was an error parsing the content of the table for table", csv_path)
+            return ""
+        if rendered is None:
+            return ""
+
+        tag, _ = TABLE_FORMATS[fmt]
+        block = f"\n\n[{tag}]\n{rendered}"
+        if estimate_tokens(block) <= remaining:
+            return block
+
+    return ""
+
+
+def build_context(inputs):
+    """
+    Fill a token budget with re-ranked chunks, best first.
+
+      • chunks that are near-duplicates of an already selected chunk
+        of the same record (overlapping windows) are skipped; chunks of
+        different records — e.g. two tables with the same header — are
+        always kept
+      • a chunk that does not fit is skipped; later (smaller) ones may
+        still fit
+      • each table is attached once, in the configured rendering or
+        the compact one when that is what fits — or, for a numeric
+        question on a performance table, just the looked-up cell
+
+    The context sent to the LLM is `text`: each chunk's label and
+    content, nothing from its metadata. The budget is counted on that
+    text, so `tokens` is what the prompt really carries.
+
+    Inputs:
+        inputs (dict):
+            {
+                "docs": list[Document] (best first),
+                "budget": int (max context tokens),
+                "query": str (optional, enables table lookups),
+                "dedup_threshold": float (optional, default 0.8)
+            }
+
+    Returns:
+        dict:
+            {
+                "docs": list[Document] (copies, tables attached),
+                "text": str (the context for the prompt),
+                "tokens": int (estimated tokens of `text`)
+            }
+    """
+    budget = inputs["budget"]
+    threshold = inputs.get("dedup_threshold", 0.8)
+    query = inputs.get("query")
+
+    selected = []
+    blocks = []
+    selected_token_sets = {}   # record key -> token sets of its selected chunks
+    attached_tables = set()
+    used = 0
+
+    for doc in inputs["docs"]:
+        tokens = set(clean_tokenize(doc.page_content))
+        record = record_key(doc)
+        if record is not None and is_near_duplicate(tokens, selected_token_sets.get(record, []), threshold):
+            continue
+
+        block = f"{chunk_label(doc)}\n{doc.page_content}"
+        cost = estimate_tokens(CHUNK_SEPARATOR + block)
+        if used + cost > budget:
+            continue
+
+        content = doc.page_content
+        csv_path = doc.metadata.get("csv_path")
+        if doc.metadata.get("type") == "table" and csv_path and csv_path not in attached_tables:
+            table_block = render_table(csv_path, budget - used - cost, query)
+            if table_block:
+                attached_tables.add(csv_path)
+                content += table_block
+                block += table_block
+                cost += estimate_tokens(table_block)
+
+        selected.append(doc.model_copy(update={"page_content": content}))
+        blocks.append(block)
+        if record is not None:
+            selected_token_sets.setdefault(record, []).append(tokens)
+        used += cost
+
+    text = CHUNK_SEPARATOR.join(blocks)
+    return {"docs": selected, "text": text, "tokens": estimate_tokens(text)}
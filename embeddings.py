@@ -1,10 +1,42 @@
 
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 import os
+import platform
+import time
 from pathlib import Path
 
-def load_embeddings(env=None):
+# langchain_chroma / langchain_huggingface (and torch behind them) are
+# imported inside the functions that need them, so importing this
+# module stays cheap and the API can start serving probes right away.
+
+MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+
+
+# Serving backends for the query model (EMBEDDING_BACKEND):
+#   torch     — full-precision PyTorch (default, also used for indexing)
+#   onnx      — ONNX Runtime export of the same weights
+#   onnx-int8 — dynamically int8-quantized ONNX export
+# The ONNX files ship with the model on the Hugging Face hub; loading them
+# needs the ONNX extra of sentence-transformers (optimum + optimum-onnx,
+# pinned in requirements.txt).
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def default_int8_file():
+    """Quantized ONNX file matching this CPU (overridable with EMBEDDING_ONNX_FILE)."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "onnx/model_qint8_arm64.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+def embedding_namespace(backend="torch"):
+    """
+    Cache namespace for vectors produced by `backend`. Torch keeps the
+    bare model name so existing caches stay valid.
+    """
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}:{backend}"
+
+
+def load_embeddings(env=None, batch_size=32, num_threads=None, backend=None):
     """
     Load the all-mpnet-base-v2 embedding model and store/cache it
     in a 'models' folder located next to this embeddings.py file.
@@ -12,7 +44,17 @@ def load_embeddings(env=None):
     Structure:
         embeddings.py
         models/
+
+    Inputs:
+        env (dict | None): EMBEDDING_BACKEND / EMBEDDING_ONNX_FILE are read from it
+        batch_size (int): texts per forward pass in embed_documents
+        num_threads (int | None): torch intra-op threads (None = torch default)
+        backend (str | None): "torch", "onnx" or "onnx-int8"; overrides env
     """
+    env = env or {}
+    backend = backend or env.get("EMBEDDING_BACKEND") or "torch"
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected one of {EMBEDDING_BACKENDS}")
 
     # Folder where this file lives (e.g. .../boeing_737/)
     module_dir = Path(__file__).resolve().parent
@@ -26,15 +68,67 @@ def load_embeddings(env=None):
     # Tell HuggingFace to use this folder for caching models
     os.environ["HF_HOME"] = str(model_dir)
 
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    model_kwargs = {"device": "cpu"}
+    if backend == "torch":
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+    else:
+        model_kwargs["backend"] = "onnx"
+        file_name = "onnx/model.onnx"
+        if backend == "onnx-int8":
+            file_name = env.get("EMBEDDING_ONNX_FILE") or default_int8_file()
+        model_kwargs["model_kwargs"] = {"file_name": file_name}
+
     embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-mpnet-base-v2",
-        model_kwargs={"device": "cpu"}  
+        model_name=MODEL_NAME,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": batch_size},
     )
 
-    print(f"✔ Embedding model will be stored at: {model_dir}")
+    print(f"✔ Embedding model ({backend}) will be stored at: {model_dir}")
     return embeddings
 
 
+def load_indexing_embeddings(batch_size=64, num_threads=None, cache_dir=None):
+    """
+    Embeddings tuned for build_vector_store.py.
+
+    Uses large batches, all CPU cores by default, and an on-disk cache
+    keyed by model name + SHA-256 of the text. Re-indexing (or moving to
+    another vector store) never recomputes an embedding that is already
+    in the cache.
+
+    Inputs:
+        batch_size (int): texts per forward pass
+        num_threads (int | None): torch threads (None = every core)
+        cache_dir (str | Path | None): cache folder
+                  (None = 'embedding_cache' next to this file)
+
+    Returns:
+        CacheBackedEmbeddings
+    """
+    from langchain_classic.embeddings import CacheBackedEmbeddings
+    from langchain_classic.storage import LocalFileStore
+
+    embeddings = load_embeddings(
+        batch_size=batch_size,
+        num_threads=num_threads or os.cpu_count(),
+    )
+
+    if cache_dir is None:
+        cache_dir = Path(__file__).resolve().parent / "embedding_cache"
+
+    return CacheBackedEmbeddings.from_bytes_store(
+        embeddings,
+        LocalFileStore(str(cache_dir)),
+        namespace=embedding_namespace("torch"),
+        key_encoder="sha256",
+    )
+
+
 def load_vector_db(env, embeddings):
     """
     Load persistent Chroma vector store.
@@ -46,7 +140,48 @@ def load_vector_db(env, embeddings):
     Returns:
         Chroma vector database
     """
+    from langchain_chroma import Chroma
+
     return Chroma(
         persist_directory=env["PERSIST_DIR"],
         embedding_function=embeddings,
     )
+
+
+def warm_up(vectordb):
+    """
+    Run one synthetic query through embedding + vector search so the
+    first real request does not pay for model / index warmup.
+    """
+    vectordb.similarity_search_with_relevance_scores(
+        "What is the flap retraction schedule after takeoff?", k=1
+    )
+
+
+INDEX_VERSION_FILE = "index_version"
+
+
+def mark_index_updated(persist_dir):
+    """
+    Record that the vector store in `persist_dir` was (re)built.
+    Anything derived from the store (e.g. cached answers) uses this
+    marker to detect that it is stale.
+
+    Inputs:
+        persist_dir (str | Path): Chroma persist directory
+    """
+    marker = Path(persist_dir) / INDEX_VERSION_FILE
+    marker.parent.mkdir(parents=True, exist_ok=True)
+    marker.write_text(str(time.time_ns()), encoding="utf-8")
+
+
+def read_index_version(persist_dir):
+    """
+    Return the version marker written by mark_index_updated(),
+    or None if the store has never been marked.
+    """
+    marker = Path(persist_dir) / INDEX_VERSION_FILE
+    try:
+        return marker.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
@@ -2,6 +2,45 @@ import os
 from dotenv import load_dotenv
 
 
+# Optional tuning knobs. Each can be overridden from the environment
+# (or .env); values are returned as strings like the required ones.
+DEFAULTS = {
+    "LLM_MAX_CONCURRENCY": "4",   # in-flight Gemini calls per worker
+    "CPU_WORKERS": "4",           # threads for embedding / re-ranking
+    "ANSWER_CACHE_SIZE": "256",   # cached answers (0 disables the cache)
+    "ANSWER_CACHE_TTL": "3600",   # seconds before a cached answer expires
+    "ANSWER_CACHE_THRESHOLD": "0.92",  # cosine similarity for a semantic hit
+    "TABLE_FORMAT": "html",       # table rendering given to the LLM: html | markdown | tsv
+    "CONTEXT_TOKEN_BUDGET": "4000",  # max estimated tokens of retrieved context per request
+    "BATCH_MAX_CONCURRENCY": "8", # questions generated at once by /ask/batch
+    "QUERY_EMBEDDING_CACHE_SIZE": "1024",  # query vectors kept in memory (0 disables the cache)
+    "QUERY_EMBEDDING_CACHE_DB": "",  # SQLite file shared by all workers ("" = memory only)
+    "EMBEDDING_BACKEND": "torch", # query embedding backend: torch | onnx | onnx-int8
+    "EMBEDDING_ONNX_FILE": "",    # quantized ONNX file for onnx-int8 ("" = pick by CPU)
+    "ROUTE_QUERIES": "1",         # narrow the search by intents found in the question (0 = off)
+    "VECTOR_STORE": "chroma",     # chroma | mmap (memory-mapped serving index shared by workers)
+                                  # | numpy (whole store in memory, exact search)
+    "LLM_DEADLINE": "60",         # seconds before an LLM call (or its first token) is abandoned
+    "LLM_HEDGE_QUANTILE": "0.95", # latency quantile after which a hedged request is sent (0 = off)
+    "LLM_BREAKER_FAILURES": "5",  # consecutive LLM failures that open the circuit breaker
+    "LLM_BREAKER_RESET": "30",    # seconds the breaker stays open (answers list pages only)
+    "FAKE_LLM_URL": "",           # use fake_llm_server.py instead of Gemini (testing only)
+    "INDEX_VERSIONS_DIR": "index_versions",  # where ingest jobs build index versions (ingest.py)
+    "INDEX_POLL_SECONDS": "10",   # how often workers check for a newly published version (0 = off)
+    "INDEX_CLOSE_GRACE_SECONDS": "5",  # after a swap, time for running retrievals before the old store is closed
+    "INGEST_BATCH_SIZE": "64",    # chunks per embedding call in ingest jobs
+    "INGEST_EMBED_WORKERS": "1",  # embedding threads per ingest job (torch already uses every core)
+    "INGEST_KEEP_VERSIONS": "3",  # index versions kept on disk
+    "RERANKER_MODEL": "",         # cross-encoder for a second re-ranking stage ("" = off),
+                                  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+    "RERANK_CANDIDATES": "16",    # heuristic top chunks scored by the cross-encoder
+    "RERANK_TOP_K": "4",          # chunks kept after cross-encoder scoring
+    "RERANK_BUDGET_MS": "250",    # scoring slower than this falls back to the heuristic order
+    "RERANK_EARLY_EXIT_MARGIN": "4.0",  # score lead at which only the best chunk is kept
+    "RERANK_CACHE_SIZE": "4096",  # cached (query, chunk) scores
+}
+
+
 def load_env():
     """
     Load required environment variables.
@@ -10,7 +49,7 @@ def load_env():
         None
 
     Returns:
-        dict with , PERSIST_DIR, GEMINI_API
+        dict with , PERSIST_DIR, GEMINI_API and every key in DEFAULTS
     """
     load_dotenv()
     names = [ "PERSIST_DIR","GEMINI_API"]
@@ -19,4 +58,8 @@ def load_env():
     if missing:
         raise ValueError(f"FATAL: Missing env variables: {missing}")
 
-    return {name: os.environ[name] for name in names}
+    env = {name: os.environ[name] for name in names}
+    for name, default in DEFAULTS.items():
+        env[name] = os.environ.get(name, default)
+
+    return env
@@ -1,42 +1,87 @@
 import fitz
 import json
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+
+
+# ======================================================================
+# ---------------------------- PAGE PARSING -----------------------------
+# ======================================================================
+
+class Span(NamedTuple):
+    """One text span of a page, reduced to the fields we use."""
+    page: int
+    y0: float       # vertical start position
+    text: str       # stripped text
+    size: float
+    font: str
+
+
+def parse_page_spans(page, page_num: int) -> list[Span]:
+    """
+    Parse a page once into a flat list of spans, in PyMuPDF's
+    block / line / span order.
+    """
+    spans = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                spans.append(Span(
+                    page=page_num,
+                    y0=span["bbox"][1],
+                    text=span["text"].strip(),
+                    size=span["size"],
+                    font=span["font"],
+                ))
+    return spans
+
+
+def parse_spans(doc, start_page: int, end_page: int) -> dict[int, list[Span]]:
+    """
+    Parse every page in [start_page, end_page] exactly once.
+
+    Returns:
+        dict page_num -> list[Span]
+    """
+    return {
+        page_num: parse_page_spans(doc[page_num], page_num)
+        for page_num in range(start_page, end_page + 1)
+    }
+
 
 # ======================================================================
 # ------------------------- HEADER DETECTION ----------------------------
 # ======================================================================
 
-def is_header(span_text: str, span: dict) -> bool:
+def is_header(span: Span) -> bool:
     """
     Detect whether a piece of text represents a real section header.
     """
-    correct_size = (span["size"] == 12.0)
-    bold_font = ("Bold" in span["font"])
-    not_np = not span_text.startswith("NP.")
-    not_copyright = "Copyright" not in span_text
+    correct_size = (span.size == 12.0)
+    bold_font = ("Bold" in span.font)
+    not_np = not span.text.startswith("NP.")
+    not_copyright = "Copyright" not in span.text
 
     return correct_size and bold_font and not_np and not_copyright
 
 
-def collect_headers(doc, start_page: int, end_page: int):
+def collect_headers(pages: dict[int, list[Span]]):
     """
-    Scan pages and collect all header spans.
+    Scan the parsed pages and collect all header spans.
     """
     headers = []
 
-    for page_num in range(start_page, end_page + 1):
-        page = doc[page_num]
-        blocks = page.get_text("dict")["blocks"]
-
-        for block in blocks:
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    text = span["text"].strip()
-                    if is_header(text, span):
-                        headers.append({
-                            "page": page_num,
-                            "y0": span["bbox"][1],  # vertical start position
-                            "text": text
-                        })
+    for page_num, spans in pages.items():
+        for span in spans:
+            if is_header(span):
+                headers.append({
+                    "page": page_num,
+                    "y0": span.y0,  # vertical start position
+                    "text": span.text
+                })
 
     return headers
 
@@ -69,7 +114,7 @@ def is_boilerplate(text: str) -> bool:
     return any(patterns)
 
 
-def extract_text_by_range(doc, start_header, end_header) -> str:
+def extract_text_by_range(pages, start_header, end_header) -> str:
     """
     Extracts text based on the specific start and end coordinates.
     It determines the specific valid Y-range for the current page
@@ -85,9 +130,6 @@ def extract_text_by_range(doc, start_header, end_header) -> str:
 
     # Iterate only through the specific pages involved in this section
     for page_num in range(start_pg, end_pg + 1):
-        page = doc[page_num]
-        blocks = page.get_text("dict")["blocks"]
-
         # Define boundaries for the current page
         current_min_y = 0
         current_max_y = float('inf')
@@ -98,19 +140,14 @@ def extract_text_by_range(doc, start_header, end_header) -> str:
         if page_num == end_pg:
             current_max_y = end_y
 
-        for block in blocks:
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    y = span["bbox"][1]
-                    text = span["text"].strip()
+        for span in pages[page_num]:
+            # 1. Check if text is within the vertical boundaries of this page
+            # We use > and < strictly to avoid including the headers themselves
+            if current_min_y < span.y0 < current_max_y:
 
-                    # 1. Check if text is within the vertical boundaries of this page
-                    # We use > and < strictly to avoid including the headers themselves
-                    if current_min_y < y < current_max_y:
-                        
-                        # 2. Clean up and boilerplate check
-                        if text and not is_boilerplate(text):
-                            extracted_parts.append(text)
+                # 2. Clean up and boilerplate check
+                if span.text and not is_boilerplate(span.text):
+                    extracted_parts.append(span.text)
 
     return " ".join(extracted_parts).strip()
 
@@ -132,8 +169,12 @@ def extract_chunks_by_headers(
 
     doc = fitz.open(pdf_path)
 
+    # Step 0 — Parse every page once; both steps below reuse the spans
+    pages = parse_spans(doc, start_page, end_page)
+    doc.close()
+
     # Step 1 — Detect headers
-    headers = collect_headers(doc, start_page, end_page)
+    headers = collect_headers(pages)
 
     # Step 2 — Sort in reading order
     headers.sort(key=lambda h: (h["page"], h["y0"]))
@@ -148,7 +189,7 @@ def extract_chunks_by_headers(
         end = headers[i + 1]
 
     
-        section_text = extract_text_by_range(doc, start, end)
+        section_text = extract_text_by_range(pages, start, end)
 
         if section_text:
             chunks.append({
@@ -167,20 +208,178 @@ def extract_chunks_by_headers(
 
 
 # ======================================================================
-# ---------------------------- EXAMPLE USE ------------------------------
+# ----------------------- STREAMING / PARALLEL --------------------------
 # ======================================================================
 
-if __name__ == "__main__":
-    chunks = extract_chunks_by_headers(
-        "raw_documents/boeing_manual.pdf",
-        start_page=0, 
-        end_page=145,
-        save_to_json=True
+def parse_page_range(pdf_path, start_page: int, end_page: int) -> dict[int, list[Span]]:
+    """
+    Worker task: open the PDF and parse one page range.
+    Runs in a separate process, so it takes a path, not a Document.
+    """
+    with fitz.open(pdf_path) as doc:
+        return parse_spans(doc, start_page, end_page)
+
+
+def iter_parsed_pages(pdf_path, start_page, end_page, executor=None,
+                      pages_per_task=8, max_in_flight=8):
+    """
+    Yield (page_num, spans) in page order.
+
+    With an executor, page ranges of `pages_per_task` pages are parsed
+    in parallel, with at most `max_in_flight` ranges pending, so memory
+    stays bounded however long the document is.
+    """
+    if executor is None:
+        with fitz.open(pdf_path) as doc:
+            for page_num in range(start_page, end_page + 1):
+                yield page_num, parse_page_spans(doc[page_num], page_num)
+        return
+
+    ranges = deque(
+        (first, min(first + pages_per_task - 1, end_page))
+        for first in range(start_page, end_page + 1, pages_per_task)
     )
+    pending = deque()
+
+    while ranges or pending:
+        while ranges and len(pending) < max_in_flight:
+            first, last = ranges.popleft()
+            pending.append(executor.submit(parse_page_range, pdf_path, first, last))
 
-    for chunk in chunks:
-        print("=" * 80)
-        print(f"Section: {chunk['section']}")
-        print(f"Page: {chunk['page_number']}")
-        print("Text preview:")
-        print(chunk['description'][:200] + "...")
\ No newline at end of file
+        # Results are consumed in submission order -> deterministic output
+        yield from pending.popleft().result().items()
+
+
+def iter_chunks_by_headers(pdf_path, start_page, end_page, executor=None,
+                           pages_per_task=8, max_in_flight=8):
+    """
+    Streaming version of extract_chunks_by_headers().
+
+    Yields exactly the chunks (and in the same order) that the
+    sequential function returns for the same page range, but only keeps
+    the pages of the section currently being read in memory.
+    """
+    buffered = {}          # page_num -> spans, from the open header's page on
+    open_header = None
+
+    def make_chunk(start, end):
+        section_text = extract_text_by_range(buffered, start, end)
+        if section_text:
+            return {
+                "section": start["text"],
+                "page_number": start["page"] + 1,
+                "description": section_text
+            }
+        return None
+
+    for page_num, spans in iter_parsed_pages(
+        pdf_path, start_page, end_page, executor, pages_per_task, max_in_flight
+    ):
+        buffered[page_num] = spans
+
+        page_headers = collect_headers({page_num: spans})
+        page_headers.sort(key=lambda h: h["y0"])
+
+        for header in page_headers:
+            if open_header is not None:
+                chunk = make_chunk(open_header, header)
+                if chunk:
+                    yield chunk
+            open_header = header
+
+        # Drop pages no future section can reach
+        keep_from = open_header["page"] if open_header else page_num + 1
+        for old_page in [p for p in buffered if p < keep_from]:
+            del buffered[old_page]
+
+    if open_header is not None:
+        end = add_end_boundary([], end_page)[0]
+        chunk = make_chunk(open_header, end)
+        if chunk:
+            yield chunk
+
+
+def parse_page_spec(spec: str, page_count: int) -> tuple[int, int]:
+    """'START-END' (0-based, inclusive) or 'all' -> (start, end)."""
+    if spec == "all":
+        return 0, page_count - 1
+    start, _, end = spec.partition("-")
+    return int(start), min(int(end or start), page_count - 1)
+
+
+def extract_to_jsonl(pdf_paths, output_file, pages="all", workers=1, pages_per_task=8):
+    """
+    Extract several manuals into one JSON Lines file.
+
+    Chunks are written as soon as they are complete; each line also
+    carries the `source` PDF file name. Documents are processed in the
+    given order, so the output is deterministic for any worker count.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    written = 0
+    try:
+        with open(output_file, "w", encoding="utf-8") as f:
+            for pdf_path in pdf_paths:
+                with fitz.open(pdf_path) as doc:
+                    start_page, end_page = parse_page_spec(pages, len(doc))
+
+                for chunk in iter_chunks_by_headers(
+                    pdf_path, start_page, end_page, executor,
+                    pages_per_task=pages_per_task,
+                    max_in_flight=2 * workers,
+                ):
+                    record = {"source": Path(pdf_path).name, **chunk}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    written += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print(f"Saved {written} chunks from {len(pdf_paths)} document(s) to {output_file}")
+    return written
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+#   python extract_text.py                                   # Boeing manual -> texts_updated.json
+#   python extract_text.py fcom.pdf qrh.pdf --workers 4 --output manuals.jsonl
+#   python extract_text.py fcom.pdf --pages 10-80 --output fcom_part.jsonl
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract header-delimited text chunks from PDFs.")
+    parser.add_argument("pdfs", nargs="*", default=["raw_documents/boeing_manual.pdf"])
+    parser.add_argument("--pages", default="all",
+                        help="0-based inclusive page range 'START-END', or 'all'")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to parse pages")
+    parser.add_argument("--pages-per-task", type=int, default=8)
+    parser.add_argument("--output", default=None,
+                        help="JSON Lines output (default: texts_updated.json for one PDF)")
+    args = parser.parse_args()
+
+    if args.output is None and len(args.pdfs) == 1:
+        with fitz.open(args.pdfs[0]) as doc:
+            start_page, end_page = parse_page_spec(args.pages, len(doc))
+        chunks = extract_chunks_by_headers(
+            args.pdfs[0],
+            start_page=start_page,
+            end_page=end_page,
+            save_to_json=True
+        )
+
+        for chunk in chunks:
+            print("=" * 80)
+            print(f"Section: {chunk['section']}")
+            print(f"Page: {chunk['page_number']}")
+            print("Text preview:")
+            print(chunk['description'][:200] + "...")
+    else:
+        extract_to_jsonl(
+            args.pdfs,
+            args.output or "texts_updated.jsonl",
+            pages=args.pages,
+            workers=args.workers,
+            pages_per_task=args.pages_per_task,
+        )
@@ -0,0 +1,403 @@
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import Runnable
+
+# A local stand-in for the Gemini API, used to check resilience.py
+# against latency spikes, hangs and errors without network access or
+# an API key. httpx (installed with langchain) is imported by the client.
+
+DEFAULT_ANSWER = "The flaps are retracted on the flap retraction schedule as speed increases."
+
+
+# ======================================================================
+# ------------------------------- SERVER --------------------------------
+# ======================================================================
+#
+#   POST /chat     {"prompt": str, "stream": bool}
+#                  → {"text": str}, or one {"text": str} line per word
+#   POST /control  set the behaviour (any subset of the keys below);
+#                  also restarts the request numbering used by spike_every
+#   GET  /stats    {"requests": int, "since_control": int}
+#
+# Behaviour:
+#   latency        seconds before the answer (or its first word)
+#   spike_every    request 0, N, 2N, ... after /control is slow (0 = never)
+#   spike_latency  seconds those requests take instead
+#   hang           never answer, until switched off again
+#   error_rate     fraction of requests answered with HTTP 500
+#   word_delay     seconds between streamed words
+#   answer         the answer text
+
+DEFAULT_BEHAVIOUR = {
+    "latency": 0.05,
+    "spike_every": 0,
+    "spike_latency": 2.0,
+    "hang": False,
+    "error_rate": 0.0,
+    "word_delay": 0.0,
+    "answer": DEFAULT_ANSWER,
+}
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeLLMHandler)
+        self.behaviour = dict(DEFAULT_BEHAVIOUR)
+        self.requests = 0
+        self.since_control = 0
+        self.lock = threading.Lock()
+        self.stopping = False
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_request(self):
+        """Count a /chat request; returns (behaviour, number since /control)."""
+        with self.lock:
+            self.requests += 1
+            number = self.since_control
+            self.since_control += 1
+            return dict(self.behaviour), number
+
+    def control(self, changes):
+        with self.lock:
+            unknown = set(changes) - set(DEFAULT_BEHAVIOUR)
+            if unknown:
+                raise ValueError(f"unknown keys: {sorted(unknown)}")
+            self.behaviour.update(changes)
+            self.since_control = 0
+            return dict(self.behaviour)
+
+    def is_hanging(self):
+        with self.lock:
+            return self.behaviour["hang"] and not self.stopping
+
+    def handle_error(self, request, client_address):
+        # Abandoned attempts (deadline, losing hedge) hang up early
+        pass
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path != "/stats":
+            return self._json(404, {"error": "not found"})
+        with self.server.lock:
+            stats = {"requests": self.server.requests, "since_control": self.server.since_control}
+        self._json(200, stats)
+
+    def do_POST(self):
+        if self.path == "/control":
+            try:
+                return self._json(200, self.server.control(self._body()))
+            except ValueError as e:
+                return self._json(400, {"error": str(e)})
+        if self.path != "/chat":
+            return self._json(404, {"error": "not found"})
+
+        request = self._body()
+        behaviour, number = self.server.next_request()
+
+        if behaviour["hang"]:
+            while self.server.is_hanging():
+                time.sleep(0.02)
+            return
+        spiked = behaviour["spike_every"] and number % behaviour["spike_every"] == 0
+        time.sleep(behaviour["spike_latency"] if spiked else behaviour["latency"])
+        if random.random() < behaviour["error_rate"]:
+            return self._json(500, {"error": "simulated failure"})
+
+        if not request.get("stream"):
+            return self._json(200, {"text": behaviour["answer"]})
+
+        # No Content-Length: the body ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for i, word in enumerate(behaviour["answer"].split(" ")):
+            if i and behaviour["word_delay"]:
+                time.sleep(behaviour["word_delay"])
+            piece = word if i == 0 else " " + word
+            self.wfile.write(json.dumps({"text": piece}).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def start_server(host="127.0.0.1", port=0):
+    """
+    Start the fake server on a background thread.
+
+    Returns:
+        FakeLLMServer (see .url; stop with stop_server)
+    """
+    server = FakeLLMServer((host, port))
+    threading.Thread(target=server.serve_forever, name="fake-llm", daemon=True).start()
+    return server
+
+
+def stop_server(server):
+    with server.lock:
+        server.stopping = True
+    server.shutdown()
+    server.server_close()
+
+
+# ======================================================================
+# ------------------------------- CLIENT --------------------------------
+# ======================================================================
+
+def prompt_text(input):
+    """Prompt value, message list or string → plain text."""
+    if hasattr(input, "to_string"):
+        return input.to_string()
+    if isinstance(input, list):
+        return "\n".join(str(getattr(m, "content", m)) for m in input)
+    return str(input)
+
+
+class FakeServerLLM(Runnable):
+    """
+    Chat-model stand-in that calls the fake server over HTTP; returns
+    AIMessage / AIMessageChunk like ChatGoogleGenerativeAI.
+    """
+
+    def __init__(self, url, timeout=60.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def invoke(self, input, config=None, **kwargs):
+        import httpx
+
+        response = httpx.post(f"{self.url}/chat", json={"prompt": prompt_text(input)}, timeout=self.timeout)
+        response.raise_for_status()
+        return AIMessage(content=response.json()["text"])
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        import httpx
+
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(f"{self.url}/chat", json={"prompt": prompt_text(input)})
+        response.raise_for_status()
+        return AIMessage(content=response.json()["text"])
+
+    def stream(self, input, config=None, **kwargs):
+        import httpx
+
+        payload = {"prompt": prompt_text(input), "stream": True}
+        with httpx.stream("POST", f"{self.url}/chat", json=payload, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield AIMessageChunk(content=json.loads(line)["text"])
+
+    async def astream(self, input, config=None, **kwargs):
+        import httpx
+
+        payload = {"prompt": prompt_text(input), "stream": True}
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            async with client.stream("POST", f"{self.url}/chat", json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield AIMessageChunk(content=json.loads(line)["text"])
+
+
+# ======================================================================
+# ----------------------------- SELF-CHECK ------------------------------
+# ======================================================================
+
+def self_check():
+    """
+    Run ResilientLLM against the fake server: coalescing, queueing for a
+    concurrency slot without hitting the deadline, hedging on a
+    latency spike, the deadline on a hang, and the circuit breaker
+    degrading the pipeline to a sources-only answer and recovering after
+    a cancelled trial call.
+    """
+    import httpx
+    from langchain_core.documents import Document
+
+    from metrics import LLM_CALLS
+    from pipeline import build_generation_chain
+    from resilience import LLMUnavailable, ResilientLLM, is_sources_only
+
+    server = start_server()
+
+    def control(**changes):
+        httpx.post(f"{server.url}/control", json=changes).raise_for_status()
+
+    def requests():
+        return httpx.get(f"{server.url}/stats").json()["requests"]
+
+    def calls(result):
+        return LLM_CALLS._values.get((("result", result),), 0)
+
+    def resilient_llm(max_concurrency=16):
+        return ResilientLLM(
+            FakeServerLLM(server.url, timeout=10),
+            max_concurrency=max_concurrency,
+            deadline_seconds=1.0,
+            hedge_quantile=0.95,
+            hedge_min_samples=5,
+            failure_threshold=3,
+            reset_seconds=0.5,
+        )
+
+    async def run():
+        # Coalescing: identical concurrent prompts → one upstream call
+        llm = resilient_llm()
+        control(latency=0.3)
+        before = requests()
+        answers = await asyncio.gather(*(llm.ainvoke("same question") for _ in range(8)))
+        assert len({a.content for a in answers}) == 1
+        assert requests() - before == 1, requests() - before
+        print("✔ async: 8 identical concurrent calls → 1 upstream request")
+
+        before = requests()
+        await asyncio.gather(*(asyncio.to_thread(llm.invoke, "same sync question") for _ in range(4)))
+        assert requests() - before == 1, requests() - before
+        print("✔ sync: 4 identical concurrent calls → 1 upstream request")
+
+        # Queueing for a slot is not upstream latency: 10 calls through one
+        # slot take ~3s in total, yet none hits the 1s deadline
+        llm = resilient_llm(max_concurrency=1)
+        control(latency=0.3)
+        answers = await asyncio.gather(
+            *(llm.ainvoke(f"queued question {i}") for i in range(10)), return_exceptions=True
+        )
+        failed = [a for a in answers if isinstance(a, BaseException)]
+        assert not failed and llm.breaker.state == "closed", (failed, llm.breaker.state)
+        print("✔ queueing: 10 calls through 1 slot, none timed out, breaker closed")
+
+        # Hedging: learn the normal latency, then make the first attempt slow
+        llm = resilient_llm()
+        control(latency=0.05)
+        for i in range(8):
+            await llm.ainvoke(f"warm-up {i}")
+        assert llm.hedge_delay() is not None
+        control(latency=0.05, spike_every=2, spike_latency=0.9)
+        won = calls("hedge_won")
+        start = time.perf_counter()
+        await llm.ainvoke("spiked question")
+        elapsed = time.perf_counter() - start
+        assert calls("hedge_won") == won + 1 and elapsed < 0.5, elapsed
+        print(f"✔ latency spike hedged: answered in {elapsed:.2f}s instead of 0.9s")
+
+        control(latency=0.05, spike_every=2, spike_latency=0.9)
+        start = time.perf_counter()
+        chunks = [chunk.content async for chunk in llm.astream("spiked stream")]
+        assert "".join(chunks) == DEFAULT_ANSWER and time.perf_counter() - start < 0.5
+        print("✔ streaming: first token hedged, answer complete")
+
+        # Deadline: a hanging upstream is abandoned
+        control(hang=True)
+        start = time.perf_counter()
+        try:
+            await llm.ainvoke("hanging question")
+            raise AssertionError("hang was not abandoned")
+        except LLMUnavailable:
+            pass
+        elapsed = time.perf_counter() - start
+        assert elapsed < 1.3, elapsed
+        print(f"✔ hang abandoned after {elapsed:.2f}s (deadline 1s)")
+
+        # Breaker: failures open it, then the pipeline answers with pages only
+        control(hang=False, error_rate=1.0)
+        for i in range(3):
+            try:
+                await llm.ainvoke(f"failing question {i}")
+            except LLMUnavailable:
+                pass
+        assert llm.breaker.state == "open", llm.breaker.state
+
+        before = requests()
+        chain = build_generation_chain(llm, top_k=4, context_token_budget=1000)
+        doc = Document(
+            page_content="Flap retraction schedule ...",
+            metadata={"type": "text", "title": "Flap Retraction", "page_number": 42},
+            id="p42",
+        )
+        result = await chain.ainvoke({"query": "When are the flaps retracted?", "results": [(doc, 0.9)]})
+        assert requests() == before, "the open breaker still called the server"
+        assert is_sources_only(result["answer"]) and "page 42" in result["answer"], result["answer"]
+        print("✔ breaker open: answered with sources only, no upstream call")
+
+        # A cancelled trial call frees the half-open slot for the next one
+        control(error_rate=0.0, latency=0.3)
+        await asyncio.sleep(0.6)
+        trial = asyncio.ensure_future(llm.ainvoke("abandoned trial"))
+        await asyncio.sleep(0.05)
+        trial.cancel()
+        try:
+            await trial
+        except asyncio.CancelledError:
+            pass
+        assert llm.breaker.state == "half-open", llm.breaker.state
+        print("✔ cancelled trial call: breaker stays half-open, slot released")
+
+        # Recovery: the next trial call closes the breaker
+        control(latency=0.05)
+        await llm.ainvoke("recovered question")
+        assert llm.breaker.state == "closed"
+        print("✔ breaker closed again after a successful trial call")
+
+    try:
+        asyncio.run(run())
+    finally:
+        stop_server(server)
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# Check resilience.py (takes a few seconds):
+#   python fake_llm_server.py --check
+#
+# Or serve the API against the fake server and play with its behaviour:
+#   python fake_llm_server.py --port 8765
+#   FAKE_LLM_URL=http://127.0.0.1:8765 uvicorn main:app
+#   curl -X POST localhost:8765/control -d '{"latency": 0.5, "spike_every": 10}'
+#   curl -X POST localhost:8765/control -d '{"hang": true}'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake LLM server for resilience checks.")
+    parser.add_argument("--check", action="store_true", help="run the resilience self-check and exit")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.check:
+        self_check()
+    else:
+        server = FakeLLMServer((args.host, args.port))
+        print(f"Fake LLM server on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,571 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from build_vector_store import SOURCE_FILES, chunk_records, finalize_store
+from chunking import CHUNKING_STRATEGIES
+from metrics import INGEST_JOBS
+from utils import PROJECT_DIR
+
+# Chroma, the embedding model and extract_text (PyMuPDF) are imported
+# only when a job runs, so importing this module (main.py does) is cheap.
+
+# Every ingestion job builds a complete store (Chroma + BM25 + exports)
+# in its own folder under INDEX_VERSIONS_DIR; CURRENT names the one to serve.
+CURRENT_FILE = "CURRENT"
+
+# Job state, one <id>.json per job, so every worker can report every job
+JOBS_DIR = "jobs"
+
+SOURCE_SUFFIXES = (".json", ".jsonl", ".pdf")
+
+STAGES = ("extract", "chunk", "embed", "upsert")
+
+# Marks the end of a stage's input queue
+DONE = object()
+
+
+# ======================================================================
+# ---------------------------- INDEX VERSIONS ---------------------------
+# ======================================================================
+
+def read_current(versions_dir):
+    """Name of the version CURRENT points to, or None."""
+    try:
+        name = (Path(versions_dir) / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return name if name and (Path(versions_dir) / name).is_dir() else None
+
+
+def resolve_persist_dir(env):
+    """
+    The store to serve: the current ingested version if there is one,
+    else PERSIST_DIR (built by build_vector_store.py).
+    """
+    versions_dir = env.get("INDEX_VERSIONS_DIR", "index_versions")
+    current = read_current(versions_dir)
+    return str(Path(versions_dir) / current) if current else env["PERSIST_DIR"]
+
+
+def publish_version(versions_dir, name):
+    """Point CURRENT at `name`; readers see either the old or the new name."""
+    tmp = Path(versions_dir) / (CURRENT_FILE + ".tmp")
+    tmp.write_text(name, encoding="utf-8")
+    os.replace(tmp, Path(versions_dir) / CURRENT_FILE)
+
+
+def prune_versions(versions_dir, keep):
+    """Delete all but the `keep` newest versions (never the current one)."""
+    current = read_current(versions_dir)
+    versions = sorted(
+        (
+            p for p in Path(versions_dir).iterdir()
+            if p.is_dir() and not p.name.endswith(".tmp") and p.name != JOBS_DIR
+        ),
+        key=lambda p: p.name,
+        reverse=True,
+    )
+    for old in versions[keep:]:
+        if old.name != current:
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def save_job(versions_dir, job):
+    """Write the job's state to jobs/<id>.json (atomically, like CURRENT)."""
+    jobs_dir = Path(versions_dir) / JOBS_DIR
+    jobs_dir.mkdir(parents=True, exist_ok=True)
+    tmp = jobs_dir / f"{job.id}.json.tmp"
+    tmp.write_text(json.dumps(job.to_dict()), encoding="utf-8")
+    os.replace(tmp, jobs_dir / f"{job.id}.json")
+
+
+def load_job(versions_dir, job_id):
+    """A job's last saved state as a dict, or None."""
+    if not re.fullmatch(r"[0-9a-f]+", job_id):
+        return None
+    try:
+        return json.loads((Path(versions_dir) / JOBS_DIR / f"{job_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def load_jobs(versions_dir):
+    """Every saved job state, oldest first."""
+    jobs = [load_job(versions_dir, path.name[:-len(".json")])
+            for path in (Path(versions_dir) / JOBS_DIR).glob("*.json")]
+    return sorted((job for job in jobs if job), key=lambda job: job["created"])
+
+
+# ======================================================================
+# -------------------------------- STAGES -------------------------------
+# ======================================================================
+
+def resolve_sources(sources=None):
+    """
+    Source names (relative to the project folder) → paths. Only .json,
+    .jsonl and .pdf files inside the project folder are accepted, so
+    a job reads the same files whatever the working directory.
+
+    Returns:
+        list[Path]
+    """
+    if not sources:
+        sources = [name for name, _ in SOURCE_FILES]
+
+    root = PROJECT_DIR
+    paths = []
+    for source in sources:
+        path = (root / source).resolve()
+        if root not in path.parents or path.suffix not in SOURCE_SUFFIXES:
+            raise ValueError(f"Not an ingestible source: {source!r}")
+        if not path.is_file():
+            raise ValueError(f"Source not found: {source!r}")
+        paths.append(path)
+    return paths
+
+
+def extract_records(path):
+    """
+    extract: one source file → its records.
+
+      .json   — a list of objects (texts.json, tables.json, diagrams.json)
+      .jsonl  — one object per line (extract_text.py --output)
+      .pdf    — header-delimited sections, extracted with extract_text.py
+    """
+    if path.suffix == ".pdf":
+        from extract_text import iter_chunks_by_headers, parse_page_spec
+        import fitz
+
+        with fitz.open(path) as doc:
+            start_page, end_page = parse_page_spec("all", len(doc))
+        return [{"source": path.name, **chunk} for chunk in iter_chunks_by_headers(path, start_page, end_page)]
+
+    with path.open("r", encoding="utf-8") as f:
+        if path.suffix == ".jsonl":
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def source_type(path):
+    return dict(SOURCE_FILES).get(path.name, "text")
+
+
+def embed_batch(docs, embeddings, previous=None):
+    """
+    embed: vectors for a batch of chunks. Chunk ids are content hashes,
+    so a chunk already in the previous version keeps its vector.
+
+    Returns:
+        (list[list[float]], int) — vectors and how many were reused
+    """
+    known = {}
+    if previous is not None:
+        found = previous.get(ids=[doc.id for doc in docs], include=["embeddings"])
+        known = {doc_id: list(vector) for doc_id, vector in zip(found["ids"], found["embeddings"])}
+
+    missing = [doc for doc in docs if doc.id not in known]
+    if missing:
+        for doc, vector in zip(missing, embeddings.embed_documents([doc.page_content for doc in missing])):
+            known[doc.id] = vector
+    return [known[doc.id] for doc in docs], len(docs) - len(missing)
+
+
+def upsert_batch(vectordb, docs, vectors):
+    """upsert: write a batch of embedded chunks into the new collection."""
+    vectordb._collection.upsert(
+        ids=[doc.id for doc in docs],
+        embeddings=vectors,
+        documents=[doc.page_content for doc in docs],
+        metadatas=[doc.metadata for doc in docs],
+    )
+
+
+# ======================================================================
+# --------------------------------- JOBS --------------------------------
+# ======================================================================
+
+class IngestJob:
+    """One extract → chunk → embed → upsert run, and its progress."""
+
+    def __init__(self, sources, chunking="structure"):
+        self.id = uuid.uuid4().hex[:12]
+        self.sources = sources
+        self.chunking = chunking
+        self.state = "queued"   # queued | running | succeeded | failed
+        self.version = None
+        self.persist_dir = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # extract / chunk count sources, embed / upsert count chunks
+        self.progress = {stage: {"done": 0, "total": None} for stage in STAGES}
+        self.stats = {"chunks": 0, "embedded": 0, "reused": 0}
+        self.saved_at = 0.0   # monotonic time of the last save_job
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "sources": [path.name for path in self.sources],
+            "chunking": self.chunking,
+            "version": self.version,
+            "persist_dir": self.persist_dir,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "seconds": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+            "progress": self.progress,
+            "stats": self.stats,
+        }
+
+
+class IngestService:
+    """
+    Queue of ingestion jobs, run one at a time on the event loop.
+
+    Each job streams its sources through four stages connected by
+    bounded queues. Every stage has its own thread pool, so a slow
+    stage applies back-pressure instead of piling up work:
+
+        extract (extract_workers) → chunk (chunk_workers)
+            → embed (embed_workers, `batch_size` chunks per call)
+            → upsert (1 writer)
+
+    The job builds into a new folder under `versions_dir`. Only when
+    the store, BM25 index and exports are complete is `on_publish`
+    awaited (main.py swaps its pipeline there) and CURRENT moved to it.
+    The store being served is never written to.
+
+    Job state is saved under `versions_dir`/jobs as it changes, so the
+    worker that did not run a job (or a CLI run) can still report it.
+
+    Chunks are embedded with `embeddings`, else with what `embeddings_fn()`
+    returns (main.py: the torch model already loaded for serving), else
+    with a model loaded by load_indexing_embeddings (the CLI, and
+    workers serving an ONNX backend).
+    """
+
+    def __init__(
+        self,
+        versions_dir="index_versions",
+        previous_dir_fn=None,
+        on_publish=None,
+        embeddings=None,
+        embeddings_fn=None,
+        batch_size=64,
+        extract_workers=2,
+        chunk_workers=2,
+        embed_workers=1,
+        keep_versions=3,
+        cache_dir=None,
+        max_jobs=16,
+    ):
+        self.versions_dir = Path(versions_dir)
+        self.previous_dir_fn = previous_dir_fn
+        self.on_publish = on_publish
+        self.embeddings = embeddings
+        self.embeddings_fn = embeddings_fn
+        self.batch_size = batch_size
+        self.workers = {"extract": extract_workers, "chunk": chunk_workers, "embed": embed_workers, "upsert": 1}
+        self.keep_versions = keep_versions
+        self.cache_dir = cache_dir
+
+        self.jobs = {}                              # id -> IngestJob queued or running here
+        self.max_jobs = max_jobs                    # finished job files kept for /ingest/jobs
+        self._queue = asyncio.Queue()
+        self._runner = None
+
+    # --------------------------------------------------------
+    # Queue
+    # --------------------------------------------------------
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run_jobs())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def submit(self, sources=None, chunking="structure"):
+        """
+        Queue a job. Raises ValueError for unknown chunking strategies
+        or sources outside the data folder.
+
+        Returns:
+            IngestJob
+        """
+        if chunking not in CHUNKING_STRATEGIES:
+            raise ValueError(f"chunking must be one of {CHUNKING_STRATEGIES}")
+        job = IngestJob(resolve_sources(sources), chunking)
+        self.jobs[job.id] = job
+        self._save(job, force=True)
+        self._forget_old_jobs()
+        self._queue.put_nowait(job)
+        INGEST_JOBS.inc(result="queued")
+        return job
+
+    def _forget_old_jobs(self):
+        finished = [job for job in load_jobs(self.versions_dir) if job["state"] in ("succeeded", "failed")]
+        for job in finished[:max(len(finished) - self.max_jobs, 0)]:
+            (self.versions_dir / JOBS_DIR / f"{job['id']}.json").unlink(missing_ok=True)
+
+    def _save(self, job, force=False):
+        """Save the job's state; progress updates at most twice a second."""
+        now = time.monotonic()
+        if not force and now - job.saved_at < 0.5:
+            return
+        job.saved_at = now
+        try:
+            save_job(self.versions_dir, job)
+        except OSError as e:
+            print(f"Ingest job {job.id}: could not save its state: {e}")
+
+    def get(self, job_id):
+        """A job's state as a dict, from this worker or from its saved file; None if unknown."""
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else load_job(self.versions_dir, job_id)
+
+    async def _run_jobs(self):
+        while True:
+            job = await self._queue.get()
+            await self.run(job)
+
+    # --------------------------------------------------------
+    # One job
+    # --------------------------------------------------------
+    async def run(self, job):
+        """Run `job` to completion; failures are recorded on the job."""
+        job.state = "running"
+        job.started = time.time()
+        job.version = time.strftime("%Y%m%d-%H%M%S") + "-" + job.id[:6]
+        out_dir = self.versions_dir / job.version
+        job.persist_dir = str(out_dir)
+        self._save(job, force=True)
+        print(f"Ingest job {job.id}: building version {job.version} from {len(job.sources)} source(s)")
+
+        try:
+            await self._build(job, out_dir)
+            if self.on_publish is not None:
+                await self.on_publish(str(out_dir))
+            publish_version(self.versions_dir, job.version)
+            prune_versions(self.versions_dir, self.keep_versions)
+            job.state = "succeeded"
+            INGEST_JOBS.inc(result="succeeded")
+            print(f"Ingest job {job.id}: version {job.version} published ({job.stats['chunks']} chunks)")
+        except Exception as e:
+            job.state = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+            INGEST_JOBS.inc(result="failed")
+            shutil.rmtree(out_dir, ignore_errors=True)
+            print(f"Ingest job {job.id} failed: {job.error}")
+        finally:
+            job.finished = time.time()
+            self._save(job, force=True)
+            self.jobs.pop(job.id, None)
+
+    async def _build(self, job, out_dir):
+        from langchain_chroma import Chroma
+
+        loop = asyncio.get_running_loop()
+        pools = {
+            stage: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"rag-ingest-{stage}")
+            for stage, n in self.workers.items()
+        }
+
+        def in_pool(stage, func, *args):
+            return loop.run_in_executor(pools[stage], func, *args)
+
+        try:
+            embeddings = self.embeddings
+            if embeddings is None and self.embeddings_fn is not None:
+                embeddings = self.embeddings_fn()
+                if embeddings is None:
+                    raise RuntimeError("the embedding model is not loaded yet")
+            if embeddings is None:
+                from embeddings import load_indexing_embeddings
+
+                embeddings = self.embeddings = await in_pool(
+                    "embed", load_indexing_embeddings, self.batch_size, None, self.cache_dir
+                )
+
+            out_dir.mkdir(parents=True)
+            vectordb = Chroma(persist_directory=str(out_dir), embedding_function=embeddings)
+            previous = None
+            previous_dir = self.previous_dir_fn() if self.previous_dir_fn else None
+            if previous_dir and (Path(previous_dir) / "chroma.sqlite3").exists():
+                previous = Chroma(persist_directory=str(previous_dir))
+
+            docs_by_source = await self._stream(job, embeddings, vectordb, previous, in_pool)
+
+            # BM25, version marker and exports, like build_vector_store.py
+            all_docs = [doc for i in range(len(job.sources)) for doc in docs_by_source.get(i, [])]
+            await in_pool("upsert", finalize_store, vectordb, all_docs, str(out_dir))
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=False)
+
+    async def _stream(self, job, embeddings, vectordb, previous, in_pool):
+        """Run the four stages concurrently; returns {source index: chunks}."""
+        progress = job.progress
+        progress["extract"]["total"] = progress["chunk"]["total"] = len(job.sources)
+        workers = self.workers
+
+        sources = asyncio.Queue()
+        records = asyncio.Queue(maxsize=workers["chunk"] * 2)
+        batches = asyncio.Queue(maxsize=workers["embed"] * 2)
+        embedded = asyncio.Queue(maxsize=4)
+        for item in enumerate(job.sources):
+            sources.put_nowait(item)
+        for _ in range(workers["extract"]):
+            sources.put_nowait(DONE)
+
+        docs_by_source = {}
+        chunk_keys = set()
+
+        async def extract(item):
+            index, path = item
+            items = await in_pool("extract", extract_records, path)
+            progress["extract"]["done"] += 1
+            self._save(job)
+            await records.put((index, path, items))
+
+        async def chunk(item):
+            index, path, items = item
+            docs = await in_pool("chunk", chunk_records, items, path, source_type(path), job.chunking)
+            # Two sources with the same file name would collide in chunk_key
+            docs = [doc for doc in docs if doc.metadata["chunk_key"] not in chunk_keys]
+            chunk_keys.update(doc.metadata["chunk_key"] for doc in docs)
+            docs_by_source[index] = docs
+            job.stats["chunks"] += len(docs)
+            progress["chunk"]["done"] += 1
+            if progress["chunk"]["done"] == len(job.sources):
+                progress["embed"]["total"] = progress["upsert"]["total"] = job.stats["chunks"]
+            self._save(job)
+            for i in range(0, len(docs), self.batch_size):
+                await batches.put(docs[i:i + self.batch_size])
+
+        async def embed(docs):
+            vectors, reused = await in_pool("embed", embed_batch, docs, embeddings, previous)
+            job.stats["reused"] += reused
+            job.stats["embedded"] += len(docs) - reused
+            progress["embed"]["done"] += len(docs)
+            self._save(job)
+            await embedded.put((docs, vectors))
+
+        async def upsert(item):
+            docs, vectors = item
+            await in_pool("upsert", upsert_batch, vectordb, docs, vectors)
+            progress["upsert"]["done"] += len(docs)
+            self._save(job)
+
+        async def stage(handle, inbox, n_workers, outbox=None, next_workers=0):
+            async def worker():
+                while True:
+                    item = await inbox.get()
+                    if item is DONE:
+                        return
+                    await handle(item)
+
+            await asyncio.gather(*(worker() for _ in range(n_workers)))
+            for _ in range(next_workers):
+                await outbox.put(DONE)
+
+        tasks = [
+            asyncio.ensure_future(stage(extract, sources, workers["extract"], records, workers["chunk"])),
+            asyncio.ensure_future(stage(chunk, records, workers["chunk"], batches, workers["embed"])),
+            asyncio.ensure_future(stage(embed, batches, workers["embed"], embedded, workers["upsert"])),
+            asyncio.ensure_future(stage(upsert, embedded, workers["upsert"])),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return docs_by_source
+
+    def stats(self):
+        """Recent jobs of every worker, oldest first."""
+        jobs = {job["id"]: job for job in load_jobs(self.versions_dir)}
+        jobs.update((job.id, job.to_dict()) for job in self.jobs.values())
+        return sorted(jobs.values(), key=lambda job: job["created"])
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# Build a new index version from the default sources and publish it:
+#   python ingest.py
+#   python ingest.py texts.json tables.json diagrams.json manuals.jsonl
+#
+# A running API (main.py) switches to it within INDEX_POLL_SECONDS. Jobs
+# can also be queued over HTTP (POST /ingest/jobs) and watched with
+# GET /ingest/jobs/{id} on any worker; the worker that ran the job
+# switches at once.
+
+async def run_cli(args):
+    service = IngestService(
+        versions_dir=args.versions_dir,
+        previous_dir_fn=lambda: resolve_persist_dir(
+            {"INDEX_VERSIONS_DIR": args.versions_dir, "PERSIST_DIR": args.previous_dir}
+        ),
+        batch_size=args.batch_size,
+        extract_workers=args.extract_workers,
+        chunk_workers=args.chunk_workers,
+        embed_workers=args.embed_workers,
+        keep_versions=args.keep,
+        cache_dir=args.cache_dir,
+    )
+    job = service.submit(args.sources, args.chunking)
+
+    async def report():
+        while True:
+            await asyncio.sleep(2)
+            print("  " + "  ".join(
+                f"{stage} {p['done']}/{p['total'] if p['total'] is not None else '?'}"
+                for stage, p in job.progress.items()
+            ))
+
+    reporter = asyncio.create_task(report())
+    try:
+        await service.run(job)
+    finally:
+        reporter.cancel()
+    print(json.dumps(job.to_dict(), indent=2))
+    return job.state == "succeeded"
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build and publish a new index version.")
+    parser.add_argument("sources", nargs="*", help="source files in the data folder (default: the three JSON files)")
+    parser.add_argument("--chunking", choices=CHUNKING_STRATEGIES, default="structure")
+    parser.add_argument("--versions-dir", default=os.environ.get("INDEX_VERSIONS_DIR", "index_versions"))
+    parser.add_argument("--previous-dir", default=os.environ.get("PERSIST_DIR", "chroma_db"),
+                        help="store whose vectors are reused when there is no current version yet")
+    parser.add_argument("--batch-size", type=int, default=64, help="chunks per embedding call")
+    parser.add_argument("--extract-workers", type=int, default=2)
+    parser.add_argument("--chunk-workers", type=int, default=2)
+    parser.add_argument("--embed-workers", type=int, default=1)
+    parser.add_argument("--keep", type=int, default=3, help="index versions kept on disk")
+    parser.add_argument("--cache-dir", default=None, help="on-disk embedding cache (default: ./embedding_cache)")
+    args = parser.parse_args()
+
+    raise SystemExit(0 if asyncio.run(run_cli(args)) else 1)
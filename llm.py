@@ -1,6 +1,7 @@
 import os
 from pydantic import SecretStr
-from langchain_google_genai import ChatGoogleGenerativeAI
+
+from resilience import ResilientLLM
 
 
 def create_llm(env):
@@ -8,18 +9,40 @@ def create_llm(env):
     Create the DeepSeek-chat LLM client.
 
     Inputs:
-        env (dict): must contain "GEMINI_API"
+        env (dict): must contain "GEMINI_API"; LLM_MAX_CONCURRENCY
+                    (in-flight calls, default 4), LLM_DEADLINE,
+                    LLM_HEDGE_QUANTILE and LLM_BREAKER_* configure
+                    ResilientLLM; FAKE_LLM_URL replaces Gemini with
+                    fake_llm_server.py
 
     Returns:
-        ChatOpenAI instance
+        ChatGoogleGenerativeAI wrapped in a ResilientLLM
     """
-    llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-pro",
-            temperature=0,
-            max_tokens=None,
-            timeout=None,
-            max_retries=2,
-            api_key = SecretStr(env["GEMINI_API"])
-
-)
-    return llm
+    deadline = float(env.get("LLM_DEADLINE", 60))
+
+    if env.get("FAKE_LLM_URL"):
+        from fake_llm_server import FakeServerLLM
+
+        llm = FakeServerLLM(env["FAKE_LLM_URL"], timeout=deadline)
+    else:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        llm = ChatGoogleGenerativeAI(
+                model="gemini-2.5-pro",
+                temperature=0,
+                max_tokens=None,
+                timeout=deadline,
+                max_retries=2,
+                api_key = SecretStr(env["GEMINI_API"])
+
+    )
+    # The concurrency limit lives in ResilientLLM, so time spent queueing
+    # for a slot never counts against the deadline or trips the breaker
+    return ResilientLLM(
+        llm,
+        max_concurrency=int(env.get("LLM_MAX_CONCURRENCY", 4)),
+        deadline_seconds=deadline,
+        hedge_quantile=float(env.get("LLM_HEDGE_QUANTILE", 0.95)),
+        failure_threshold=int(env.get("LLM_BREAKER_FAILURES", 5)),
+        reset_seconds=float(env.get("LLM_BREAKER_RESET", 30)),
+    )
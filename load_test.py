@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+DEFAULT_QUESTIONS = [
+    "What is the flap retraction schedule?",
+    "What are the duties of the pilot flying during the landing procedure?",
+    "What is the quick turnaround limit weight with flaps 40?",
+    "How do I use the water fire extinguisher?",
+]
+
+
+async def run_level(url, questions, concurrency, total_requests, timeout):
+    """
+    Send `total_requests` POST /ask calls using `concurrency` clients.
+
+    Returns:
+        dict with throughput (req/s), p50 / p99 latency (s) and errors
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                question = questions[i % len(questions)]
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, json={"question": question})
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except httpx.HTTPError:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": statistics.median(latencies) if latencies else float("nan"),
+        "p99": latencies[int(0.99 * (len(latencies) - 1))] if latencies else float("nan"),
+        "errors": errors,
+    }
+
+
+async def compare_batch(base_url, questions, batch_size, timeout):
+    """
+    Time `batch_size` sequential POST /ask calls against a single
+    POST /ask/batch carrying the same questions.
+    """
+    batch = [questions[i % len(questions)] for i in range(batch_size)]
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        start = time.perf_counter()
+        for question in batch:
+            response = await client.post(base_url + "/ask", json={"question": question})
+            response.raise_for_status()
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = await client.post(base_url + "/ask/batch", json={"questions": batch})
+        response.raise_for_status()
+        batched = time.perf_counter() - start
+
+    errors = sum(1 for item in response.json()["results"] if item["error"])
+    print(f"{batch_size} questions")
+    print(f"  sequential /ask : {sequential:8.2f} s")
+    print(f"  /ask/batch      : {batched:8.2f} s  ({errors} errors)")
+    print(f"  speedup         : {sequential / batched:8.1f}x")
+
+
+async def main(args):
+    base_url = args.base_url.rstrip("/")
+    url = base_url + "/ask"
+    questions = args.question or DEFAULT_QUESTIONS
+
+    if args.batch_size:
+        await compare_batch(base_url, questions, args.batch_size, args.timeout)
+        return
+
+    print(f"{'clients':>8} {'req/s':>8} {'p50 (s)':>8} {'p99 (s)':>8} {'errors':>7}")
+    for concurrency in args.concurrency:
+        total = max(args.requests, concurrency)
+        result = await run_level(url, questions, concurrency, total, args.timeout)
+        print(
+            f"{result['concurrency']:>8} {result['throughput']:>8.2f} "
+            f"{result['p50']:>8.2f} {result['p99']:>8.2f} {result['errors']:>7}"
+        )
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# Start the API (uvicorn main:app), then:
+#   python load_test.py --concurrency 1 2 4 8 --requests 32
+#
+# With the async serving path, req/s should rise with the number of
+# clients (up to LLM_MAX_CONCURRENCY) instead of staying flat.
+#
+# Compare N sequential /ask calls with one /ask/batch call:
+#   python load_test.py --batch-size 50
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the /ask endpoint.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=32,
+                        help="requests sent per concurrency level")
+    parser.add_argument("--question", action="append",
+                        help="question to send (repeatable)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="compare N sequential /ask calls with one /ask/batch call")
+    asyncio.run(main(parser.parse_args()))
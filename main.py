@@ -1,51 +1,319 @@
-from typing import List
+import json
+import time
+import asyncio
+from typing import Dict, List, Literal, Optional
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from  env import load_env
-from embeddings import  load_vector_db, load_embeddings
+from embeddings import  embedding_namespace, load_embeddings, read_index_version, warm_up
 from llm import create_llm
-from pipeline  import build_pipeline
+from pipeline  import build_pipeline, build_batch_pipeline
+from concurrency import create_executor
+from cache import AnswerCache, CachedPipeline, CachedQueryEmbeddings
+from reranker import CrossEncoderReranker, load_cross_encoder
+from resilience import is_sources_only
+from table_lookup import preload_lookup_tables
+from vector_store import load_vector_store
+from utils import preload_tables
+from bm25 import load_sparse_index
+from router import CHAPTERS, DOC_TYPES
+from chunking import CHUNKING_STRATEGIES
+from ingest import IngestService, resolve_persist_dir
+from metrics import registry, StageTimer, REQUESTS, REQUESTS_IN_FLIGHT, REQUEST_SECONDS, INDEX_SWAPS
 
 
 # --- Pydantic Models ---
+class SearchFilters(BaseModel):
+    """Restrict retrieval to matching chunks (pushed down into the vector search)."""
+    type: Optional[Literal[DOC_TYPES]] = None
+    chapter: Optional[Literal[tuple(CHAPTERS)]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+
 class QueryRequest(BaseModel):
     question: str
+    filters: Optional[SearchFilters] = None
+    debug: bool = False  # return per-stage timings with the answer
 
 class QueryResponse(BaseModel):
     answer: str
     pages: List[int]
+    cache: Literal["exact", "semantic", "miss", "disabled"] = "disabled"
+    context_tokens: Optional[int] = None
+    timings: Optional[Dict[str, float]] = None
+    degraded: bool = False  # LLM unavailable: the answer only lists the relevant pages
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    filters: Optional[SearchFilters] = None  # applied to every question
+
+class BatchItem(BaseModel):
+    question: str
+    answer: Optional[str] = None
+    pages: List[int] = []
+    context_tokens: Optional[int] = None
+    degraded: bool = False
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchItem]
+
+class IngestRequest(BaseModel):
+    sources: Optional[List[str]] = None  # files in the data folder (default: the three JSON files)
+    chunking: Literal[CHUNKING_STRATEGIES] = "structure"
 
 # Global variable to hold the pipeline
 rag_chain = None
+# Pipeline answering a list of questions with shared retrieval
+batch_chain = None
+# Answer cache in front of the pipeline (None when disabled)
+answer_cache = None
+# Memoized query embeddings (None when disabled)
+query_embedding_cache = None
+# Cross-encoder second re-ranking stage (None when disabled)
+cross_encoder = None
+# Bounded pool for the CPU-bound pipeline steps
+cpu_executor = None
+# Startup progress, reported by /healthz and /readyz
+startup_state = {"ready": False, "error": None, "phases": {}}
+# What swap_index() needs to rebuild the pipelines for a new index version
+serving = {"env": None, "persist_dir": None, "vectordb": None, "embeddings": None, "llm": None, "reranker": None}
+# One index swap at a time (finished ingest job, index watcher)
+swap_lock = asyncio.Lock()
+# Queue of extract → chunk → embed → upsert jobs (see ingest.py)
+ingest_service = None
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+
+async def timed_phase(name, func, *args):
+    """Run one blocking init step in a thread and record how long it took."""
+    start = time.perf_counter()
+    result = await asyncio.to_thread(func, *args)
+    elapsed = time.perf_counter() - start
+    startup_state["phases"][name] = round(elapsed, 3)
+    print(f"  startup phase {name!r}: {elapsed:.2f}s")
+    return result
+
+
+async def initialize():
     """
-    Lifespan context manager for startup and shutdown events.
-    Code before yield runs on startup, code after yield runs on shutdown.
+    Build the RAG pipeline. Independent steps run concurrently:
+
+        load_embeddings → open_vector_db → warmup
+        load_bm25
+        create_llm
+        preload_tables
+        preload_lookup_tables
+        load_reranker → warmup_reranker   (only with RERANKER_MODEL)
+
+    The store served is the current ingested index version, if there is
+    one, else PERSIST_DIR. The app is marked ready only after the warmup
+    query has run.
     """
-    global rag_chain
-    
-    # Startup
+    global rag_chain, batch_chain, answer_cache, query_embedding_cache, cross_encoder
+
+    start = time.perf_counter()
     try:
         print("Initializing RAG Pipeline...")
         env = load_env()
-        embeddings = load_embeddings(env)
-        vectordb = load_vector_db(env, embeddings)
-        llm = create_llm(env)
-        
+        env["PERSIST_DIR"] = resolve_persist_dir(env)
+
+        async def load_search():
+            embeddings = await timed_phase("load_embeddings", load_embeddings, env)
+            if int(env["QUERY_EMBEDDING_CACHE_SIZE"]) > 0:
+                embeddings = CachedQueryEmbeddings(
+                    embeddings,
+                    max_entries=int(env["QUERY_EMBEDDING_CACHE_SIZE"]),
+                    db_path=env["QUERY_EMBEDDING_CACHE_DB"] or None,
+                    namespace=embedding_namespace(env["EMBEDDING_BACKEND"]),
+                )
+            # VECTOR_STORE picks Chroma, the memory-mapped serving index
+            # or the in-memory NumPy store (see vector_store.py)
+            vectordb = await timed_phase("open_vector_db", load_vector_store, env, embeddings)
+            await timed_phase("warmup", warm_up, vectordb)
+            return embeddings, vectordb
+
+        async def load_reranker():
+            if not env["RERANKER_MODEL"]:
+                return None
+            model = await timed_phase("load_reranker", load_cross_encoder, env["RERANKER_MODEL"])
+            reranker = CrossEncoderReranker(
+                model,
+                candidates=int(env["RERANK_CANDIDATES"]),
+                top_k=int(env["RERANK_TOP_K"]),
+                budget_seconds=float(env["RERANK_BUDGET_MS"]) / 1000,
+                early_exit_margin=float(env["RERANK_EARLY_EXIT_MARGIN"]),
+                cache_size=int(env["RERANK_CACHE_SIZE"]),
+            )
+            await timed_phase("warmup_reranker", reranker.warm_up)
+            return reranker
+
+        (embeddings, vectordb), sparse_index, llm, reranker, _, _ = await asyncio.gather(
+            load_search(),
+            timed_phase("load_bm25", load_sparse_index, env),
+            timed_phase("create_llm", create_llm, env),
+            load_reranker(),
+            timed_phase("preload_tables", preload_tables, env["TABLE_FORMAT"]),
+            timed_phase("preload_lookup_tables", preload_lookup_tables),
+        )
+
+        serving.update(
+            env=env, persist_dir=env["PERSIST_DIR"], vectordb=vectordb,
+            embeddings=embeddings, llm=llm, reranker=reranker,
+        )
+
+        cache_size = int(env["ANSWER_CACHE_SIZE"])
+        if cache_size > 0:
+            # Follows index swaps: a new version makes older answers stale
+            answer_cache = AnswerCache(
+                embeddings,
+                max_entries=cache_size,
+                ttl_seconds=float(env["ANSWER_CACHE_TTL"]),
+                similarity_threshold=float(env["ANSWER_CACHE_THRESHOLD"]),
+                version_fn=lambda: read_index_version(serving["persist_dir"]),
+            )
+
         # This pipeline now returns {"answer": str, "sources": List[Docs]}
-        rag_chain = build_pipeline(vectordb, llm)
-        print("RAG Pipeline ready.")
+        rag_chain, batch_chain = build_chains(vectordb, sparse_index)
+        startup_state["index"] = env["PERSIST_DIR"]
+        if isinstance(embeddings, CachedQueryEmbeddings):
+            query_embedding_cache = embeddings
+        cross_encoder = reranker
+        startup_state["ready"] = True
+        print(f"RAG Pipeline ready in {time.perf_counter() - start:.2f}s.")
     except Exception as e:
+        startup_state["error"] = str(e)
         print(f"Failed to initialize RAG: {e}")
-        raise e
-    
+
+
+def build_chains(vectordb, sparse_index):
+    """(rag_chain, batch_chain) over one index version, with the answer cache in front."""
+    env = serving["env"]
+    pipeline_options = dict(
+        executor=cpu_executor,
+        sparse_index=sparse_index,
+        context_token_budget=int(env["CONTEXT_TOKEN_BUDGET"]),
+        route_queries=env["ROUTE_QUERIES"] == "1",
+        reranker=serving["reranker"],
+    )
+
+    chain = build_pipeline(vectordb, serving["llm"], **pipeline_options)
+    batch = build_batch_pipeline(
+        vectordb,
+        serving["llm"],
+        max_concurrency=int(env["BATCH_MAX_CONCURRENCY"]),
+        **pipeline_options,
+    )
+    if answer_cache:
+        chain = CachedPipeline(chain, answer_cache, executor=cpu_executor)
+    return chain, batch
+
+
+async def swap_index(persist_dir):
+    """
+    Switch to the index version in `persist_dir` without downtime. The
+    new store is opened and warmed up while the old pipelines keep
+    answering; then both pipelines are replaced at once. Requests that
+    already started finish on the old ones.
+
+    The old store is closed INDEX_CLOSE_GRACE_SECONDS later, before this
+    returns, so an ingest job prunes old versions only once their files
+    are no longer open.
+    """
+    global rag_chain, batch_chain
+
+    if not startup_state["ready"]:
+        return  # initialize() opens the current version itself
+    async with swap_lock:
+        if persist_dir == serving["persist_dir"]:
+            return
+        start = time.perf_counter()
+        env = {**serving["env"], "PERSIST_DIR": persist_dir}
+        vectordb = await asyncio.to_thread(load_vector_store, env, serving["embeddings"])
+        await asyncio.to_thread(warm_up, vectordb)
+        sparse_index = await asyncio.to_thread(load_sparse_index, env)
+        chains = build_chains(vectordb, sparse_index)
+
+        rag_chain, batch_chain = chains
+        old_vectordb = serving["vectordb"]
+        serving.update(persist_dir=persist_dir, vectordb=vectordb)
+        startup_state["index"] = persist_dir
+        INDEX_SWAPS.inc()
+        print(f"Serving index {persist_dir!r} (switched in {time.perf_counter() - start:.2f}s)")
+
+        # Retrievals already running on the old store get time to finish
+        await asyncio.sleep(float(env["INDEX_CLOSE_GRACE_SECONDS"]))
+        try:
+            await asyncio.to_thread(old_vectordb.close)
+        except Exception as e:
+            print(f"Failed to close the previous index: {e}")
+
+
+async def watch_index_versions(poll_seconds):
+    """
+    Follow the CURRENT index version, so every worker switches to a
+    version published by an ingest job in another worker or the CLI.
+    """
+    while True:
+        await asyncio.sleep(poll_seconds)
+        if not startup_state["ready"]:
+            continue
+        persist_dir = resolve_persist_dir(serving["env"])
+        if persist_dir != serving["persist_dir"]:
+            try:
+                await swap_index(persist_dir)
+            except Exception as e:
+                print(f"Failed to switch to index {persist_dir!r}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Lifespan context manager for startup and shutdown events.
+    Code before yield runs on startup, code after yield runs on shutdown.
+
+    Initialization runs in the background so /healthz answers at once;
+    /readyz turns green when the pipeline is built and warm.
+    """
+    global rag_chain, batch_chain, cpu_executor, answer_cache, query_embedding_cache, cross_encoder
+    global ingest_service
+
+    # Startup
+    env = load_env()
+    cpu_executor = create_executor(int(env["CPU_WORKERS"]))
+    init_task = asyncio.create_task(initialize())
+
+    ingest_service = IngestService(
+        versions_dir=env["INDEX_VERSIONS_DIR"],
+        previous_dir_fn=lambda: serving["persist_dir"] or resolve_persist_dir(env),
+        on_publish=swap_index,
+        # Reuse the serving model: no second copy of MPNet in each worker.
+        # ONNX vectors differ slightly from the torch ones a job reuses
+        # from the previous version, so those workers load the torch model.
+        embeddings_fn=(lambda: serving["embeddings"]) if env["EMBEDDING_BACKEND"] == "torch" else None,
+        batch_size=int(env["INGEST_BATCH_SIZE"]),
+        embed_workers=int(env["INGEST_EMBED_WORKERS"]),
+        keep_versions=int(env["INGEST_KEEP_VERSIONS"]),
+    )
+    ingest_service.start()
+    poll_seconds = float(env["INDEX_POLL_SECONDS"])
+    watch_task = asyncio.create_task(watch_index_versions(poll_seconds)) if poll_seconds > 0 else None
+
     yield  # Server is running
-    
+
     print("Shutting down RAG Pipeline...")
+    init_task.cancel()
+    if watch_task:
+        watch_task.cancel()
+    await ingest_service.stop()
+    ingest_service = None
     rag_chain = None
+    batch_chain = None
+    answer_cache = None
+    query_embedding_cache = None
+    cross_encoder = None
+    cpu_executor.shutdown(wait=False)
 
 # --- App Initialization ---
 app = FastAPI(
@@ -57,34 +325,112 @@ app = FastAPI(
 
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Request rate, in-flight requests and latency of the /ask endpoints.
+
+    call_next returns as soon as the headers are ready, so the request
+    is counted as finished only when its body has been sent; for
+    /ask/stream that is the end of the SSE stream, not its first byte.
+    """
+    endpoint = request.url.path
+    if not endpoint.startswith("/ask"):
+        return await call_next(request)
+
+    REQUESTS_IN_FLIGHT.inc(endpoint=endpoint)
+    start = time.perf_counter()
+
+    def finished(status):
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        REQUESTS.inc(endpoint=endpoint, status=status)
+        REQUESTS_IN_FLIGHT.dec(endpoint=endpoint)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        finished(500)
+        raise
+
+    body = response.body_iterator
+
+    async def body_then_record():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            finished(response.status_code)
+
+    response.body_iterator = body_then_record()
+    return response
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and initialization has not failed."""
+    if startup_state["error"]:
+        raise HTTPException(status_code=500, detail=startup_state["error"])
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the pipeline is built and warmed up."""
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail={"ready": False, **startup_state})
+    return startup_state
+
+
+def chain_input(question, filters):
+    """The pipeline's input: the bare question, or question + filters."""
+    if filters is None:
+        return question
+    return {"question": question, "filters": filters.model_dump(exclude_none=True)}
+
+
+def extract_pages(source_docs):
+    """Sorted, de-duplicated page numbers of the source documents."""
+    # We use a set to handle uniqueness, then convert to sorted list
+    unique_pages = set()
+    for doc in source_docs:
+        # Handle cases where page_number might be missing or None
+        page_num = doc.metadata.get("page_number")
+        if page_num is not None:
+            # Ensure it's an integer
+            try:
+                unique_pages.add(int(page_num))
+            except (ValueError, TypeError):
+                pass # Skip invalid page numbers
+    return sorted(list(unique_pages))
+
+
 @app.post("/ask", response_model=QueryResponse)
 async def ask_question(request: QueryRequest):
     if not rag_chain:
         raise HTTPException(status_code=503, detail="RAG system not initialized")
     
+    timer = StageTimer()
+    start = time.perf_counter()
     try:
-        # Invoke the chain
-        result = rag_chain.invoke(request.question)
+        # Invoke the chain without blocking the event loop
+        result = await rag_chain.ainvoke(
+            chain_input(request.question, request.filters),
+            config={"callbacks": [timer]},
+        )
         
         answer_text = result.get("answer", "No answer generated.")
         source_docs = result.get("sources", [])
         
-        # Extract page numbers and remove duplicates
-        # We use a set to handle uniqueness, then convert to sorted list
-        unique_pages = set()
-        for doc in source_docs:
-            # Handle cases where page_number might be missing or None
-            page_num = doc.metadata.get("page_number")
-            if page_num is not None:
-                # Ensure it's an integer
-                try:
-                    unique_pages.add(int(page_num))
-                except (ValueError, TypeError):
-                    pass # Skip invalid page numbers
-        
         return QueryResponse(
             answer=answer_text,
-            pages=sorted(list(unique_pages))
+            pages=extract_pages(source_docs),
+            cache=result.get("cache", "disabled"),
+            context_tokens=result.get("context_tokens"),
+            degraded=is_sources_only(answer_text),
+            timings=(
+                {**timer.timings, "total": round(time.perf_counter() - start, 6)}
+                if request.debug else None
+            ),
         )
         
     except Exception as e:
@@ -92,3 +438,182 @@ async def ask_question(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ask/batch", response_model=BatchQueryResponse)
+async def ask_batch(request: BatchQueryRequest):
+    if not batch_chain:
+        raise HTTPException(status_code=503, detail="RAG system not initialized")
+
+    try:
+        batch_input = request.questions
+        if request.filters is not None:
+            batch_input = {
+                "questions": request.questions,
+                "filters": request.filters.model_dump(exclude_none=True),
+            }
+        outputs = await batch_chain.ainvoke(batch_input, config={"callbacks": [StageTimer()]})
+    except Exception as e:
+        # Retrieval failed for the whole batch
+        print(f"Error processing batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    items = []
+    for question, result in zip(request.questions, outputs):
+        if isinstance(result, Exception):
+            items.append(BatchItem(question=question, error=str(result)))
+        else:
+            items.append(BatchItem(
+                question=question,
+                answer=result.get("answer", "No answer generated."),
+                pages=extract_pages(result.get("sources", [])),
+                context_tokens=result.get("context_tokens"),
+                degraded=is_sources_only(result.get("answer")),
+            ))
+    return BatchQueryResponse(results=items)
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_answer(chain_request, http_request, debug=False):
+    """
+    Yield SSE events for one question:
+        pages  — as soon as retrieval + re-ranking are done
+        token  — each piece of the answer as the LLM produces it
+        done   — cache status, context size, whether the answer is
+                 degraded (and timings if `debug`)
+        error  — if the pipeline fails
+
+    If the client goes away, the chain's stream is closed, which
+    cancels the upstream LLM call.
+    """
+    timer = StageTimer()
+    stream = rag_chain.astream(chain_request, config={"callbacks": [timer]})
+    info = {}
+    answer = ""
+    try:
+        async for chunk in stream:
+            if await http_request.is_disconnected():
+                print("Client disconnected; cancelling generation.")
+                return
+            if "sources" in chunk:
+                yield sse_event("pages", {"pages": extract_pages(chunk["sources"])})
+            if chunk.get("answer"):
+                answer += chunk["answer"]
+                yield sse_event("token", {"text": chunk["answer"]})
+            for key in ("cache", "context_tokens"):
+                if key in chunk:
+                    info[key] = chunk[key]
+        info["degraded"] = is_sources_only(answer)
+        if debug:
+            info["timings"] = timer.timings
+        yield sse_event("done", info)
+    except Exception as e:
+        print(f"Error streaming request: {e}")
+        yield sse_event("error", {"detail": str(e)})
+    finally:
+        await stream.aclose()
+
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: QueryRequest, http_request: Request):
+    if not rag_chain:
+        raise HTTPException(status_code=503, detail="RAG system not initialized")
+
+    return StreamingResponse(
+        stream_answer(chain_input(request.question, request.filters), http_request, request.debug),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ingest/jobs", status_code=202)
+async def create_ingest_job(request: IngestRequest):
+    """
+    Queue an ingestion job. It builds a new index version in the
+    background; when it succeeds the API switches to it. Poll
+    /ingest/jobs/{id} for progress.
+    """
+    if not ingest_service:
+        raise HTTPException(status_code=503, detail="Ingestion not available")
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="RAG system not initialized")
+    try:
+        job = ingest_service.submit(request.sources, request.chunking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+
+@app.get("/ingest/jobs")
+async def list_ingest_jobs():
+    if not ingest_service:
+        raise HTTPException(status_code=503, detail="Ingestion not available")
+    return {"index": serving["persist_dir"], "jobs": ingest_service.stats()}
+
+
+@app.get("/ingest/jobs/{job_id}")
+async def get_ingest_job(job_id: str):
+    """Job state, per-stage progress (done / total) and chunk counts."""
+    job = ingest_service.get(job_id) if ingest_service else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = {"enabled": False}
+    if answer_cache:
+        stats = {"enabled": True, **answer_cache.stats()}
+    if query_embedding_cache:
+        stats["query_embeddings"] = query_embedding_cache.stats()
+    if cross_encoder:
+        stats["rerank_scores"] = cross_encoder.stats()
+    return stats
+
+
+def cache_metric_families():
+    """Answer and query embedding cache statistics as Prometheus metric families."""
+    families = []
+    if query_embedding_cache:
+        stats = query_embedding_cache.stats()
+        families += [
+            ("rag_query_embedding_cache_lookups_total", "counter",
+             "Query embedding cache lookups by outcome.", [
+                ("", (("result", "memory"),), stats["memory_hits"]),
+                ("", (("result", "disk"),), stats["disk_hits"]),
+                ("", (("result", "miss"),), stats["misses"]),
+            ]),
+            ("rag_query_embedding_cache_entries", "gauge",
+             "Query embeddings held in memory.", [
+                ("", (), stats["entries"]),
+            ]),
+        ]
+    if not answer_cache:
+        return families
+    stats = answer_cache.stats()
+    return families + [
+        ("rag_answer_cache_lookups_total", "counter", "Answer cache lookups by outcome.", [
+            ("", (("result", "exact"),), stats["exact_hits"]),
+            ("", (("result", "semantic"),), stats["semantic_hits"]),
+            ("", (("result", "miss"),), stats["misses"]),
+        ]),
+        ("rag_answer_cache_entries", "gauge", "Answers currently cached.", [
+            ("", (), stats["entries"]),
+        ]),
+        ("rag_answer_cache_invalidations_total", "counter",
+         "Cache flushes caused by a rebuilt index.", [
+            ("", (), stats["invalidations"]),
+        ]),
+    ]
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(
+        registry.render(cache_metric_families()),
+        media_type="text/plain; version=0.0.4",
+    )
@@ -0,0 +1,267 @@
+import threading
+import time
+from bisect import bisect_left
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# ======================================================================
+# ------------------------- PROMETHEUS METRICS --------------------------
+# ======================================================================
+# A few hand-rolled metric types that render the Prometheus text
+# exposition format, so /metrics needs no extra dependency.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels)
+    return "{" + inner + "}"
+
+
+def render_samples(name, kind, help_text, samples):
+    """
+    Render one metric family.
+
+    Args:
+        samples: iterable of (suffix, labels, value), where labels is a
+            tuple of (key, value) pairs.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{format_labels(labels)} {value:g}")
+    return "\n".join(lines)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [("", key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        return render_samples(self.name, self.kind, self.help_text, self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(("_bucket", key + (("le", f"{bound:g}"),), cumulative))
+                cumulative += counts[-1]
+                samples.append(("_bucket", key + (("le", "+Inf"),), cumulative))
+                samples.append(("_sum", key, total))
+                samples.append(("_count", key, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """Holds the process-wide metrics and renders them for /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra=()):
+        """
+        Render all registered metrics, followed by `extra` families given
+        as (name, kind, help, samples) — values that are read on demand,
+        e.g. the answer cache statistics.
+        """
+        blocks = [metric.render() for metric in self._metrics]
+        blocks.extend(render_samples(*family) for family in extra)
+        return "\n".join(blocks) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUESTS = registry.register(Counter(
+    "rag_requests_total", "HTTP requests to the question endpoints.", ("endpoint", "status")))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "rag_requests_in_flight", "Requests currently being handled.", ("endpoint",)))
+REQUEST_SECONDS = registry.register(Histogram(
+    "rag_request_seconds", "Time until the response body has been fully sent, per endpoint.", ("endpoint",)))
+STAGE_SECONDS = registry.register(Histogram(
+    "rag_stage_seconds", "Latency of each pipeline stage.", ("stage",)))
+LLM_TOKENS = registry.register(Counter(
+    "rag_llm_tokens_total", "Tokens reported by the LLM.", ("kind",)))
+LLM_CALLS = registry.register(Counter(
+    "rag_llm_calls_total",
+    "LLM calls by outcome (ok, hedge_won, timeout, error, rejected) and hedged / coalesced requests.",
+    ("result",)))
+LLM_CIRCUIT_OPEN = registry.register(Gauge(
+    "rag_llm_circuit_open", "1 while the LLM circuit breaker is open."))
+RERANK_RESULTS = registry.register(Counter(
+    "rag_rerank_total", "Cross-encoder re-rankings by outcome (scored, cached, fallback, busy).", ("result",)))
+RERANK_EARLY_EXITS = registry.register(Counter(
+    "rag_rerank_early_exits_total", "Re-rankings that kept a single dominant chunk."))
+INGEST_JOBS = registry.register(Counter(
+    "rag_ingest_jobs_total", "Ingestion jobs queued, succeeded and failed.", ("result",)))
+INDEX_SWAPS = registry.register(Counter(
+    "rag_index_swaps_total", "Times the pipeline switched to a new index version."))
+
+
+# ======================================================================
+# ------------------------ PER-STAGE TIMING ------------------------------
+# ======================================================================
+
+# Pipeline steps (the names of the offloaded RunnableLambdas) that are timed
+PIPELINE_STAGES = {
+    "embed_query",
+    "retrieve_with_scores",
+    "sparse_retrieve_with_scores",
+    "reciprocal_rank_fusion",
+    "title_weighted_reranker",
+    "cross_encoder_rerank",
+    "build_context",
+}
+
+
+def token_usage(response):
+    """(input_tokens, output_tokens) from an LLMResult, or None if not reported."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return None
+
+
+class StageTimer(BaseCallbackHandler):
+    """
+    Callback handler timing the pipeline stages of one request.
+
+    Pass it as `config={"callbacks": [timer]}`. Every finished stage is
+    observed in the rag_stage_seconds histogram and added to
+    `timer.timings` (seconds per stage), which /ask returns when the
+    request asks for `debug`. The LLM call is reported as "llm", and
+    "llm_first_token" when the answer is streamed.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.timings = {}
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, stage):
+        with self._lock:
+            self._started[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id):
+        with self._lock:
+            started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        stage, start = started
+        self._record(stage, time.perf_counter() - start)
+
+    def _record(self, stage, elapsed):
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        with self._lock:
+            self.timings[stage] = round(self.timings.get(stage, 0.0) + elapsed, 6)
+
+    # --- pipeline steps ---
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        if kwargs.get("name") in PIPELINE_STAGES:
+            self._start(run_id, kwargs["name"])
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._started.pop(run_id, None)
+
+    # --- LLM ---
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if "llm_first_token" in self.timings:
+            return
+        with self._lock:
+            started = self._started.get(run_id)
+        if started is not None:
+            self._record("llm_first_token", time.perf_counter() - started[1])
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+        usage = token_usage(response)
+        if usage is not None:
+            LLM_TOKENS.inc(usage[0], kind="input")
+            LLM_TOKENS.inc(usage[1], kind="output")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._started.pop(run_id, None)
@@ -1,119 +1,393 @@
+import asyncio
+from functools import partial
 from operator import itemgetter
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import (
-    RunnableParallel,
     RunnableLambda,
+    RunnableParallel,
     RunnablePassthrough,
 )
+from langchain_core.runnables.config import patch_config
 from langchain_core.output_parsers import StrOutputParser
 
-from retrieval import retrieve_with_scores
+from concurrency import offload
+from retrieval import (
+    embed_query,
+    retrieve_with_scores,
+    sparse_retrieve_with_scores,
+    reciprocal_rank_fusion,
+    batch_retrieve_with_scores,
+)
+from router import normalize_filters, resolve_request, route_query
 from scoring import title_weighted_reranker
-from utils import convert_tables_to_html
+from reranker import cross_encoder_rerank
+from resilience import LLMUnavailable, sources_only_answer
+from context import build_context
 
 
-def build_pipeline(vectordb, llm):
+def build_context_chain(
+    executor=None,
+    top_k=16,
+    title_match_score_weight=10,
+    context_token_budget=4000,
+    reranker=None,
+):
     """
-    Build the Retrieval-Augmented Generation (RAG) pipeline.
-    The pipeline retrieves documents, re-ranks them using
-    custom title-matching logic, enriches tables, and generates
-    an answer along with the supporting sources.
+    Build the re-ranking and context assembly steps. With a `reranker`
+    (reranker.CrossEncoderReranker) the heuristic's top chunks are
+    re-scored by the cross-encoder before the context is filled.
+
+    Input:
+        {"query": str, "results": list[(Document, float)]}
+
+    Output:
+        {"docs": list[Document], "tokens": int}
+    """
+
+    # --------------------------------------------------------
+    # STEP 3 — Custom Re-Ranking
+    # --------------------------------------------------------
+    # Feeds the raw search results + query into our custom
+    # title_weighted_reranker, which boosts documents whose
+    # titles share important words with the query.
+    #
+    # Final output of this block:
+    #   List[Document] — sorted by our combined score.
+    reranked_docs = RunnableParallel({
+        "results": itemgetter("results"),
+        "query": itemgetter("query"),
+        "weight": lambda _: title_match_score_weight,
+        "top_k": lambda _: top_k,
+    }) | offload(title_weighted_reranker, executor)
+
+    # --------------------------------------------------------
+    # STEP 3b — Cross-encoder re-ranking (optional)
+    # --------------------------------------------------------
+    # Scores the heuristic's best candidates against the query in one
+    # batched forward pass and keeps fewer, better chunks. Falls back
+    # to the heuristic order when it would exceed its latency budget.
+    if reranker is not None:
+        reranked_docs = RunnableParallel({
+            "docs": reranked_docs,
+            "query": itemgetter("query"),
+            "reranker": lambda _: reranker,
+        }) | offload(cross_encoder_rerank, executor)
+
+    # --------------------------------------------------------
+    # STEP 4 — Fill the token budget (and attach tables)
+    # --------------------------------------------------------
+    # Walks the re-ranked docs best first and keeps adding them
+    # until `context_token_budget` is used up. Near-duplicate chunks
+    # (overlapping splitter windows) are skipped, and each table is
+    # attached once — as HTML, or in a compact rendering when the
+    # HTML would not fit. When the question names the cell it needs
+    # in a performance table, only that looked-up value is attached.
+    #
+    # Output: {"docs": List[Document], "tokens": int}
+    return RunnableParallel({
+        "docs": reranked_docs,
+        "query": itemgetter("query"),
+        "budget": lambda _: context_token_budget,
+    }) | offload(build_context, executor)
+
+
+def build_generation_chain(
+    llm,
+    executor=None,
+    top_k=16,
+    title_match_score_weight=10,
+    context_token_budget=4000,
+    reranker=None,
+):
+    """
+    Build the part of the pipeline that runs after retrieval:
+    re-ranking, context assembly and answer generation.
+
+    Input:
+        {"query": str, "results": list[(Document, float)]}
+
+    Output:
+        {"answer": str, "sources": list[Document], "context_tokens": int}
     """
 
     # Prompt that the LLM receives.
-    # It already includes a slot {context} for retrieved chunks
+    # It already includes a slot {context_text} for retrieved chunks
     # and {input} for the user question.
     prompt = ChatPromptTemplate.from_messages([
         (
             "system",
             "Use the retrieved context to answer the question. "
-            "If the answer is unknown, say you don't know.\n\nContext:\n{context}"
+            "If the answer is unknown, say you don't know.\n\nContext:\n{context_text}"
         ),
         ("human", "{input}"),
     ])
 
-    # --------------------------------------------------------
-    # STEP 1 — Attach retrieval parameters to the incoming query
-    # --------------------------------------------------------
-    # This stage:
-    #   • passes the query unchanged
-    #   • attaches the vectordb instance
-    #   • defines how many documents to retrieve (k)
-    #   • sets the weight for our custom title-match re-ranker
-    #
-    # Output example:
-    #   {
-    #       "query": "...",
-    #       "vectordb": <Chroma instance>,
-    #       "k": 20,
-    #       "title_match_score_weight": 10
-    #   }
-    
-    retrieval_inputs = RunnableParallel({
-        "query": RunnablePassthrough(),
-        "vectordb": lambda _: vectordb,
-        "k": lambda _: 25,
-        "title_match_score_weight": lambda _: 10,
-    })
-
-    # --------------------------------------------------------
-    # STEP 2 — Retrieve + Custom Re-Ranking
-    # --------------------------------------------------------
-    # The pipeline now:
-    #   1. Runs vector search (retrieve_with_scores)
-    #   2. Feeds the raw vector results + query into our custom
-    #      title_weighted_reranker
-    #   3. The reranker boosts documents whose titles share
-    #      important words with the query.
-    #
-    # Final output of this block:
-    #   List[Document] — sorted by our combined score.
-    retrieval_pipeline = (
-        retrieval_inputs
-        | RunnableParallel({
-            "results": RunnableLambda(retrieve_with_scores),
-            "query": itemgetter("query"),
-            "weight": itemgetter("title_match_score_weight"),
-        })
-        | RunnableLambda(title_weighted_reranker)
+    # STEP 3 + 4 — re-rank and fill the token budget
+    context_stage = build_context_chain(
+        executor=executor,
+        top_k=top_k,
+        title_match_score_weight=title_match_score_weight,
+        context_token_budget=context_token_budget,
+        reranker=reranker,
     )
 
     # --------------------------------------------------------
-    # STEP 3 — Enrich documents (table → HTML)
-    # --------------------------------------------------------
-    # If a chunk represents a table, we load its CSV, convert
-    # it to HTML, and attach the HTML to the document content.
-    # This lets the LLM “see” tables in a structured form.
-    enriched_docs = retrieval_pipeline | convert_tables_to_html
-
-    # --------------------------------------------------------
-    # STEP 4 — Prepare final inputs for the LLM
+    # STEP 5 — Prepare final inputs for the LLM
     # --------------------------------------------------------
     # Build:
     #   {
-    #       "context": <list of enriched docs>,
-    #       "input":   <original query>
+    #       "context":        <list of enriched docs>,
+    #       "context_text":   <the chunks as sent: label + content>,
+    #       "context_tokens": <estimated tokens of context_text>,
+    #       "input":          <original query>
     #   }
     gather_stage = RunnableParallel({
-        "context": enriched_docs,
-        "input": RunnablePassthrough(),
+        "built": context_stage,
+        "input": itemgetter("query"),
+    }) | RunnableParallel({
+        "context": lambda x: x["built"]["docs"],
+        "context_text": lambda x: x["built"]["text"],
+        "context_tokens": lambda x: x["built"]["tokens"],
+        "input": itemgetter("input"),
     })
 
     # --------------------------------------------------------
-    # STEP 5 — Generate the answer
+    # STEP 6 — Generate the answer
     # --------------------------------------------------------
-    # Prompt → LLM → string
-    answer_chain = prompt | llm | StrOutputParser()
+    # Prompt → LLM → string. When the LLM is unavailable (deadline,
+    # errors, open circuit breaker; see resilience.py) the answer lists
+    # the retrieved pages instead.
+    answer_chain = (prompt | llm | StrOutputParser()).with_fallbacks(
+        [RunnableLambda(sources_only_answer)],
+        exceptions_to_handle=(LLMUnavailable,),
+    )
 
     # --------------------------------------------------------
-    # STEP 6 — Final output
+    # STEP 7 — Final output
     # --------------------------------------------------------
     # Returns:
     #   {
     #       "answer": <generated answer>,
-    #       "sources": <documents used as context>
+    #       "sources": <documents used as context>,
+    #       "context_tokens": <estimated tokens in the context>
     #   }
     return gather_stage | RunnableParallel({
         "answer": answer_chain,
         "sources": itemgetter("context"),
+        "context_tokens": itemgetter("context_tokens"),
+    })
+
+
+def build_retrieval_chain(vectordb, executor=None, sparse_index=None, k=25, route_queries=False):
+    """
+    Build the retrieval steps: query in, scored candidates out.
+
+    Input:
+        str (the question), or
+        {"question": str, "filters": dict | None} (see router.py)
+
+    Output:
+        {"query": str, "results": list[(Document, float)]}
+    """
+
+    # --------------------------------------------------------
+    # STEP 1 — Attach retrieval parameters to the incoming query
+    # --------------------------------------------------------
+    # This stage:
+    #   • splits the input into the query and its metadata filters
+    #     (from the request, or from the query router when
+    #     `route_queries` is on and the request has none)
+    #   • attaches the vectordb (and BM25 index, if any)
+    #   • defines how many documents to retrieve (k)
+    #
+    # Output example:
+    #   {
+    #       "query": "...",
+    #       "filters": {"type": "table"} | None,
+    #       "vectordb": <Chroma instance>,
+    #       "sparse_index": <BM25Index | None>,
+    #       "k": 25
+    #   }
+
+    retrieval_inputs = RunnableLambda(
+        partial(resolve_request, route=route_queries), name="resolve_request"
+    ) | RunnableParallel({
+        "query": itemgetter("query"),
+        "filters": itemgetter("filters"),
+        "vectordb": lambda _: vectordb,
+        "sparse_index": lambda _: sparse_index,
+        "k": lambda _: k,
+    })
+
+    # --------------------------------------------------------
+    # STEP 2 — Retrieve
+    # --------------------------------------------------------
+    # Embeds the query (embed_query), then runs vector search
+    # (retrieve_with_scores); in hybrid mode BM25 search runs in
+    # parallel and the two are fused by reciprocal rank. Both
+    # searches only consider chunks passing the filters.
+    #
+    # Output: {"query": str, "results": List[(Document, float)]}
+    dense_search = (
+        RunnablePassthrough.assign(embedding=offload(embed_query, executor))
+        | offload(retrieve_with_scores, executor)
+    )
+    if sparse_index is None:
+        search = dense_search
+    else:
+        search = RunnableParallel({
+            "dense": dense_search,
+            "sparse": offload(sparse_retrieve_with_scores, executor),
+            "k": itemgetter("k"),
+        }) | offload(reciprocal_rank_fusion, executor)
+
+    return retrieval_inputs | RunnableParallel({
+        "query": itemgetter("query"),
+        "results": search,
     })
+
+
+def build_pipeline(
+    vectordb,
+    llm,
+    executor=None,
+    sparse_index=None,
+    k=25,
+    top_k=16,
+    title_match_score_weight=10,
+    context_token_budget=4000,
+    route_queries=False,
+    reranker=None,
+):
+    """
+    Build the Retrieval-Augmented Generation (RAG) pipeline.
+    The pipeline retrieves documents, re-ranks them using
+    custom title-matching logic, enriches tables, and generates
+    an answer along with the supporting sources.
+
+    When invoked with `ainvoke`, the CPU-bound steps (query embedding +
+    vector search, re-ranking, table parsing) run on `executor`, so the
+    event loop stays free while they work.
+
+    With a `sparse_index` (bm25.BM25Index), retrieval is hybrid: dense
+    and BM25 search run concurrently and are merged with reciprocal-rank
+    fusion before re-ranking.
+
+    `k` candidates are retrieved and the re-ranker keeps the best `top_k`;
+    those then fill at most `context_token_budget` tokens of context.
+
+    The input is the question, or {"question", "filters"} to restrict
+    the search by type, chapter or page range. With `route_queries`,
+    questions without filters go through router.route_query.
+
+    With a `reranker` (reranker.CrossEncoderReranker), a cross-encoder
+    re-scores the re-ranker's best chunks and keeps the best few.
+    """
+    # STEP 1 + 2 — retrieve; STEP 3 onwards — re-rank, build context, generate
+    return build_retrieval_chain(
+        vectordb,
+        executor=executor,
+        sparse_index=sparse_index,
+        k=k,
+        route_queries=route_queries,
+    ) | build_generation_chain(
+        llm,
+        executor=executor,
+        top_k=top_k,
+        title_match_score_weight=title_match_score_weight,
+        context_token_budget=context_token_budget,
+        reranker=reranker,
+    )
+
+
+def build_batch_pipeline(
+    vectordb,
+    llm,
+    executor=None,
+    sparse_index=None,
+    k=25,
+    top_k=16,
+    title_match_score_weight=10,
+    context_token_budget=4000,
+    max_concurrency=8,
+    route_queries=False,
+    reranker=None,
+):
+    """
+    Build a pipeline that answers a list of questions at once.
+
+      • identical questions are answered once
+      • all questions are embedded in one model call and searched in
+        one vector-store query (batch_retrieve_with_scores)
+      • generation runs through the chain's `abatch` with at most
+        `max_concurrency` questions in flight
+
+    Input:
+        list[str], or {"questions": list[str], "filters": dict | None}
+        to apply the same metadata filters to every question
+
+    Output:
+        list of result dicts (as from build_pipeline) or Exceptions,
+        in the order of the input questions
+    """
+    generation_chain = build_generation_chain(
+        llm,
+        executor=executor,
+        top_k=top_k,
+        title_match_score_weight=title_match_score_weight,
+        context_token_budget=context_token_budget,
+        reranker=reranker,
+    )
+
+    def prepare(questions, filters):
+        unique = list(dict.fromkeys(questions))
+        if unique and filters is None and route_queries:
+            # One vector-store query serves the whole batch, so routing
+            # only applies when every question routes the same way
+            routed = [route_query(q) for q in unique]
+            if all(r == routed[0] for r in routed):
+                filters = routed[0]
+        all_results = batch_retrieve_with_scores({
+            "queries": unique,
+            "vectordb": vectordb,
+            "sparse_index": sparse_index,
+            "k": k,
+            "filters": filters,
+        })
+        inputs = [
+            {"query": query, "results": results}
+            for query, results in zip(unique, all_results)
+        ]
+        return unique, inputs
+
+    def split_batch(request):
+        if isinstance(request, dict):
+            return request["questions"], normalize_filters(request.get("filters"))
+        return request, None
+
+    # `config` carries the caller's callbacks (e.g. StageTimer), so the
+    # generation runs are traced as children of the batch run
+    def answer_batch(request, config):
+        questions, filters = split_batch(request)
+        unique, inputs = prepare(questions, filters)
+        outputs = generation_chain.batch(
+            inputs,
+            config=patch_config(config, max_concurrency=max_concurrency),
+            return_exceptions=True,
+        )
+        by_question = dict(zip(unique, outputs))
+        return [by_question[q] for q in questions]
+
+    async def aanswer_batch(request, config):
+        questions, filters = split_batch(request)
+        loop = asyncio.get_running_loop()
+        unique, inputs = await loop.run_in_executor(executor, prepare, questions, filters)
+        outputs = await generation_chain.abatch(
+            inputs,
+            config=patch_config(config, max_concurrency=max_concurrency),
+            return_exceptions=True,
+        )
+        by_question = dict(zip(unique, outputs))
+        return [by_question[q] for q in questions]
+
+    return RunnableLambda(answer_batch, afunc=aanswer_batch, name="answer_batch")
@@ -0,0 +1,200 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from pathlib import Path
+
+from cache import normalize_query_text
+from metrics import RERANK_EARLY_EXITS, RERANK_RESULTS
+
+# sentence_transformers (and torch behind it) is imported inside
+# load_cross_encoder, like the embedding model in embeddings.py.
+
+CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+def load_cross_encoder(model_name=CROSS_ENCODER_MODEL, max_length=512):
+    """
+    Load a sentence-transformers CrossEncoder on the CPU, cached in the
+    same models/ folder as the embedding model.
+
+    Returns:
+        CrossEncoder (anything with predict(list[(query, text)]) works)
+    """
+    model_dir = Path(__file__).resolve().parent / "models"
+    model_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["HF_HOME"] = str(model_dir)
+
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+    print(f"✔ Cross-encoder {model_name} loaded")
+    return model
+
+
+class CrossEncoderReranker:
+    """
+    Second re-ranking stage: scores the best `candidates` chunks of the
+    title-weighted re-ranker against the query with a cross-encoder,
+    all pairs in one batched forward pass, and keeps the best `top_k`.
+
+      • scores are cached per (normalized query, chunk id), LRU-bounded
+      • if the forward pass does not finish within `budget_seconds`,
+        the heuristic order is returned instead. A pass that already
+        started completes in the background and fills the cache; one
+        still waiting is cancelled, and while a pass waits behind the
+        running one new requests skip scoring, so an overloaded worker
+        never builds a backlog of passes nobody waits for
+      • early exit: when the best chunk outscores the runner-up by at
+        least `early_exit_margin`, only that chunk is kept
+    """
+
+    def __init__(
+        self,
+        model,
+        candidates=16,
+        top_k=4,
+        budget_seconds=0.25,
+        early_exit_margin=4.0,
+        cache_size=4096,
+    ):
+        self.model = model
+        self.candidates = candidates
+        self.top_k = top_k
+        self.budget_seconds = budget_seconds
+        self.early_exit_margin = early_exit_margin
+        self.cache_size = cache_size
+
+        # One forward pass at a time; torch already uses every core for it
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-rerank")
+        self._scores = OrderedDict()   # (query, chunk id) -> score
+        self._queued = 0               # passes submitted but not started
+        self._lock = threading.Lock()
+
+        self.scored = 0
+        self.cache_hits = 0
+        self.fallbacks = 0
+        self.busy = 0
+        self.early_exits = 0
+
+    # --------------------------------------------------------
+    # Score cache
+    # --------------------------------------------------------
+    @staticmethod
+    def _key(query, doc):
+        return normalize_query_text(query), doc.id or doc.page_content
+
+    def _cached(self, key):
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def _store(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._scores[key] = float(score)
+                self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def _submit(self, query, docs, keys):
+        """Queue a forward pass, or None if one is already waiting to start."""
+        with self._lock:
+            if self._queued:
+                return None
+            self._queued += 1
+        return self._executor.submit(self._run_queued, query, docs, keys)
+
+    def _run_queued(self, query, docs, keys):
+        with self._lock:
+            self._queued -= 1
+        return self._predict(query, docs, keys)
+
+    def _predict(self, query, docs, keys):
+        scores = self.model.predict([(query, doc.page_content) for doc in docs], batch_size=len(docs))
+        self._store(keys, scores)
+        return [float(score) for score in scores]
+
+    # --------------------------------------------------------
+    # Re-ranking
+    # --------------------------------------------------------
+    def rerank(self, query, docs):
+        """
+        Re-rank heuristic-ordered `docs` (best first).
+
+        Returns:
+            list[Document] — at most `top_k`, or `docs` unchanged when
+            the latency budget is exceeded
+        """
+        candidates = docs[:self.candidates]
+        if len(candidates) < 2:
+            return candidates
+
+        keys = [self._key(query, doc) for doc in candidates]
+        scores = [self._cached(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            future = self._submit(query, [candidates[i] for i in missing], [keys[i] for i in missing])
+            if future is None:
+                self.busy += 1
+                RERANK_RESULTS.inc(result="busy")
+                return docs
+            try:
+                for i, score in zip(missing, future.result(timeout=self.budget_seconds)):
+                    scores[i] = score
+            except TimeoutError:
+                if future.cancel():
+                    with self._lock:
+                        self._queued -= 1
+                self.fallbacks += 1
+                RERANK_RESULTS.inc(result="fallback")
+                return docs
+            self.scored += 1
+            RERANK_RESULTS.inc(result="scored")
+        else:
+            self.cache_hits += 1
+            RERANK_RESULTS.inc(result="cached")
+
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+        if scores[order[0]] - scores[order[1]] >= self.early_exit_margin:
+            self.early_exits += 1
+            RERANK_EARLY_EXITS.inc()
+            return [candidates[order[0]]]
+        return [candidates[i] for i in order[:self.top_k]]
+
+    def warm_up(self):
+        """One forward pass so the first request does not pay for it."""
+        self.model.predict([("flap retraction schedule", "Flaps up maneuver speed")])
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._scores)
+        return {
+            "scored": self.scored,
+            "cache_hits": self.cache_hits,
+            "fallbacks": self.fallbacks,
+            "busy": self.busy,
+            "early_exits": self.early_exits,
+            "entries": entries,
+        }
+
+
+def cross_encoder_rerank(inputs):
+    """
+    Pipeline step for CrossEncoderReranker.
+
+    Inputs:
+        inputs (dict):
+            {
+                "query": str,
+                "docs": list[Document] (title-weighted order, best first),
+                "reranker": CrossEncoderReranker
+            }
+
+    Returns:
+        list[Document]
+    """
+    return inputs["reranker"].rerank(inputs["query"], inputs["docs"])
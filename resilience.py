@@ -0,0 +1,500 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import numpy as np
+from langchain_core.runnables import Runnable
+
+from metrics import LLM_CALLS, LLM_CIRCUIT_OPEN
+
+
+class LLMUnavailable(Exception):
+    """The LLM call failed, timed out, or was refused by the open circuit breaker."""
+
+
+# ======================================================================
+# --------------------------- CIRCUIT BREAKER ---------------------------
+# ======================================================================
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream that keeps failing.
+
+      closed    — calls go through; `failure_threshold` failures in a
+                  row open the breaker
+      open      — calls are refused for `reset_seconds`
+      half-open — then one trial call is let through: success closes
+                  the breaker, failure opens it again
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return "open"
+            return "half-open"
+
+    def allow(self):
+        """True if a call may go through now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+        LLM_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            LLM_CIRCUIT_OPEN.set(1)
+
+    def record_cancelled(self):
+        """
+        The call was abandoned before it had an outcome (client went away,
+        task cancelled). Counts as neither success nor failure; only frees
+        the half-open trial slot so the next call can be the trial.
+        """
+        with self._lock:
+            self._trial_running = False
+
+
+# ======================================================================
+# ---------------------------- RESILIENT LLM ----------------------------
+# ======================================================================
+
+def prompt_key(input):
+    """Coalescing key of an LLM input (prompt value, messages or string)."""
+    if hasattr(input, "to_messages"):
+        text = "\x00".join(f"{m.type}:{m.content}" for m in input.to_messages())
+    else:
+        text = str(input)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResilientLLM(Runnable):
+    """
+    Wrap the chat model.
+
+      • concurrency   — at most `max_concurrency` upstream requests in
+                        flight (sync and async callers are limited
+                        separately, since a threading semaphore would
+                        block the event loop). Waiting for a slot is
+                        local queueing, not upstream latency: the
+                        deadline, the hedge timer and the latency
+                        samples only start once the slot is held
+      • single-flight — identical prompts in flight at the same time
+                        share one upstream call (invoke / ainvoke)
+      • deadline      — a call that has not answered (or, when
+                        streaming, produced its first token) within
+                        `deadline_seconds` is abandoned
+      • hedging       — if the first attempt is slower than the
+                        `hedge_quantile` of recent latencies, a second
+                        identical request is sent and the first answer
+                        wins (0 disables; needs `hedge_min_samples`;
+                        only sent when a slot is free right away)
+      • breaker       — repeated failures open a CircuitBreaker
+
+    An abandoned attempt keeps its slot until the upstream request has
+    really ended. Every failure is raised as LLMUnavailable, which
+    build_generation_chain turns into a sources-only answer.
+    """
+
+    def __init__(
+        self,
+        bound,
+        max_concurrency=4,
+        deadline_seconds=60.0,
+        hedge_quantile=0.95,
+        hedge_min_samples=20,
+        failure_threshold=5,
+        reset_seconds=30.0,
+    ):
+        self.bound = bound
+        self.max_concurrency = max_concurrency
+        self.deadline_seconds = deadline_seconds
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = asyncio.Semaphore(max_concurrency)
+        self._latencies = deque(maxlen=200)   # seconds of recent successful calls
+        self._lock = threading.Lock()
+        self._sync_inflight = {}    # key -> Future
+        self._async_inflight = {}   # key -> [Task, waiters]
+        # Sync attempts run here so they can be abandoned at the deadline
+        self._threads = ThreadPoolExecutor(max_workers=32, thread_name_prefix="rag-llm")
+
+    @property
+    def InputType(self):
+        return self.bound.InputType
+
+    @property
+    def OutputType(self):
+        return self.bound.OutputType
+
+    # --------------------------------------------------------
+    # Bookkeeping
+    # --------------------------------------------------------
+    def hedge_delay(self):
+        """Seconds before a hedged request is sent, or None (no hedging)."""
+        if not self.hedge_quantile:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = list(self._latencies)
+        return float(np.quantile(latencies, self.hedge_quantile))
+
+    def _success(self, elapsed):
+        with self._lock:
+            self._latencies.append(elapsed)
+        self.breaker.record_success()
+
+    def _failure(self, error, reason):
+        self.breaker.record_failure()
+        LLM_CALLS.inc(result=reason)
+        return LLMUnavailable(f"LLM {reason}: {error}")
+
+    def _admit(self, slots):
+        """Check the breaker once a slot is held; give the slot back if refused."""
+        if not self.breaker.allow():
+            slots.release()
+            LLM_CALLS.inc(result="rejected")
+            raise LLMUnavailable("LLM circuit breaker is open")
+
+    def _settle(self, error):
+        """Called for any exception leaving an admitted call."""
+        if not isinstance(error, LLMUnavailable):
+            # Cancelled or interrupted: _success/_failure never ran
+            self.breaker.record_cancelled()
+
+    # --------------------------------------------------------
+    # Sync
+    # --------------------------------------------------------
+    def _call(self, input, config, **kwargs):
+        self._sync_slots.acquire()
+        self._admit(self._sync_slots)
+        try:
+            return self._hedged_call(input, config, **kwargs)
+        except BaseException as e:
+            self._settle(e)
+            raise
+
+    def _attempt(self, input, config, **kwargs):
+        """One upstream request, run in a pool thread; frees its slot when it ends."""
+        try:
+            return self.bound.invoke(input, config, **kwargs)
+        finally:
+            self._sync_slots.release()
+
+    def _hedged_call(self, input, config, **kwargs):
+        start = time.perf_counter()
+        deadline = start + self.deadline_seconds
+        hedge_at = self.hedge_delay()
+
+        attempts = {self._threads.submit(self._attempt, input, config, **kwargs)}
+        hedge = None
+        last_error = None
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                raise self._failure(f"no answer after {self.deadline_seconds:g}s", "timeout")
+            timeout = deadline - now
+            if hedge is None and hedge_at is not None:
+                timeout = min(timeout, max(start + hedge_at - now, 0))
+
+            done, attempts = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    self._success(time.perf_counter() - start)
+                    LLM_CALLS.inc(result="hedge_won" if future is hedge else "ok")
+                    return future.result()
+                last_error = future.exception()
+
+            if not attempts:
+                raise self._failure(last_error, "error")
+            if hedge is None and hedge_at is not None and time.perf_counter() >= start + hedge_at:
+                if self._sync_slots.acquire(blocking=False):
+                    LLM_CALLS.inc(result="hedged")
+                    hedge = self._threads.submit(self._attempt, input, config, **kwargs)
+                    attempts = attempts | {hedge}
+                else:
+                    hedge_at = None   # every slot is busy: a hedge would only queue
+
+    def invoke(self, input, config=None, **kwargs):
+        key = prompt_key(input)
+        with self._lock:
+            shared = self._sync_inflight.get(key)
+            if shared is None:
+                future = self._sync_inflight[key] = Future()
+        if shared is not None:
+            LLM_CALLS.inc(result="coalesced")
+            return shared.result()
+
+        # Leader: make the call in this thread and share the outcome
+        try:
+            result = self._call(input, config, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._forget(self._sync_inflight, key, future)
+
+    def _forget(self, inflight, key, entry):
+        with self._lock:
+            if inflight.get(key) is entry:
+                del inflight[key]
+
+    # --------------------------------------------------------
+    # Async
+    # --------------------------------------------------------
+    def _start_attempt(self, input, config, **kwargs):
+        """One upstream request as a task (its slot already held); the slot is freed when it ends."""
+        task = asyncio.ensure_future(self.bound.ainvoke(input, config, **kwargs))
+        task.add_done_callback(lambda _: self._async_slots.release())
+        return task
+
+    async def _acall(self, input, config, **kwargs):
+        await self._async_slots.acquire()
+        self._admit(self._async_slots)
+        start = time.perf_counter()
+        deadline = start + self.deadline_seconds
+        hedge_at = self.hedge_delay()
+
+        attempts = {self._start_attempt(input, config, **kwargs)}
+        hedge = None
+        last_error = None
+        try:
+            while True:
+                now = time.perf_counter()
+                if now >= deadline:
+                    raise self._failure(f"no answer after {self.deadline_seconds:g}s", "timeout")
+                timeout = deadline - now
+                if hedge is None and hedge_at is not None:
+                    timeout = min(timeout, max(start + hedge_at - now, 0))
+
+                done, attempts = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._success(time.perf_counter() - start)
+                        LLM_CALLS.inc(result="hedge_won" if task is hedge else "ok")
+                        return task.result()
+                    last_error = task.exception()
+
+                if not attempts:
+                    raise self._failure(last_error, "error")
+                if hedge is None and hedge_at is not None and time.perf_counter() >= start + hedge_at:
+                    if not self._async_slots.locked():
+                        await self._async_slots.acquire()   # free, so this does not wait
+                        LLM_CALLS.inc(result="hedged")
+                        hedge = self._start_attempt(input, config, **kwargs)
+                        attempts.add(hedge)
+                    else:
+                        hedge_at = None   # every slot is busy: a hedge would only queue
+        except BaseException as e:
+            self._settle(e)
+            raise
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        key = prompt_key(input)
+        entry = self._async_inflight.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(self._acall(input, config, **kwargs)), 0]
+            self._async_inflight[key] = entry
+            entry[0].add_done_callback(lambda _: self._forget(self._async_inflight, key, entry))
+        else:
+            LLM_CALLS.inc(result="coalesced")
+
+        # The shared call outlives a cancelled waiter, unless it was the last one
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                entry[0].cancel()
+
+    # --------------------------------------------------------
+    # Streaming
+    # --------------------------------------------------------
+    def stream(self, input, config=None, **kwargs):
+        self._sync_slots.acquire()
+        self._admit(self._sync_slots)
+        try:
+            start = time.perf_counter()
+            try:
+                yield from self.bound.stream(input, config, **kwargs)
+            except Exception as e:
+                raise self._failure(e, "error") from e
+            except BaseException as e:
+                # Consumer closed the stream early
+                self._settle(e)
+                raise
+            self._success(time.perf_counter() - start)
+            LLM_CALLS.inc(result="ok")
+        finally:
+            self._sync_slots.release()
+
+    async def astream(self, input, config=None, **kwargs):
+        """
+        Stream the answer. The deadline and hedging apply to the first
+        token: the stream that produces it first is kept, the other one
+        is closed. Streams are not coalesced.
+        """
+        await self._async_slots.acquire()
+        self._admit(self._async_slots)
+        start = time.perf_counter()
+        deadline = start + self.deadline_seconds
+        hedge_at = self.hedge_delay()
+
+        streams = {}   # first-token task -> stream
+        holding = []   # open streams, each holding a slot until closed
+
+        def open_stream():
+            stream = self.bound.astream(input, config, **kwargs)
+            task = asyncio.ensure_future(stream.__anext__())
+            streams[task] = stream
+            holding.append(stream)
+            return stream
+
+        async def close(stream):
+            try:
+                await stream.aclose()
+            finally:
+                holding.remove(stream)
+                self._async_slots.release()
+
+        open_stream()
+        hedge = winner = first = last_error = None
+        try:
+            try:
+                while winner is None:
+                    now = time.perf_counter()
+                    if now >= deadline:
+                        raise self._failure(f"no first token after {self.deadline_seconds:g}s", "timeout")
+                    timeout = deadline - now
+                    if hedge is None and hedge_at is not None:
+                        timeout = min(timeout, max(start + hedge_at - now, 0))
+
+                    done, _ = await asyncio.wait(streams, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        stream = streams.pop(task)
+                        if task.exception() is None:
+                            winner, first = stream, task.result()
+                            break
+                        if not isinstance(task.exception(), StopAsyncIteration):
+                            last_error = task.exception()
+                        await close(stream)
+
+                    if winner is None and not streams:
+                        raise self._failure(last_error or "empty stream", "error")
+                    if winner is None and hedge is None and hedge_at is not None \
+                            and time.perf_counter() >= start + hedge_at:
+                        if not self._async_slots.locked():
+                            await self._async_slots.acquire()   # free, so this does not wait
+                            LLM_CALLS.inc(result="hedged")
+                            hedge = open_stream()
+                        else:
+                            hedge_at = None   # every slot is busy: a hedge would only queue
+            except BaseException as e:
+                self._settle(e)
+                raise
+            finally:
+                # Close the losing (or abandoned) streams
+                for task, stream in streams.items():
+                    task.cancel()
+                    try:
+                        await task
+                    except BaseException:
+                        pass
+                    await close(stream)
+
+            try:
+                yield first
+                async for chunk in winner:
+                    yield chunk
+            except Exception as e:
+                raise self._failure(e, "error") from e
+            except BaseException as e:
+                # Consumer closed the stream early
+                self._settle(e)
+                raise
+            self._success(time.perf_counter() - start)
+            LLM_CALLS.inc(result="hedge_won" if winner is hedge else "ok")
+        finally:
+            for stream in list(holding):
+                await close(stream)
+
+
+# ======================================================================
+# -------------------------- SOURCES-ONLY ANSWER -------------------------
+# ======================================================================
+# What the user gets while the LLM is unavailable: the pages and sections
+# retrieval found, without a generated answer. Such answers are not cached.
+
+SOURCES_ONLY_NOTICE = "The answer service is unavailable right now."
+
+
+def is_sources_only(answer):
+    return isinstance(answer, str) and answer.startswith(SOURCES_ONLY_NOTICE)
+
+
+def sources_only_answer(inputs):
+    """
+    Fallback for the answer step.
+
+    Inputs:
+        inputs (dict): {"context": list[Document], "input": str, ...}
+
+    Returns:
+        str
+    """
+    lines = [SOURCES_ONLY_NOTICE]
+    docs = inputs.get("context") or []
+    if not docs:
+        return lines[0] + " No relevant pages were found for this question."
+
+    lines.append("These pages of the manual are the most relevant to your question:")
+    seen = set()
+    for doc in docs:
+        page = doc.metadata.get("page_number")
+        heading = doc.metadata.get("title") or doc.metadata.get("section") or ""
+        if (page, heading) in seen:
+            continue
+        seen.add((page, heading))
+        lines.append(f"• page {page}: {heading}" if heading else f"• page {page}")
+    return "\n".join(lines)
@@ -1,3 +1,28 @@
+from vector_store import as_vector_store
+
+
+def embed_query(inputs):
+    """
+    Embed the query with the vector store's embedding model.
+    Kept as its own pipeline step so its latency is measured separately
+    from the vector search.
+
+    Inputs:
+        inputs (dict): {"query": str, "vectordb": Chroma | VectorStore}
+
+    Returns:
+        list[float]
+    """
+    return inputs["vectordb"].embeddings.embed_query(inputs["query"])
+
+
+def search_by_vector(vectordb, embedding, k, filters=None):
+    """
+    Vector search for a precomputed query embedding. Every store
+    returns relevance scores exactly as Chroma's
+    similarity_search_with_relevance_scores does (see vector_store.py).
+    """
+    return as_vector_store(vectordb).search(embedding, k, filters)
 
 
 def retrieve_with_scores(inputs):
@@ -8,8 +33,10 @@ def retrieve_with_scores(inputs):
         inputs (dict):
             {
                 "query": str,
-                "vectordb": Chroma,
-                "k": int
+                "vectordb": Chroma | VectorStore,
+                "k": int,
+                "embedding": list[float] (optional, precomputed query embedding),
+                "filters": dict (optional, metadata filters, see router.py)
             }
 
     Returns:
@@ -18,9 +45,123 @@ def retrieve_with_scores(inputs):
     query = inputs["query"]
     vectordb = inputs["vectordb"]
     k = inputs.get("k", 25)
+    embedding = inputs.get("embedding")
+
+    if embedding is None:
+        embedding = vectordb.embeddings.embed_query(query)
+    return search_by_vector(vectordb, embedding, k, inputs.get("filters"))
+
+
+def sparse_retrieve_with_scores(inputs):
+    """
+    Perform BM25 keyword search with scores.
+
+    Inputs:
+        inputs (dict):
+            {
+                "query": str,
+                "sparse_index": BM25Index,
+                "k": int,
+                "filters": dict (optional, metadata filters, see router.py)
+            }
+
+    Returns:
+        list[(Document, float)]
+    """
+    query = inputs["query"]
+    sparse_index = inputs["sparse_index"]
+    k = inputs.get("k", 25)
+
+    return sparse_index.search(query, k=k, filters=inputs.get("filters"))
+
+
+def reciprocal_rank_fusion(inputs):
+    """
+    Merge dense and sparse results with reciprocal-rank fusion:
+        score(doc) = sum over lists of 1 / (rrf_k + rank)
+
+    Scores are divided by the best possible score (rank 1 in both
+    lists), so they stay in [0, 1] like the vector relevance scores the
+    re-ranker expects.
+
+    Inputs:
+        inputs (dict):
+            {
+                "dense": list[(Document, float)],
+                "sparse": list[(Document, float)],
+                "k": int,
+                "rrf_k": int (optional, default 60)
+            }
+
+    Returns:
+        list[(Document, float)] (top k by fused score)
+    """
+    k = inputs.get("k", 25)
+    rrf_k = inputs.get("rrf_k", 60)
+    result_lists = [inputs["dense"], inputs["sparse"]]
+    max_score = len(result_lists) / (rrf_k + 1)
+
+    fused = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = doc.id or doc.page_content
+            score, first_doc = fused.get(key, (0.0, doc))
+            fused[key] = (score + 1.0 / (rrf_k + rank), first_doc)
+
+    ranked = sorted(fused.values(), key=lambda x: x[0], reverse=True)
+    return [(doc, score / max_score) for score, doc in ranked[:k]]
+
+
+def batch_search_by_vector(vectordb, embeddings, k, filters=None):
+    """
+    Vector search for many query embeddings in one store query.
 
-    return vectordb.similarity_search_with_relevance_scores(query, k=k)
+    Returns:
+        list[list[(Document, float)]] — one result list per embedding
+    """
+    return as_vector_store(vectordb).search_batch(embeddings, k, filters)
+
+
+def batch_retrieve_with_scores(inputs):
+    """
+    Retrieve for many queries at once: one embedding call for all
+    queries and one vector-store query for all embeddings. In hybrid
+    mode each query's BM25 results are fused in as usual.
+
+    Inputs:
+        inputs (dict):
+            {
+                "queries": list[str],
+                "vectordb": Chroma | VectorStore,
+                "sparse_index": BM25Index | None,
+                "k": int,
+                "filters": dict (optional, applied to every query)
+            }
+
+    Returns:
+        list[list[(Document, float)]] — one result list per query
+    """
+    queries = inputs["queries"]
+    vectordb = inputs["vectordb"]
+    sparse_index = inputs.get("sparse_index")
+    k = inputs.get("k", 25)
+    filters = inputs.get("filters")
 
+    if not queries:
+        return []
 
+    query_embeddings = vectordb.embeddings.embed_documents(queries)
+    dense_lists = batch_search_by_vector(vectordb, query_embeddings, k, filters)
 
+    all_results = []
+    for query, dense in zip(queries, dense_lists):
+        if sparse_index is None:
+            all_results.append(dense)
+        else:
+            all_results.append(reciprocal_rank_fusion({
+                "dense": dense,
+                "sparse": sparse_index.search(query, k=k, filters=filters),
+                "k": k,
+            }))
 
+    return all_results
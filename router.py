@@ -0,0 +1,170 @@
+import re
+
+# ======================================================================
+# ------------------------------ CHAPTERS -------------------------------
+# ======================================================================
+# The manual's chapters, with the pages they span. Chunks are tagged
+# with the chapter id at index time: from the source's "chapter" field
+# when it has one, otherwise from its page number (texts.json has none).
+
+CHAPTERS = {
+    "normal_procedures": ("Normal Procedures", 1, 56),
+    "supplementary_procedures": ("Supplementary Procedures", 57, 76),
+    "performance_dispatch": ("Performance Dispatch", 77, 107),
+    "airplane_general": ("Airplane General, Emergency Equipment, Doors, Windows", 108, None),
+}
+
+DOC_TYPES = ("text", "table", "diagram")
+
+
+def chapter_id(chapter=None, page_number=None):
+    """
+    Chapter id for a source record, e.g. "Performance dispatch" → "performance_dispatch".
+    Falls back to the chapter page ranges; None if neither matches.
+    """
+    if chapter:
+        name = " ".join(re.findall(r"[a-z]+", chapter.lower()))
+        for cid, (title, _, _) in CHAPTERS.items():
+            if " ".join(re.findall(r"[a-z]+", title.lower().split(",")[0])) in name:
+                return cid
+
+    if page_number is not None:
+        for cid, (_, first, last) in CHAPTERS.items():
+            if first <= int(page_number) and (last is None or int(page_number) <= last):
+                return cid
+    return None
+
+
+# ======================================================================
+# ------------------------------- FILTERS -------------------------------
+# ======================================================================
+# A filter is a dict with any of:
+#   {"type": "text" | "table" | "diagram",
+#    "chapter": <chapter id>,
+#    "page_from": int, "page_to": int}
+
+def normalize_filters(filters):
+    """
+    Validate a filter dict and drop empty keys.
+    Returns None when nothing is left; raises ValueError on bad values.
+    """
+    if not filters:
+        return None
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    unknown = set(filters) - {"type", "chapter", "page_from", "page_to"}
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {sorted(unknown)}")
+    if "type" in filters and filters["type"] not in DOC_TYPES:
+        raise ValueError(f"type must be one of {DOC_TYPES}")
+    if "chapter" in filters and filters["chapter"] not in CHAPTERS:
+        raise ValueError(f"chapter must be one of {tuple(CHAPTERS)}")
+    for key in ("page_from", "page_to"):
+        if key in filters:
+            filters[key] = int(filters[key])
+
+    return filters or None
+
+
+def chroma_where(filters):
+    """Translate a filter dict into a Chroma `where` clause (None = no filter)."""
+    if not filters:
+        return None
+
+    conditions = []
+    for key in ("type", "chapter"):
+        if key in filters:
+            conditions.append({key: {"$eq": filters[key]}})
+    if "page_from" in filters:
+        conditions.append({"page_number": {"$gte": filters["page_from"]}})
+    if "page_to" in filters:
+        conditions.append({"page_number": {"$lte": filters["page_to"]}})
+
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def matches_filters(metadata, filters):
+    """True if a chunk's metadata passes the filter (same rules as chroma_where)."""
+    if not filters:
+        return True
+    for key in ("type", "chapter"):
+        if key in filters and metadata.get(key) != filters[key]:
+            return False
+    page = metadata.get("page_number")
+    if "page_from" in filters and (page is None or page < filters["page_from"]):
+        return False
+    if "page_to" in filters and (page is None or page > filters["page_to"]):
+        return False
+    return True
+
+
+# ======================================================================
+# ------------------------------- ROUTER --------------------------------
+# ======================================================================
+# Only unambiguous phrasings narrow the search; anything else searches
+# the whole collection as before.
+
+TYPE_PATTERNS = [
+    ("table", re.compile(r"\b(table|tables|chart|charts)\b")),
+    ("diagram", re.compile(r"\b(diagram|diagrams|schematic|schematics|illustration)\b")),
+]
+
+CHAPTER_PATTERNS = [
+    ("performance_dispatch", re.compile(r"\bperformance dispatch\b")),
+    ("supplementary_procedures", re.compile(r"\bsupplementary procedures?\b")),
+    ("normal_procedures", re.compile(r"\bnormal procedures?\b")),
+]
+
+PAGE_PATTERN = re.compile(r"\bpages? (\d{1,3})(?:\s*(?:-|–|to|and)\s*(\d{1,3}))?\b")
+
+
+def route_query(query):
+    """
+    Detect obvious intents in the question and return filters for them,
+    e.g. "flaps 40 table" → {"type": "table"}, "on page 45" → page 45 only.
+
+    Returns:
+        filter dict or None
+    """
+    text = query.lower()
+    filters = {}
+
+    types = {doc_type for doc_type, pattern in TYPE_PATTERNS if pattern.search(text)}
+    if len(types) == 1:
+        filters["type"] = types.pop()
+
+    for cid, pattern in CHAPTER_PATTERNS:
+        if pattern.search(text):
+            filters["chapter"] = cid
+            break
+
+    match = PAGE_PATTERN.search(text)
+    if match:
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        filters["page_from"], filters["page_to"] = min(first, last), max(first, last)
+
+    return filters or None
+
+
+def split_request(request):
+    """
+    Pipeline input → (question, filters). The input is either the
+    question string or {"question": str, "filters": dict | None}.
+    """
+    if isinstance(request, str):
+        return request, None
+    return request["question"], normalize_filters(request.get("filters"))
+
+
+def resolve_request(request, route=False):
+    """
+    Pipeline input → {"query": str, "filters": dict | None}.
+    Explicit filters win; otherwise, with `route`, the router's.
+    """
+    question, filters = split_request(request)
+    if filters is None and route:
+        filters = route_query(question)
+    return {"query": question, "filters": filters}
@@ -1,4 +1,18 @@
-from utils import count_keyword_matches
+import numpy as np
+
+from utils import clean_tokenize
+
+
+def title_token_set(doc):
+    """
+    Title tokens of a chunk. Uses the set precomputed at index time
+    (metadata "title_tokens"), falling back to tokenizing the title for
+    stores built before it existed.
+    """
+    tokens = doc.metadata.get("title_tokens")
+    if tokens is not None:
+        return set(tokens.split())
+    return set(clean_tokenize(doc.metadata.get("title", "")))
 
 
 def title_weighted_reranker(inputs):
@@ -6,31 +20,49 @@ def title_weighted_reranker(inputs):
     Re-rank docs using:
       final_score = vector_score + (keyword_matches * weight)
 
+    The query is tokenized once; scores are computed as NumPy arrays
+    and the top k are selected with argpartition instead of a full sort.
+
     Inputs:
         inputs (dict):
             {
                 "results": list[(Document, float)],
                 "query": str,
-                "weight": float
+                "weight": float,
+                "top_k": int (optional, default 8)
             }
 
     Returns:
-        list[Document] (top 8)
+        list[Document] (top k)
     """
     results = inputs["results"]
     query = inputs["query"]
     weight = inputs["weight"]
-    top_k = 8
+    top_k = inputs.get("top_k", 8)
+
+    if not results or top_k <= 0:
+        return []
+
+    query_words = set(clean_tokenize(query))
+
+    vector_scores = np.fromiter(
+        (score for _, score in results), dtype=np.float64, count=len(results)
+    )
+    matches = np.fromiter(
+        (len(query_words & title_token_set(doc)) for doc, _ in results),
+        dtype=np.float64,
+        count=len(results),
+    )
 
-    scored = []
+    normalized = matches / max(len(query), 1)
+    final_scores = vector_scores + normalized * weight
 
-    for doc, vector_score in results:
-        title = doc.metadata.get("title", "")
-        matches = count_keyword_matches(query, title)
-        normalized=matches/len(query)
-        boost = normalized * weight
-        final_score = vector_score + boost
-        scored.append((final_score, doc))
+    if len(results) > top_k:
+        top = np.argpartition(-final_scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(results))
 
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [doc for _, doc in scored[:top_k]]
+    # Best first; ties keep retrieval order, like the previous stable sort
+    top = np.sort(top)
+    top = top[np.argsort(-final_scores[top], kind="stable")]
+    return [results[i][0] for i in top]
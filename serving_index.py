@@ -0,0 +1,188 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from embeddings import read_index_version
+from vector_store import ExactSearchStore, read_collection, replace_dir
+
+# Exported next to the Chroma files in PERSIST_DIR
+SERVING_INDEX_DIR = "serving_index"
+
+# ======================================================================
+# --------------------------- ON-DISK FORMAT ----------------------------
+# ======================================================================
+# A directory of plain files, all opened memory-mapped and read-only, so
+# every uvicorn worker shares the same pages through the OS page cache:
+#
+#   manifest.json   — count, dim, distance, index_version, filter vocabularies
+#   embeddings.npy  — float32 (count, dim), in Chroma's order
+#   sq_norms.npy    — float32 (count,), squared L2 norm of each row
+#   types.npy       — int8 code into manifest["types"] (-1 = none)
+#   chapters.npy    — int8 code into manifest["chapters"] (-1 = none)
+#   pages.npy       — float32 page number (NaN = none)
+#   chunks.jsonl    — {"id", "page_content", "metadata"} per line
+#   offsets.npy     — int64 (count + 1,), byte offset of each line
+#
+# Only the rows a query returns are decoded from chunks.jsonl.
+
+ARRAY_FILES = ("embeddings", "sq_norms", "types", "chapters", "pages", "offsets")
+
+
+def export_serving_index(vectordb, out_dir, index_version=None):
+    """
+    Write the contents of a Chroma store in the serving format.
+
+    The files are written to a temporary directory that then replaces
+    `out_dir`; workers that still have the old files mapped keep
+    reading them until they reload.
+
+    Inputs:
+        vectordb (Chroma): the store built by build_vector_store.py
+        out_dir (str | Path): target directory
+        index_version (str | None): version marker of the store
+
+    Returns:
+        int — number of chunks exported
+    """
+    out_dir = Path(out_dir)
+    data = read_collection(vectordb, index_version)
+    vectors = data["vectors"]
+
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    offsets = [0]
+    with (tmp_dir / "chunks.jsonl").open("wb") as f:
+        for doc_id, text, meta in zip(data["ids"], data["texts"], data["metadatas"]):
+            line = json.dumps({"id": doc_id, "page_content": text, "metadata": meta}, ensure_ascii=False)
+            f.write(line.encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+
+    arrays = {
+        "embeddings": vectors,
+        "sq_norms": np.einsum("ij,ij->i", vectors, vectors).astype(np.float32),
+        "types": data["types"],
+        "chapters": data["chapters"],
+        "pages": data["pages"],
+        "offsets": np.array(offsets, dtype=np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(tmp_dir / f"{name}.npy", array)
+
+    (tmp_dir / "manifest.json").write_text(json.dumps(data["manifest"], indent=2), encoding="utf-8")
+
+    # Swap the directories (the old one may still be mapped by workers)
+    replace_dir(tmp_dir, out_dir)
+
+    print(f"Exported {len(data['ids'])} chunks to serving index {str(out_dir)!r}")
+    return len(data["ids"])
+
+
+# ======================================================================
+# ------------------------------- SEARCH --------------------------------
+# ======================================================================
+
+class ServingIndex(ExactSearchStore):
+    """
+    Read-only, memory-mapped copy of the Chroma store with exact NumPy
+    search (see vector_store.ExactSearchStore). Opening it maps the files
+    without reading them, and the mapped pages are shared by every
+    process that opens the same files.
+    """
+
+    def __init__(self, path, embeddings=None):
+        self.path = Path(path)
+        self.embeddings = embeddings
+        self.manifest = json.loads((self.path / "manifest.json").read_text(encoding="utf-8"))
+
+        arrays = {name: np.load(self.path / f"{name}.npy", mmap_mode="r") for name in ARRAY_FILES}
+        self._vectors = arrays["embeddings"]
+        self._sq_norms = arrays["sq_norms"]
+        self._types = arrays["types"]
+        self._chapters = arrays["chapters"]
+        self._pages = arrays["pages"]
+        self._offsets = arrays["offsets"]
+
+        self._chunks_file = (self.path / "chunks.jsonl").open("rb")
+        self._chunks = (
+            mmap.mmap(self._chunks_file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._offsets[-1] else b""
+        )
+
+        self._init_search()
+
+    def document(self, row):
+        """Decode one chunk from chunks.jsonl."""
+        start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+        record = json.loads(self._chunks[start:end])
+        return Document(page_content=record["page_content"], metadata=record["metadata"], id=record["id"])
+
+    def close(self):
+        if isinstance(self._chunks, mmap.mmap):
+            self._chunks.close()
+        self._chunks_file.close()
+
+
+def serving_index_path(persist_dir):
+    return Path(persist_dir) / SERVING_INDEX_DIR
+
+
+def load_serving_index(env, embeddings):
+    """
+    Open the serving index exported into PERSIST_DIR.
+
+    Inputs:
+        env (dict): must contain "PERSIST_DIR"
+        embeddings: embedding function instance (used for query embeddings)
+
+    Returns:
+        ServingIndex
+    """
+    path = serving_index_path(env["PERSIST_DIR"])
+    if not (path / "manifest.json").exists():
+        raise FileNotFoundError(
+            f"No serving index in {str(path)!r}; run `python serving_index.py` "
+            "or build_vector_store.py first"
+        )
+
+    index = ServingIndex(path, embeddings)
+    if index.index_version != read_index_version(env["PERSIST_DIR"]):
+        print("⚠ Serving index is older than the Chroma store; re-export it with `python serving_index.py`")
+    print(f"✔ Serving index mapped: {len(index)} chunks from {str(path)!r}")
+    return index
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# build_vector_store.py exports the index after every sync. To export
+# an existing store by hand:
+#   python serving_index.py
+#
+# Then serve with any number of workers:
+#   VECTOR_STORE=mmap uvicorn main:app --workers 4
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from embeddings import load_vector_db
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export the Chroma store as a memory-mapped serving index.")
+    parser.add_argument("--persist-dir", help="Chroma directory (default: PERSIST_DIR or chroma_db)")
+    args = parser.parse_args()
+
+    persist_dir = args.persist_dir or os.environ.get("PERSIST_DIR", "chroma_db")
+    export_serving_index(
+        load_vector_db({"PERSIST_DIR": persist_dir}, None),
+        serving_index_path(persist_dir),
+        index_version=read_index_version(persist_dir),
+    )
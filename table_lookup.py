@@ -0,0 +1,553 @@
+import csv
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+from utils import PROJECT_DIR
+
+# Tables the lookup engine serves (paths as stored in tables.json)
+PERFORMANCE_TABLE_DIR = "tables/performance_dispatch"
+
+NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+
+# ======================================================================
+# ------------------------------- PARSING -------------------------------
+# ======================================================================
+
+def parse_number(text):
+    """First number in a header / label ("PA_1000" → 1000, "15 TW" → -15), or NaN."""
+    match = NUMBER.search(text.replace(",", ""))
+    if not match:
+        return float("nan")
+    value = float(match.group())
+    # Tailwinds are negative, as on the wind-correction axes
+    if re.search(r"\btw\b|tailwind", text.lower()):
+        value = -abs(value)
+    return value
+
+
+def parse_cell(text):
+    """Cell value as float. Blank and non-numeric cells (e.g. times "1:08") are NaN."""
+    text = text.strip().rstrip(",*")
+    try:
+        return float(text)
+    except ValueError:
+        return float("nan")
+
+
+def header_kind(text):
+    """
+    Physical quantity an axis label refers to, e.g. "OAT (°C)" → "temperature".
+    Returns None when the label does not say.
+    """
+    t = text.lower()
+    if "isa" in t:
+        return "isa"
+    if "oat" in t or "temp" in t or "°c" in t or t.startswith("c_") or t.endswith("_c_"):
+        return "temperature"
+    if "field length" in t or "field_length" in t:
+        return "field_length"
+    if "wind" in t or re.search(r"\b(hw|tw)\b", t) or t.startswith("hd"):
+        return "wind"
+    if "dist" in t:
+        return "distance"
+    if "weight" in t:
+        return "weight"
+    if "obstacle" in t or "height" in t:
+        return "obstacle_height"
+    if re.search(r"ft\b|alt|\bpa_|pressure", t):
+        return "altitude"
+    if "crew" in t:
+        return "crew"
+    if "speed" in t or "kias" in t:
+        return "speed"
+    return None
+
+
+def column_kind(header):
+    """
+    Quantity a column header's number measures, read from the unit right
+    after the number ("2000 ft", "-40°C") or the prefix before it ("PA_1000").
+    """
+    match = NUMBER.search(header)
+    if not match:
+        return None
+    suffix = re.sub(r"\(.*?\)", "", header[match.end():]).strip()
+    prefix = header[:match.start()].strip()
+    return (suffix and header_kind(suffix)) or (prefix and header_kind(prefix)) or None
+
+
+def axis_scale(header):
+    """Factor from query units to axis units (e.g. "PRESSURE_ALTITUDE_1000FT" → 1/1000)."""
+    t = header.lower().replace(" ", "").replace("_", "")
+    if header_kind(header) == "altitude" and "1000ft" in t:
+        return 1 / 1000
+    return 1.0
+
+
+# Column quantities the headers do not spell out
+COLUMN_KINDS = {
+    "landing_field_limit_weight.csv": "altitude",
+    "takeoff_field_climb_limit_sea_level_dry.csv": "temperature",
+    "landing_field_limit_wind_corrected.csv": "wind",
+    "wind_corrections_dry_runway.csv": "wind",
+    "take_off_climb_limit_wind_corrections.csv": "wind",
+    "slope_corrections_dry_runway.csv": "slope",
+    "takeoff_climb_limit_slope_corrections.csv": "slope",
+}
+
+
+# Conditions a table holds fixed, from its file name ("_3000ft", "_isa15",
+# "_76cu", "_flaps5", "_wet_runway") or, where the name does not say, its
+# title or description (tables.json). Each is an inclusive (low, high)
+# range of the query value it is valid for; flaps up is flaps 0.
+FLAPS_5 = (5.0, 5.0)
+TABLE_CONDITIONS = {
+    "takeoff_field_climb_limit_2000ft.csv": {"surface": "wet", "flaps": FLAPS_5},
+    "takeoff_field_climb_limit_3000ft.csv": {"surface": "wet", "flaps": FLAPS_5},
+    "takeoff_field_climb_limit_wet_runway_sea_level.csv": {"flaps": FLAPS_5},
+    "takeoff_field_climb_limit_wet_runway_1000ft.csv": {"flaps": FLAPS_5},
+    "takeoff_field_climb_limit_sea_level_dry.csv": {"flaps": FLAPS_5},
+    "takeoff_field_climb_limit_dry_1000ft.csv": {"flaps": FLAPS_5},
+    "takeoff_field_climb_limit_dry_2000ft.csv": {"flaps": FLAPS_5},
+    "obstacle_limit_reference.csv": {"flaps": FLAPS_5},
+    "obstacle_limit_oat_adjust.csv": {"flaps": FLAPS_5},
+    "quick_turnaround_limit_weight.csv": {"flaps": (40.0, 40.0)},
+    "go_around_climb_gradient.csv": {"flaps": (15.0, 15.0)},
+    "landing_field_limit_wind_corrected.csv": {"flaps": (40.0, 40.0)},
+    "crew_oxygen_114cu.csv": {"cylinder": (114.0, 115.0)},
+    "long_range_cruise_moa_isa10.csv": {"isa": (float("-inf"), 10.0)},
+    "takeoff_obstacle_limit_weight_flaps5.csv": {
+        "altitude": (0.0, 0.0),
+        "temperature": (float("-inf"), 30.0),
+    },
+}
+
+
+def table_conditions(name):
+    """
+    Fixed conditions of a table: ({kind: (low, high)}, runway surface or None).
+
+    e.g. "takeoff_field_climb_limit_dry_2000ft.csv" → ({"altitude": (2000, 2000)}, "dry")
+    """
+    stem = Path(name).stem.lower()
+    words = set(stem.split("_"))
+    conditions = {}
+    match = re.search(r"(?:^|_)(\d+)ft(?:_|$)", stem)
+    if match:
+        conditions["altitude"] = (float(match.group(1)),) * 2
+    elif "sea_level" in stem:
+        conditions["altitude"] = (0.0, 0.0)
+    match = re.search(r"(?:^|_)isa(\d+)(?:_|$)", stem)
+    if match:
+        conditions["isa"] = (float(match.group(1)),) * 2
+    match = re.search(r"(?:^|_)(\d+)cu(?:_|$)", stem)
+    if match:
+        conditions["cylinder"] = (float(match.group(1)),) * 2
+    match = re.search(r"(?:^|_)flaps_?(\d+|up)(?:_|$)", stem)
+    if match:
+        conditions["flaps"] = (0.0 if match.group(1) == "up" else float(match.group(1)),) * 2
+    surface = "wet" if "wet" in words else "dry" if "dry" in words else None
+
+    override = dict(TABLE_CONDITIONS.get(name, {}))
+    surface = override.pop("surface", surface)
+    conditions.update(override)
+    return conditions, surface
+
+
+# ======================================================================
+# ------------------------- QUANTITIES IN QUERIES -----------------------
+# ======================================================================
+
+def _int(text):
+    return float(text.replace(",", ""))
+
+
+def extract_quantities(query):
+    """
+    Numbers with units in a question, by kind. Weights are returned in
+    1000 kg (the tables' unit), winds signed (tailwind < 0).
+
+    e.g. "at 30°C and 2000 ft" → {"temperature": 30.0, "altitude": 2000.0}
+    """
+    q = query.lower()
+    found = {}
+
+    def first(kind, pattern, convert=_int):
+        if kind in found:
+            return
+        match = re.search(pattern, q)
+        if match:
+            found[kind] = convert(match)
+
+    first("temperature", r"(-?\d+(?:\.\d+)?)\s*(?:°\s*c\b|degrees?\s*(?:c\b|celsius)|deg\s*c\b|c\b)",
+          lambda m: float(m.group(1)))
+    first("isa", r"isa\s*\+\s*(\d+)", lambda m: float(m.group(1)))
+    first("altitude", r"(\d{1,3}(?:,\d{3})+|\d+)\s*(?:ft|feet|foot)\b", lambda m: _int(m.group(1)))
+    if "sea level" in q:
+        found.setdefault("altitude", 0.0)
+    first("weight", r"(\d+(?:\.\d+)?)\s*(?:t|tonnes?|tons?)\b", lambda m: float(m.group(1)))
+    first("weight", r"(\d{1,3}(?:,\d{3})+|\d+)\s*kg\b", lambda m: _int(m.group(1)) / 1000)
+    first("distance", r"(\d{1,3}(?:,\d{3})+|\d+)\s*(?:nm|nautical miles?)\b", lambda m: _int(m.group(1)))
+    first("field_length", r"(\d{1,3}(?:,\d{3})+|\d+)\s*(?:m|meters?|metres?)\b", lambda m: _int(m.group(1)))
+    first("wind", r"(\d+)\s*(?:kts?|knots?)\s*(?:of\s*)?(head|tail)\s*-?wind",
+          lambda m: float(m.group(1)) * (-1 if m.group(2) == "tail" else 1))
+    first("wind", r"(head|tail)\s*-?wind\s*(?:of\s*)?(\d+)",
+          lambda m: float(m.group(2)) * (-1 if m.group(1) == "tail" else 1))
+    if re.search(r"\b(no|zero|calm) wind", q):
+        found.setdefault("wind", 0.0)
+    first("slope", r"(\d+(?:\.\d+)?)\s*%\s*(up|down)hill",
+          lambda m: float(m.group(1)) * (-1 if m.group(2) == "down" else 1))
+    first("crew", r"(\d+)\s*(?:crew|crew members|pilots)\b", lambda m: float(m.group(1)))
+    first("crew", r"crew of (\d+)", lambda m: float(m.group(1)))
+    first("cylinder", r"(\d+)\s*(?:/\s*\d+\s*)?cu\b", lambda m: float(m.group(1)))
+    first("flaps", r"\bflaps?\s*(\d+|up)\b", lambda m: 0.0 if m.group(1) == "up" else float(m.group(1)))
+    return found
+
+
+def runway_surface(query):
+    """"wet" / "dry" if the question names the runway condition, else None."""
+    words = set(re.findall(r"[a-z]+", query.lower()))
+    if "wet" in words and "dry" not in words:
+        return "wet"
+    if "dry" in words and "wet" not in words:
+        return "dry"
+    return None
+
+
+# ======================================================================
+# ------------------------------- LOOKUP --------------------------------
+# ======================================================================
+
+class LookupResult(NamedTuple):
+    table: str
+    value: float
+    method: str              # "exact" | "interpolated"
+    row: tuple               # (axis header, requested value)
+    column: tuple            # (axis header, requested value)
+    cells: list              # [(row label, column label, cell value, weight)]
+
+    def render(self):
+        """Short provenance block for the LLM context."""
+        lines = [
+            f"Table: {self.table}",
+            f"{self.row[0]} = {self.row[1]:g}; {self.column[0]} = {self.column[1]:g}",
+            f"Value: {self.value:.4g} ({self.method})",
+            "From cells:",
+        ]
+        for row_label, column_label, cell, weight in self.cells:
+            lines.append(f"  row {row_label!r}, column {column_label!r}: {cell:g} (weight {weight:.3g})")
+        return "\n".join(lines)
+
+
+def bracket(keys, x):
+    """
+    [(index, weight)] for linear interpolation of `x` along `keys`
+    (any order, NaN keys ignored): one exact match, or the nearest key
+    on each side. None if `x` is outside the axis.
+    """
+    finite = np.flatnonzero(~np.isnan(keys))
+    exact = finite[keys[finite] == x]
+    if len(exact):
+        return [(int(exact[0]), 1.0)]
+
+    below = finite[keys[finite] < x]
+    above = finite[keys[finite] > x]
+    if not len(below) or not len(above):
+        return None
+    lo = below[np.argmax(keys[below])]
+    hi = above[np.argmin(keys[above])]
+    t = (x - keys[lo]) / (keys[hi] - keys[lo])
+    return [(int(lo), 1.0 - t), (int(hi), t)]
+
+
+class LookupTable:
+    """
+    One CSV as typed arrays: the first column is the row axis, the other
+    columns with a number in their header form the column axis.
+
+      row_keys / col_keys — axis values as float64 (NaN = not numeric)
+      values              — float64 grid, NaN where the cell is blank
+    """
+
+    def __init__(self, name, headers, rows):
+        self.name = name
+        self.headers = headers
+        self.row_header = headers[0]
+        self.row_labels = [row[0] for row in rows]
+        self.row_keys = np.array([parse_number(label) for label in self.row_labels])
+        self.row_kind = header_kind(self.row_header)
+        self.row_scale = axis_scale(self.row_header)
+
+        self.col_labels = headers[1:]
+        self.col_keys = np.array([parse_number(label) for label in self.col_labels])
+        self.col_kinds = [COLUMN_KINDS.get(name) or column_kind(label) for label in self.col_labels]
+        self.conditions, self.surface = table_conditions(name)
+
+        self.raw = [row[1:] + [""] * (len(headers) - len(row)) for row in rows]
+        self.values = np.array(
+            [[parse_cell(cell) for cell in row[:len(self.col_labels)]] for row in self.raw],
+            dtype=np.float64,
+        ).reshape(len(rows), len(self.col_labels))
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            headers = [h.strip() for h in next(reader)]
+            rows = [[cell.strip() for cell in row] for row in reader if any(c.strip() for c in row)]
+        return cls(Path(path).name, headers, rows)
+
+    def lookup(self, row, column, columns=None):
+        """
+        Value at row-axis value `row` and column-axis value `column`,
+        bilinearly interpolated between the neighbouring cells.
+
+        Args:
+            columns: optional list of column indices to choose from
+                (e.g. only the "WET" columns)
+
+        Returns:
+            LookupResult, or None if the point is outside the table or
+            a needed cell is blank
+        """
+        columns = np.arange(len(self.col_labels)) if columns is None else np.asarray(columns)
+        row_part = bracket(self.row_keys, row)
+        col_part = bracket(self.col_keys[columns], column)
+        if row_part is None or col_part is None:
+            return None
+
+        cells = []
+        value = 0.0
+        for r, rw in row_part:
+            for c, cw in col_part:
+                c = int(columns[c])
+                cell = self.values[r, c]
+                if np.isnan(cell):
+                    return None
+                cells.append((self.row_labels[r], self.col_labels[c], float(cell), rw * cw))
+                value += rw * cw * cell
+
+        exact = len(row_part) == 1 and len(col_part) == 1
+        return LookupResult(
+            table=self.name,
+            value=float(value),
+            method="exact" if exact else "interpolated",
+            row=(self.row_header, float(row)),
+            column=(self.column_axis_name(columns), float(column)),
+            cells=cells,
+        )
+
+    def column_axis_name(self, columns):
+        kinds = {self.col_kinds[int(c)] for c in columns}
+        kind = kinds.pop() if len(kinds) == 1 else None
+        return kind or "column"
+
+    def query_columns(self, kind, query):
+        """
+        Indices of the numeric columns of `kind`. When several columns
+        share a value (e.g. "1000_DRY" / "1000_WET"), the words of the
+        query pick between them; None if it stays ambiguous.
+        """
+        candidates = [
+            i for i, k in enumerate(self.col_kinds)
+            if k == kind and not np.isnan(self.col_keys[i])
+        ]
+        keys = self.col_keys[candidates]
+        if len(set(keys.tolist())) == len(candidates):
+            return candidates
+
+        words = set(re.findall(r"[a-z]+", query.lower()))
+        chosen = [
+            i for i in candidates
+            if set(re.findall(r"[a-z]+", self.col_labels[i].lower())) & words
+        ]
+        if chosen and len(set(self.col_keys[chosen].tolist())) == len(chosen):
+            return chosen
+        return None
+
+    def lookup_query(self, query):
+        """
+        Look up the cell a question asks for, using the numbers with
+        units found in it (see extract_quantities). None if the question
+        does not give a value for both axes, gives a quantity the lookup
+        would ignore (e.g. a wind on a table without a wind axis), or
+        contradicts a condition the table is for (e.g. 2000 ft on the
+        3000 ft table, flaps 15 on a Flaps 40 table, a wet runway on a
+        dry-runway table) — the caller
+        then falls back to the full table.
+        """
+        quantities = extract_quantities(query)
+        kinds = {k for k in self.col_kinds if k}
+        if self.row_kind not in quantities or len(kinds) != 1:
+            return None
+        col_kind = kinds.pop()
+        if col_kind == self.row_kind or col_kind not in quantities:
+            return None
+
+        for kind, (low, high) in self.conditions.items():
+            if kind in quantities and not low <= quantities[kind] <= high:
+                return None
+        surface = runway_surface(query)
+        if surface and self.surface and surface != self.surface:
+            return None
+        if set(quantities) - {self.row_kind, col_kind} - set(self.conditions):
+            return None
+
+        columns = self.query_columns(col_kind, query)
+        if not columns:
+            return None
+        return self.lookup(quantities[self.row_kind] * self.row_scale, quantities[col_kind], columns)
+
+
+class TableLookupEngine:
+    """
+    Lookup tables keyed by csv_path (as stored in tables.json), loaded
+    once and reloaded only when the CSV's mtime changes — like
+    utils.TableCache, but holding arrays instead of renderings.
+    """
+
+    def __init__(self, base_dir=PROJECT_DIR):
+        self.base_dir = Path(base_dir)
+        self._tables = {}   # csv_path -> (mtime_ns, LookupTable)
+
+    def get(self, csv_path):
+        """The LookupTable for `csv_path`, or None if the CSV does not exist."""
+        path = self.base_dir / csv_path
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+        entry = self._tables.get(csv_path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+
+        table = LookupTable.from_csv(path)
+        self._tables[csv_path] = (mtime, table)
+        return table
+
+    def preload(self, directory=PERFORMANCE_TABLE_DIR):
+        """Load every CSV in `directory`; returns how many were loaded."""
+        loaded = 0
+        for path in sorted((self.base_dir / directory).glob("*.csv")):
+            csv_path = path.relative_to(self.base_dir).as_posix()
+            try:
+                self.get(csv_path)
+                loaded += 1
+            except Exception:
+                print("There was an error loading the lookup table", csv_path)
+        return loaded
+
+    def lookup_query(self, csv_path, query):
+        """
+        LookupResult for `query` in a performance-dispatch table, or None
+        (other tables, or the question does not pin down a cell).
+        """
+        if not csv_path.startswith(PERFORMANCE_TABLE_DIR):
+            return None
+        table = self.get(csv_path)
+        if table is None:
+            return None
+        return table.lookup_query(query)
+
+
+lookup_engine = TableLookupEngine()
+
+
+def preload_lookup_tables():
+    """Load the performance-dispatch tables into the shared engine."""
+    loaded = lookup_engine.preload()
+    print(f"Loaded {loaded} performance tables for lookups")
+    return lookup_engine
+
+
+# ======================================================================
+# ----------------------------- SELF-CHECK ------------------------------
+# ======================================================================
+# python table_lookup.py
+#
+# Checks every table against its CSV: each numeric cell must come back
+# exactly from lookup(row, column), and every midpoint between two
+# neighbouring cells must lie between them.
+
+def self_check():
+    engine = TableLookupEngine()
+    engine.preload()
+    exact_checks = midpoint_checks = 0
+
+    for csv_path, (_, table) in sorted(engine._tables.items()):
+        for r, row_label in enumerate(table.row_labels):
+            for c, column_label in enumerate(table.col_labels):
+                cell = parse_cell(table.raw[r][c])
+                row_key, col_key = table.row_keys[r], table.col_keys[c]
+                if np.isnan(cell) or np.isnan(row_key) or np.isnan(col_key):
+                    continue
+                # Duplicate keys on an axis (e.g. FUEL_29 / TIME_29) need a column subset
+                same = np.flatnonzero(table.col_keys == col_key)
+                columns = [c] if len(same) > 1 else None
+                if np.count_nonzero(table.row_keys == row_key) > 1:
+                    continue
+                result = table.lookup(row_key, col_key, columns)
+                assert result is not None and result.value == cell, (csv_path, row_label, column_label)
+                assert result.cells == [(row_label, column_label, cell, 1.0)], (csv_path, row_label)
+                exact_checks += 1
+
+                if r + 1 < len(table.row_labels) and not np.isnan(table.row_keys[r + 1]):
+                    below = table.values[r + 1, c]
+                    middle = (row_key + table.row_keys[r + 1]) / 2
+                    if np.isnan(below) or np.count_nonzero(table.row_keys == middle):
+                        continue
+                    result = table.lookup(middle, col_key, columns)
+                    if result is not None:
+                        low, high = sorted((cell, below))
+                        assert low - 1e-9 <= result.value <= high + 1e-9, (csv_path, row_label)
+                        midpoint_checks += 1
+
+    examples = [
+        ("tables/performance_dispatch/quick_turnaround_limit_weight.csv",
+         "Quick turnaround limit weight at 30°C and 2000 ft, flaps 40?", 71.8),
+        ("tables/performance_dispatch/quick_turnaround_limit_weight.csv",
+         "Quick turnaround limit weight at 35°C and 2500 ft?", (71.8 + 70.4 + 70.6 + 69.3) / 4),
+        ("tables/performance_dispatch/crew_oxygen_76cu.csv",
+         "Minimum oxygen pressure for 3 crew at 40°C, 76 cu ft cylinder", 1020),
+        ("tables/performance_dispatch/landing_field_limit_weight.csv",
+         "Landing field limit weight for 1400 m wet runway at 1000 ft", 47.0),
+        ("tables/performance_dispatch/takeoff_field_climb_limit_3000ft_dry.csv",
+         "Takeoff field limit weight, dry runway at 3000 ft, 1400 m field length, 30°C", 50.1),
+    ]
+    for csv_path, query, expected in examples:
+        result = engine.lookup_query(csv_path, query)
+        assert result is not None and abs(result.value - expected) < 1e-9, (query, result)
+
+    # Questions the lookup must leave to the full table
+    refused = [
+        ("tables/performance_dispatch/takeoff_field_climb_limit_3000ft_dry.csv",
+         "Takeoff field limit weight at 2000 ft, 1400 m field length, 30°C"),
+        ("tables/performance_dispatch/takeoff_field_climb_limit_3000ft_dry.csv",
+         "Takeoff field limit weight on a wet runway, 1400 m field length, 30°C"),
+        ("tables/performance_dispatch/crew_oxygen_76cu.csv",
+         "Minimum oxygen pressure for 3 crew at 40°C, 114 cu ft cylinder"),
+        ("tables/performance_dispatch/quick_turnaround_limit_weight.csv",
+         "Quick turnaround limit weight at 30°C and 2000 ft with 10 kts tailwind?"),
+        ("tables/performance_dispatch/takeoff_field_climb_limit_wet_runway_sea_level.csv",
+         "Takeoff field limit weight at sea level, 1600 m wet runway, 30°C, 2% uphill slope"),
+        ("tables/performance_dispatch/quick_turnaround_limit_weight.csv",
+         "Quick turnaround limit weight at 30°C and 2000 ft, flaps 15"),
+    ]
+    for csv_path, query in refused:
+        result = engine.lookup_query(csv_path, query)
+        assert result is None, (query, result)
+
+    print(f"{len(engine._tables)} tables: {exact_checks} exact cells and "
+          f"{midpoint_checks} midpoints checked, {len(examples)} question lookups OK, "
+          f"{len(refused)} mismatched questions refused")
+    print()
+    print(engine.lookup_query(*examples[1][:2]).render())
+
+
+if __name__ == "__main__":
+    self_check()
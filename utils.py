@@ -1,6 +1,9 @@
 import re
-import pandas as pd
-import os
+import json
+from pathlib import Path
+
+# Folder this file lives in; table CSV paths are relative to it
+PROJECT_DIR = Path(__file__).resolve().parent
 
 def clean_tokenize(text):
     """
@@ -46,33 +49,85 @@ def count_keyword_matches(query_text, title_text):
 
 
 
-def convert_tables_to_html(docs):
-    """
-    For each document marked as a table, load its CSV file and
-    append an HTML representation of the table to the page content.
+# Table renderings the LLM can be given, and the tag placed before each
+TABLE_FORMATS = {
+    "html": ("TABLE_HTML", lambda df: df.to_html(index=False)),
+    "markdown": ("TABLE_MARKDOWN", lambda df: df.to_markdown(index=False)),
+    "tsv": ("TABLE_TSV", lambda df: df.to_csv(sep="\t", index=False)),
+}
 
-    Args:
-        docs (list[Document])
 
-    Returns:
-        list[Document]: processed documents
+class TableCache:
     """
-    processed_docs = []
+    In-memory map of rendered tables keyed by (csv_path, format).
 
-    for doc in docs:
-        is_table = doc.metadata.get("type") == "table"
-        csv_path = doc.metadata.get("csv_path")
+    A table is parsed with pandas only the first time it is requested
+    (or preloaded) and again whenever its CSV's mtime changes.
+    Relative csv paths resolve against the project folder, not the cwd.
+    """
 
-        if is_table and csv_path and os.path.exists(csv_path):
+    def __init__(self, fmt="html", base_dir=PROJECT_DIR):
+        if fmt not in TABLE_FORMATS:
+            raise ValueError(f"Unknown table format {fmt!r}, expected one of {list(TABLE_FORMATS)}")
+        self.fmt = fmt
+        self.base_dir = Path(base_dir)
+        self._entries = {}   # (csv_path, fmt) -> (mtime_ns, rendered)
+
+    def resolve(self, csv_path):
+        return self.base_dir / csv_path
+
+    def get(self, csv_path, fmt=None):
+        """
+        Return the rendered table, or None if the CSV does not exist.
+        Raises whatever pandas raises for an unparsable CSV.
+        """
+        fmt = fmt or self.fmt
+        path = self.resolve(csv_path)
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+        entry = self._entries.get((csv_path, fmt))
+        if entry and entry[0] == mtime:
+            return entry[1]
+
+        import pandas as pd
+
+        _, render = TABLE_FORMATS[fmt]
+        rendered = render(pd.read_csv(path))
+        self._entries[(csv_path, fmt)] = (mtime, rendered)
+        return rendered
+
+    def preload(self, csv_paths):
+        """Render every table up front; returns how many were loaded."""
+        loaded = 0
+        for csv_path in csv_paths:
             try:
-                df = pd.read_csv(csv_path)
-                html_table = df.to_html(index=False)
-                doc.page_content += f"\n\n[TABLE_HTML]\n{html_table}"
+                if self.get(csv_path) is not None:
+                    loaded += 1
             except Exception:
-                print("There was an error parsing the content of the table to html for table",csv_path)
-                pass
+                print("There was an error parsing the content of the table for table", csv_path)
+        return loaded
+
 
-        processed_docs.append(doc)
+table_cache = TableCache()
+
+
+def preload_tables(fmt="html", tables_json=PROJECT_DIR / "tables.json"):
+    """
+    Replace the shared table cache with one using `fmt` and render
+    every table referenced in tables.json.
+
+    Returns:
+        TableCache
+    """
+    global table_cache
 
-    return processed_docs
+    with open(tables_json, "r", encoding="utf-8") as f:
+        csv_paths = {obj["csv_path"] for obj in json.load(f) if obj.get("csv_path")}
 
+    table_cache = TableCache(fmt)
+    loaded = table_cache.preload(sorted(csv_paths))
+    print(f"Preloaded {loaded} tables as {fmt}")
+    return table_cache
@@ -0,0 +1,450 @@
+import argparse
+import json
+import math
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+
+from embeddings import read_index_version
+from router import chroma_where
+
+# Exported next to the Chroma files in PERSIST_DIR
+NUMPY_STORE_DIR = "numpy_store"
+
+VECTOR_STORES = ("chroma", "mmap", "numpy")
+
+
+# ======================================================================
+# ------------------------------ INTERFACE ------------------------------
+# ======================================================================
+
+class VectorStore:
+    """
+    What retrieval.py needs from a vector store:
+
+      embeddings                             — embed_query / embed_documents
+      search(embedding, k, filters)          → list[(Document, relevance)]
+      search_batch(embeddings, k, filters)   → one such list per embedding
+      similarity_search_with_relevance_scores(query, k, filters)
+
+    Relevance scores are the ones LangChain's Chroma wrapper returns, so
+    every store feeds the re-ranker the same numbers. `filters` is the
+    dict built by router.py (type, chapter, page_from, page_to).
+    """
+
+    embeddings = None
+
+    def search_batch(self, embeddings, k=25, filters=None):
+        raise NotImplementedError
+
+    def search(self, embedding, k=25, filters=None):
+        return self.search_batch([embedding], k, filters)[0]
+
+    def similarity_search_with_relevance_scores(self, query, k=4, filters=None):
+        """Embed `query` and search (same signature as Chroma's, with filters)."""
+        return self.search(self.embeddings.embed_query(query), k, filters)
+
+    def close(self):
+        """Release open files, so the store's folder can be deleted."""
+
+
+class ChromaStore(VectorStore):
+    """The persistent Chroma store from embeddings.load_vector_db (HNSW, approximate)."""
+
+    def __init__(self, vectordb):
+        self.vectordb = vectordb
+
+    @property
+    def embeddings(self):
+        return self.vectordb.embeddings
+
+    def close(self):
+        # chromadb shares one system per path between clients; stop this
+        # one and drop it from the cache, or its files stay open
+        client = self.vectordb._client
+        system = client._system
+        for identifier, cached in list(client._identifier_to_system.items()):
+            if cached is system:
+                del client._identifier_to_system[identifier]
+        system.stop()
+
+    def search(self, embedding, k=25, filters=None):
+        # Filters are pushed down into the Chroma query
+        relevance = self.vectordb._select_relevance_score_fn()
+        return [
+            (doc, relevance(distance))
+            for doc, distance in self.vectordb.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=chroma_where(filters)
+            )
+        ]
+
+    def search_batch(self, embeddings, k=25, filters=None):
+        # One Chroma query for every embedding
+        raw = self.vectordb._collection.query(
+            query_embeddings=embeddings,
+            n_results=k,
+            where=chroma_where(filters),
+            include=["documents", "metadatas", "distances"],
+        )
+        relevance = self.vectordb._select_relevance_score_fn()
+
+        return [
+            [
+                (Document(page_content=text, metadata=metadata or {}, id=doc_id), relevance(distance))
+                for text, metadata, doc_id, distance in zip(
+                    raw["documents"][i], raw["metadatas"][i], raw["ids"][i], raw["distances"][i]
+                )
+            ]
+            for i in range(len(embeddings))
+        ]
+
+
+def as_vector_store(vectordb):
+    """Wrap a LangChain Chroma instance; VectorStores are returned as they are."""
+    return vectordb if isinstance(vectordb, VectorStore) else ChromaStore(vectordb)
+
+
+# ======================================================================
+# ---------------------------- EXACT SEARCH -----------------------------
+# ======================================================================
+
+# Distance → relevance, as LangChain's Chroma wrapper converts them
+RELEVANCE_FUNCTIONS = {
+    "l2": lambda distance: 1.0 - distance / math.sqrt(2),
+    "cosine": lambda distance: 1.0 - distance,
+    "ip": lambda distance: 1.0 - distance if distance > 0 else -1.0 * distance,
+}
+
+
+class ExactSearchStore(VectorStore):
+    """
+    Brute-force search over a matrix of chunk embeddings: one matrix
+    product per batch of queries, then `argpartition` for the top k.
+    Exact, and for a few thousand chunks faster than an HNSW lookup.
+
+    Subclasses load `manifest`, `_vectors`, `_sq_norms`, `_types`,
+    `_chapters` and `_pages` and implement `document(row)`.
+    """
+
+    def _init_search(self):
+        self.distance = self.manifest["distance"]
+        self.relevance = RELEVANCE_FUNCTIONS[self.distance]
+
+    @property
+    def index_version(self):
+        return self.manifest.get("index_version")
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    def document(self, row):
+        raise NotImplementedError
+
+    # --------------------------------------------------------
+    # Filters
+    # --------------------------------------------------------
+    def filter_mask(self, filters):
+        """Boolean mask of the chunks passing `filters` (see router.chroma_where)."""
+        mask = np.ones(len(self), dtype=bool)
+        if not filters:
+            return mask
+
+        for key, codes in (("type", self._types), ("chapter", self._chapters)):
+            if key in filters:
+                vocab = self.manifest[key + "s"]
+                if filters[key] not in vocab:
+                    return np.zeros(len(self), dtype=bool)
+                mask &= codes == vocab.index(filters[key])
+
+        # NaN pages compare False, so chunks without a page are excluded
+        if "page_from" in filters:
+            mask &= self._pages >= filters["page_from"]
+        if "page_to" in filters:
+            mask &= self._pages <= filters["page_to"]
+        return mask
+
+    # --------------------------------------------------------
+    # Search
+    # --------------------------------------------------------
+    def _distances(self, queries, rows=None):
+        """Distances (as Chroma computes them) from each query to each row."""
+        vectors = self._vectors if rows is None else self._vectors[rows]
+        dots = queries @ vectors.T
+
+        if self.distance == "ip":
+            return 1.0 - dots
+        if self.distance == "cosine":
+            sq_norms = self._sq_norms if rows is None else self._sq_norms[rows]
+            norms = np.sqrt(sq_norms) * np.linalg.norm(queries, axis=1, keepdims=True)
+            return 1.0 - dots / np.maximum(norms, 1e-12)
+
+        # Squared L2, like hnswlib's "l2" space
+        sq_norms = self._sq_norms if rows is None else self._sq_norms[rows]
+        query_sq = np.einsum("ij,ij->i", queries, queries)[:, None]
+        return np.maximum(query_sq + sq_norms - 2.0 * dots, 0.0)
+
+    def search_batch(self, embeddings, k=25, filters=None):
+        """
+        Exact top-k for several query embeddings at once.
+
+        Returns:
+            list[list[(Document, float)]] — relevance scores, best first
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.manifest["dim"])
+        mask = self.filter_mask(filters)
+        rows = None if mask.all() else np.flatnonzero(mask)
+        n_rows = len(self) if rows is None else len(rows)
+        if not n_rows or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        distances = self._distances(queries, rows)
+        k = min(k, n_rows)
+
+        all_results = []
+        for query_distances in distances:
+            top = np.argpartition(query_distances, k - 1)[:k]
+            top = top[np.argsort(query_distances[top], kind="stable")]
+            all_results.append([
+                (self.document(int(top_row if rows is None else rows[top_row])),
+                 self.relevance(float(query_distances[top_row])))
+                for top_row in top
+            ])
+        return all_results
+
+
+# ======================================================================
+# ------------------------------- EXPORT --------------------------------
+# ======================================================================
+
+def _codes(values):
+    """Values → (int8 codes, vocabulary); None becomes -1."""
+    vocab = sorted({v for v in values if v is not None})
+    index = {v: i for i, v in enumerate(vocab)}
+    codes = np.array([index.get(v, -1) for v in values], dtype=np.int8)
+    return codes, vocab
+
+
+def read_collection(vectordb, index_version=None):
+    """
+    Everything an exact-search store needs from a Chroma store, in
+    Chroma's order: ids, texts, metadatas, float32 vectors, the filter
+    columns (types, chapters, pages) and the manifest.
+    """
+    data = vectordb.get(include=["embeddings", "documents", "metadatas"])
+    metadatas = [meta or {} for meta in data["metadatas"]]
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    if not len(data["ids"]):
+        vectors = vectors.reshape(0, 0)
+
+    types, type_vocab = _codes([m.get("type") for m in metadatas])
+    chapters, chapter_vocab = _codes([m.get("chapter") for m in metadatas])
+    pages = np.array(
+        [m["page_number"] if m.get("page_number") is not None else np.nan for m in metadatas],
+        dtype=np.float32,
+    )
+
+    return {
+        "ids": data["ids"],
+        "texts": data["documents"],
+        "metadatas": metadatas,
+        "vectors": vectors,
+        "types": types,
+        "chapters": chapters,
+        "pages": pages,
+        "manifest": {
+            "count": len(data["ids"]),
+            "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            "distance": (vectordb._collection.metadata or {}).get("hnsw:space", "l2"),
+            "index_version": index_version,
+            "types": type_vocab,
+            "chapters": chapter_vocab,
+        },
+    }
+
+
+def replace_dir(tmp_dir, out_dir):
+    """Swap a freshly written `tmp_dir` in for `out_dir`."""
+    old_dir = out_dir.with_name(out_dir.name + ".old")
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if out_dir.exists():
+        os.replace(out_dir, old_dir)
+    os.replace(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def exported_version(out_dir):
+    """index_version recorded in an exported store's manifest (None if missing)."""
+    try:
+        manifest = json.loads((Path(out_dir) / "manifest.json").read_text(encoding="utf-8"))
+        return manifest["index_version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# ======================================================================
+# --------------------------- IN-MEMORY STORE ---------------------------
+# ======================================================================
+# Three files, read whole at startup:
+#
+#   manifest.json  — count, dim, distance, index_version, filter vocabularies
+#   arrays.npz     — uncompressed: vectors (float16), sq_norms, types,
+#                    chapters, pages (as in serving_index.py)
+#   chunks.json    — {"ids": [...], "texts": [...], "metadatas": [...]}
+#
+# float16 halves the file; the matrix is widened to float32 once at load
+# because NumPy has no BLAS kernel for float16 and a float16 product is
+# ~15x slower. Scores are computed on the float16-rounded vectors.
+
+class NumpyVectorStore(ExactSearchStore):
+    """
+    The whole store in process memory: exact search, no Chroma round
+    trip, no HNSW approximation. Meant for small corpora (this manual
+    is a few thousand chunks, a few MB of vectors).
+    """
+
+    def __init__(self, path, embeddings=None):
+        self.path = Path(path)
+        self.embeddings = embeddings
+        self.manifest = json.loads((self.path / "manifest.json").read_text(encoding="utf-8"))
+
+        with np.load(self.path / "arrays.npz") as arrays:
+            self._vectors = arrays["vectors"].astype(np.float32)
+            self._sq_norms = arrays["sq_norms"]
+            self._types = arrays["types"]
+            self._chapters = arrays["chapters"]
+            self._pages = arrays["pages"]
+
+        chunks = json.loads((self.path / "chunks.json").read_text(encoding="utf-8"))
+        self._ids = chunks["ids"]
+        self._texts = chunks["texts"]
+        self._metadatas = chunks["metadatas"]
+        self._init_search()
+
+    def document(self, row):
+        return Document(page_content=self._texts[row], metadata=dict(self._metadatas[row]), id=self._ids[row])
+
+
+def export_numpy_store(vectordb, out_dir, index_version=None):
+    """
+    Write the contents of a Chroma store in the in-memory store format.
+
+    Inputs:
+        vectordb (Chroma): the store built by build_vector_store.py
+        out_dir (str | Path): target directory
+        index_version (str | None): version marker of the store
+
+    Returns:
+        int — number of chunks exported
+    """
+    out_dir = Path(out_dir)
+    data = read_collection(vectordb, index_version)
+    vectors = data["vectors"].astype(np.float16)
+    widened = vectors.astype(np.float32)
+
+    tmp_dir = out_dir.with_name(out_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    np.savez(
+        tmp_dir / "arrays.npz",
+        vectors=vectors,
+        sq_norms=np.einsum("ij,ij->i", widened, widened).astype(np.float32),
+        types=data["types"],
+        chapters=data["chapters"],
+        pages=data["pages"],
+    )
+    chunks = {"ids": data["ids"], "texts": data["texts"], "metadatas": data["metadatas"]}
+    (tmp_dir / "chunks.json").write_text(json.dumps(chunks, ensure_ascii=False), encoding="utf-8")
+    (tmp_dir / "manifest.json").write_text(json.dumps(data["manifest"], indent=2), encoding="utf-8")
+    replace_dir(tmp_dir, out_dir)
+
+    print(f"Exported {len(data['ids'])} chunks to in-memory store {str(out_dir)!r}")
+    return len(data["ids"])
+
+
+def numpy_store_path(persist_dir):
+    return Path(persist_dir) / NUMPY_STORE_DIR
+
+
+def load_numpy_store(env, embeddings):
+    """
+    Load the in-memory store exported into PERSIST_DIR.
+
+    Inputs:
+        env (dict): must contain "PERSIST_DIR"
+        embeddings: embedding function instance (used for query embeddings)
+
+    Returns:
+        NumpyVectorStore
+    """
+    path = numpy_store_path(env["PERSIST_DIR"])
+    if not (path / "manifest.json").exists():
+        raise FileNotFoundError(
+            f"No in-memory store in {str(path)!r}; run `python vector_store.py` "
+            "or build_vector_store.py first"
+        )
+
+    store = NumpyVectorStore(path, embeddings)
+    if store.index_version != read_index_version(env["PERSIST_DIR"]):
+        print("⚠ In-memory store is older than the Chroma store; re-export it with `python vector_store.py`")
+    print(f"✔ In-memory store loaded: {len(store)} chunks from {str(path)!r}")
+    return store
+
+
+def load_vector_store(env, embeddings):
+    """
+    Open the store selected by VECTOR_STORE:
+        chroma — the Chroma store in PERSIST_DIR
+        mmap   — the memory-mapped serving index (serving_index.py)
+        numpy  — the in-memory store (NumpyVectorStore)
+
+    Returns:
+        VectorStore
+    """
+    kind = env.get("VECTOR_STORE", "chroma")
+    if kind == "mmap":
+        from serving_index import load_serving_index
+
+        return load_serving_index(env, embeddings)
+    if kind == "numpy":
+        return load_numpy_store(env, embeddings)
+    if kind != "chroma":
+        raise ValueError(f"VECTOR_STORE must be one of {VECTOR_STORES}, got {kind!r}")
+
+    from embeddings import load_vector_db
+
+    return ChromaStore(load_vector_db(env, embeddings))
+
+
+# ======================================================================
+# ---------------------------- EXAMPLE USE ------------------------------
+# ======================================================================
+#
+# build_vector_store.py exports the store after every sync. To export
+# an existing Chroma store by hand:
+#   python vector_store.py
+#
+# Then serve from memory:
+#   VECTOR_STORE=numpy uvicorn main:app
+#
+# bench_vector_store.py compares the stores on latency and recall.
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from embeddings import load_vector_db
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Export the Chroma store as an in-memory NumPy store.")
+    parser.add_argument("--persist-dir", help="Chroma directory (default: PERSIST_DIR or chroma_db)")
+    args = parser.parse_args()
+
+    persist_dir = args.persist_dir or os.environ.get("PERSIST_DIR", "chroma_db")
+    export_numpy_store(
+        load_vector_db({"PERSIST_DIR": persist_dir}, None),
+        numpy_store_path(persist_dir),
+        index_version=read_index_version(persist_dir),
+    )